@@ -1,24 +1,119 @@
-from flask import Flask, request, render_template, redirect, jsonify, Response
+from flask import (Flask, request, render_template, redirect, jsonify, Response, send_file, abort,
+                   make_response, url_for)
+from werkzeug.security import safe_join
 from flask_cors import CORS
-import time
+import atexit
+import functools
+import logging
+import os
 from datetime import datetime
-from arduino_controller import ArduinoController
-from camera_controller import CameraController
-from teammate_sender import TeammateSender
+from events import KEEPALIVE_SECONDS, RETRY_MS, format_sse, parse_last_event_id
+from rigs import Rig, RigRegistry, parse_rig_configs, load_rig_configs
+from frame_broadcaster import parse_stream_profile
+from renditions import RenditionCache
+from scan_archive import StreamingArchive, ArchiveError, scan_photos
+from scan_planning import steps_to_degrees
+import metrics
+import app_logging
+
+# 照片落盘后在后台进程中生成缩略图和中等尺寸图，供 /gallery 浏览（所有转台共用缓存）；
+# 工作进程用 fork 创建，必须在日志、串口、相机等线程启动之前启动
+renditions = RenditionCache(os.environ.get('RENDITION_CACHE', 'cache/renditions'),
+                            max_bytes=int(os.environ.get('RENDITION_CACHE_MB', '64')) * 1024 * 1024).start()
+atexit.register(renditions.close)
+
+# 日志：LOG_LEVEL 控制级别，LOG_FORMAT=json 输出JSON行
+app_logging.setup_logging(level=os.environ.get('LOG_LEVEL', 'INFO'),
+                          fmt=os.environ.get('LOG_FORMAT', 'text'))
+atexit.register(app_logging.stop_logging)
+logger = logging.getLogger('app')
 
 app = Flask(__name__)
 CORS(app)
 # 初始化控制器
-arduino = ArduinoController()
-camera = CameraController()
-teammate = TeammateSender("http://192.168.235.41:5000")
+# ADVANCE_MODEL_SIMULATE=1 时使用模拟串口和模拟相机，可在没有硬件的机器上运行
+SIMULATE = os.environ.get('ADVANCE_MODEL_SIMULATE') == '1'
+if SIMULATE:
+    from simulation import SimulatedSerial, SimulatedPicamera2
+    serial_factory = SimulatedSerial.factory(
+        motion_delay=float(os.environ.get('SIM_MOTION_DELAY', '0.2')),
+        jitter=float(os.environ.get('SIM_MOTION_JITTER', '0.02')))
+    startup_delay = 0
+    camera_factory = functools.partial(SimulatedPicamera2,
+                                       static_scene=os.environ.get('SIM_STATIC_SCENE') == '1')
+    # 模拟电机每4度耗时 SIM_MOTION_DELAY 秒
+    motor_speed = 4 / float(os.environ.get('SIM_MOTION_DELAY', '0.2'))
+else:
+    serial_factory = None
+    startup_delay = 2
+    camera_factory = None
+    motor_speed = float(os.environ.get('MOTOR_SPEED', '20'))
+# 照片在内存中直接上传，同时在后台批量保存到照片目录
+# 转台：RIGS_CONFIG 指定多转台配置文件（JSON），每台有自己的串口、相机、队友地址和扫描工作线程；
+# 未指定时只有一台，使用 ARDUINO_PORT（默认 /dev/ttyACM0）、相机0、photos/ 和 checkpoints/
+# 发送失败的照片和状态消息写入待发队列（SQLite），队友恢复后自动重发（重启后继续）
+if os.environ.get('RIGS_CONFIG'):
+    rig_configs = load_rig_configs(os.environ['RIGS_CONFIG'], teammate_url=os.environ.get('TEAMMATE_URL'))
+else:
+    rig_configs = parse_rig_configs([{
+        'id': 'rig0',
+        'port': os.environ.get('ARDUINO_PORT', '/dev/ttyACM0'),
+        'camera_index': 0,
+        'teammate_url': os.environ.get('TEAMMATE_URL'),
+        'photos_dir': 'photos',
+        'checkpoint_dir': 'checkpoints',
+        'spool': os.environ.get('UPLOAD_SPOOL', 'spool/uploads.db'),
+        'job_prefix': ''
+    }])
+# 扫描任务队列，每台转台一个工作线程独占它的Arduino和相机
+# motor_speed（度/秒）只用于估算阶段3规划前后的运动时间；
+# 阶段3的角度与阶段1照片相差不超过 ANGLE_CACHE_TOLERANCE 度时复用照片（负数表示不复用）
+# 阶段1相邻照片感知哈希相差不超过 DEDUP_MAX_DISTANCE 位时只发送引用（默认-1，不抑制）
+rigs = RigRegistry()
+for rig_config in rig_configs:
+    rigs.add(Rig(rig_config, serial_factory=serial_factory, camera_factory=camera_factory,
+                 startup_delay=startup_delay, on_photo_written=renditions.submit,
+                 motor_speed=motor_speed,
+                 angle_tolerance=float(os.environ.get('ANGLE_CACHE_TOLERANCE', '1.0')),
+                 dedup_max_distance=int(os.environ.get('DEDUP_MAX_DISTANCE', '-1')),
+                 dedup_hash=os.environ.get('DEDUP_HASH', 'dhash')))
+# 相机在进程内保持常开，退出时释放
+atexit.register(rigs.close)
+
+# 不带 /rigs/<id> 前缀的接口使用默认转台（第一台）
+arduino = rigs.default.arduino
+camera = rigs.default.camera
+teammate = rigs.default.teammate
+latest_angles = rigs.default.latest_angles
+scan_jobs = rigs.default.scan_jobs
+
+def rig_route(rule, **options):
+    """注册默认转台的路由，同时注册 /rigs/<rig_id> 前缀的每台转台路由
+
+    请求中记录的指标（例如手动拍照的耗时）记到该转台带 rig 标签的注册表
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def rig_view(rig_id=None, **kwargs):
+            rig = rigs.get(rig_id) if rig_id else rigs.default
+            with metrics.scoped([rig.metrics] if rig else []):
+                return view(rig_id=rig_id, **kwargs)
+        app.route(rule, **options)(rig_view)
+        app.route(f"/rigs/<rig_id>{rule}", **options)(rig_view)
+        return rig_view
+    return decorator
+
+def get_rig(rig_id=None):
+    """路由中的转台，不存在时返回404"""
+    rig = rigs.get(rig_id) if rig_id else rigs.default
+    if rig is None:
+        abort(make_response(jsonify({'success': False, 'error': '转台不存在'}), 404))
+    return rig
 
-# 存储角度数据
-latest_angles = {
-    'angles': None,
-    'timestamp': None,
-    'status': '等待数据'
-}
+@app.route('/api/rigs')
+def list_rigs():
+    """所有转台及其状态，每台的接口为 /rigs/<id> 加上原来的路径"""
+    return jsonify({'default': rigs.default.id, 'rigs': [rig.to_dict() for rig in rigs.all()]})
 
 @app.route('/')
 def index():
@@ -29,9 +124,10 @@ def video_page():
     """视频流页面"""
     return render_template('video_stream.html')
 
-@app.route('/api/receive_angles', methods=['POST'])
-def receive_angles():
+@rig_route('/api/receive_angles', methods=['POST'])
+def receive_angles(rig_id=None):
     """接收队友发送的角度数据"""
+    rig = get_rig(rig_id)
     try:
         data = request.get_json()
         if not data or 'angles' not in data:
@@ -48,157 +144,356 @@ def receive_angles():
                 return jsonify({'success': False, 'error': f'角度{i+1}无效'})
         
         # 更新数据
-        latest_angles['angles'] = angles
-        latest_angles['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        latest_angles['status'] = '已接收角度数据'
+        rig.latest_angles['angles'] = angles
+        rig.latest_angles['timestamp'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        rig.latest_angles['status'] = '已接收角度数据'
+        # 立即唤醒等待角度的阶段2，并推送给订阅者
+        rig.events.publish('angles', dict(rig.latest_angles))
         
-        print(f"收到角度数据: {angles}")
+        logger.info(f"收到角度数据: {angles}")
         return jsonify({'success': True, 'message': '角度数据已接收'})
     
     except Exception as e:
-        print(f"处理角度数据出错: {e}")
+        logger.error(f"处理角度数据出错: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/get_status')
-def get_status():
+@rig_route('/api/get_status')
+def get_status(rig_id=None):
     """获取当前状态"""
-    return jsonify(latest_angles)
+    rig = get_rig(rig_id)
+    return jsonify(rig.latest_angles)
 
-@app.route('/start_rotation', methods=['POST'])
-def start_rotation():
-    """开始两阶段旋转：完整旋转拍照 + 角度精确旋转"""
+@rig_route('/start_rotation', methods=['POST'])
+def start_rotation(rig_id=None):
+    """提交两阶段旋转任务，立即返回任务ID
+
+    可选的扫描参数（JSON或表单）：mode、step_angle、steps、coarse_step_angle、
+    fine_step_angle、interest_threshold、fine_ranges，见 scan_planning.parse_scan_params
+    """
+    rig = get_rig(rig_id)
+    params = request.get_json(silent=True) or request.form.to_dict()
     try:
-        print("开始两阶段旋转任务...")
-        
-        # 先停止视频流（如果正在运行）
-        camera.stop_streaming()
-        time.sleep(1)  # 给一点时间停止
-        
-        if not camera.initialize_camera():
-            return "错误: 无法初始化相机"
-        
-        # 阶段1：完整旋转拍照
-        print("=== 阶段1：完整旋转拍照 ===")
-        for i in range(90):
-            rotation_number = i + 1
-            print(f"旋转 {rotation_number}/90...")
-            
-            success = arduino.send_rotate()
-            if not success:
-                camera.release_camera()
-                return f"错误: 旋转命令{rotation_number}失败"
-            
-            if not arduino.recieve_end(timeout=10):
-                camera.release_camera()
-                return f"错误: 旋转{rotation_number}未收到END信号"
-            
-            # 拍照并发送
-            photo_path = camera.take_rotation_photo(rotation_number)
-            if photo_path:
-                teammate.send_photo(photo_path, rotation_number, {
-                    'rotation_type': 'full_rotation',
-                    'progress': f"{rotation_number}/90"
-                })
-        arduino.return_start() 
-        print("=== 阶段2：等待角度数据 ===")
-        
-        # 等待角度数据
-        wait_timeout = 300  # 5分钟
-        start_time = time.time()
-        
-        while True:
-            if time.time() - start_time > wait_timeout:
-                camera.release_camera()
-                return "错误: 等待角度数据超时"
-            
-            if latest_angles['angles'] is not None:
-                angles = latest_angles['angles']
-                print(f"收到角度数据: {angles}")
-                break
-            
-            time.sleep(1)
-        
-        print("=== 阶段3：角度精确旋转 ===")
-        
-        # 角度旋转
-        for i, angle in enumerate(angles):
-            angle_number = i + 1
-            print(f"角度旋转 {angle_number}/4 ({angle}度)...")
-            
-            if not arduino.send_single_angle(angle):
-                camera.release_camera()
-                return f"错误: 发送角度{angle_number}失败"
-            
-            if not arduino.recieve_end(timeout=30):
-                camera.release_camera()
-                return f"错误: 角度{angle_number}旋转超时"
-            
-        
-        camera.release_camera()
-        print("=== 旋转任务完成 ===")
-        arduino.return_start()  
-        return "旋转任务完成"
-        
-    except Exception as e:
-        print(f"旋转任务出错: {e}")
-        camera.release_camera()
-        return f"错误: {str(e)}"
+        job = rig.scan_jobs.submit(params)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    return jsonify({
+        'success': True,
+        'job_id': job.job_id,
+        'status': job.status,
+        'queue_position': rig.scan_jobs.queue_position(job)
+    }), 202
+
+@rig_route('/api/jobs')
+def list_jobs(rig_id=None):
+    """列出最近的扫描任务"""
+    rig = get_rig(rig_id)
+    return jsonify({'jobs': [job.to_dict() for job in rig.scan_jobs.list_jobs()]})
+
+@rig_route('/api/jobs/<job_id>')
+def get_job(job_id, rig_id=None):
+    """查询扫描任务进度"""
+    rig = get_rig(rig_id)
+    job = rig.scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    data = job.to_dict()
+    data['queue_position'] = rig.scan_jobs.queue_position(job)
+    return jsonify(data)
+
+@rig_route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_job(job_id, rig_id=None):
+    """取消扫描任务"""
+    rig = get_rig(rig_id)
+    if rig.scan_jobs.get(job_id) is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    if not rig.scan_jobs.cancel(job_id):
+        return jsonify({'success': False, 'error': '任务已结束'})
+    return jsonify({'success': True, 'message': '任务已取消'})
+
+@rig_route('/api/jobs/<job_id>/resume', methods=['POST'])
+def resume_job(job_id, rig_id=None):
+    """从检查点继续执行失败、取消或中断的任务"""
+    rig = get_rig(rig_id)
+    if rig.scan_jobs.get(job_id) is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    job = rig.scan_jobs.resume(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不能继续执行'})
+    return jsonify({
+        'success': True,
+        'job_id': job.job_id,
+        'status': job.status,
+        'queue_position': rig.scan_jobs.queue_position(job)
+    }), 202
 
-@app.route('/clear_angles', methods=['POST'])
-def clear_angles():
+@rig_route('/api/jobs/<job_id>/archive')
+def export_job(job_id, rig_id=None):
+    """以TAR（默认）或ZIP边读边发扫描的全部照片和 manifest.json，支持Range续传"""
+    rig = get_rig(rig_id)
+    job = rig.scan_jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': '任务不存在'}), 404
+    if job.status != 'completed':
+        return jsonify({'success': False, 'error': '任务尚未完成'}), 409
+    fmt = request.args.get('format', 'tar')
+    try:
+        archive = StreamingArchive(fmt, f"scan_{job_id}", *scan_photos(job, rig.scan_jobs.photo_index))
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    # If-Range 与当前归档不一致（照片已变化）时返回完整归档
+    start, end, status = 0, archive.size, 200
+    if_range = request.if_range
+    if if_range.etag:
+        range_valid = if_range.etag == archive.etag
+    elif if_range.date:
+        range_valid = int(if_range.date.timestamp()) == int(archive.last_modified)
+    else:
+        range_valid = True
+    # 不支持 multipart/byteranges：请求多个区间时忽略 Range，返回完整归档；只有单个区间越界时返回416
+    if request.range and len(request.range.ranges) == 1 and range_valid:
+        byte_range = request.range.range_for_length(archive.size)
+        if byte_range is None:
+            response = Response(status=416)
+            response.content_range = f"bytes */{archive.size}"
+            return response
+        (start, end), status = byte_range, 206
+
+    def generate():
+        try:
+            yield from archive.iter_bytes(start, end)
+        except ArchiveError as e:
+            # 头部已发出，只能中断连接，客户端用 If-Range 续传时会得到新的归档
+            logger.warning(f"导出任务{job_id}中断: {e}")
+            raise
+
+    response = Response(generate(), status=status, mimetype=archive.mimetype, direct_passthrough=True)
+    response.content_length = end - start
+    if status == 206:
+        response.content_range = f"bytes {start}-{end - 1}/{archive.size}"
+    response.accept_ranges = 'bytes'
+    response.set_etag(archive.etag)
+    response.last_modified = datetime.fromtimestamp(int(archive.last_modified))
+    response.headers['Content-Disposition'] = f'attachment; filename="scan_{job_id}.{fmt}"'
+    return response
+
+@rig_route('/clear_angles', methods=['POST'])
+def clear_angles(rig_id=None):
     """清除角度数据"""
-    latest_angles['angles'] = None
-    latest_angles['timestamp'] = None
-    latest_angles['status'] = '等待数据'
+    rig = get_rig(rig_id)
+    rig.latest_angles['angles'] = None
+    rig.latest_angles['timestamp'] = None
+    rig.latest_angles['status'] = '等待数据'
+    rig.events.publish('angles', dict(rig.latest_angles))
     return "角度数据已清除"
 
-@app.route('/api/video_feed')
-def video_feed():
-    """视频流接口"""
+def sse_stream(rig, last_id):
+    """事件流：先补发错过的事件（或发送状态快照），之后有事件就推送，空闲时定期发送注释行保活"""
+    yield f"retry: {RETRY_MS}\n\n".encode()
+    events, last_id = rig.events.replay(last_id, rig.event_snapshot)
+    for event in events:
+        yield format_sse(event)
+    while True:
+        events = rig.events.wait(last_id, timeout=KEEPALIVE_SECONDS)
+        if not events:
+            yield b": keepalive\n\n"
+            continue
+        for event in events:
+            yield format_sse(event)
+        last_id = events[-1].id
+
+@rig_route('/api/events')
+def event_stream(rig_id=None):
+    """Server-Sent Events：推送任务进度（job）、收到的角度（angles）和错误（error）
+
+    新连接先收到 snapshot 事件（当前角度和任务）；断线重连时按 Last-Event-ID 补发错过的事件
+    """
+    rig = get_rig(rig_id)
+    last_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+    return Response(sse_stream(rig, last_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@rig_route('/api/events/stats')
+def event_stats(rig_id=None):
+    """事件总线状态：最新事件ID、已发布数量和订阅者数量"""
+    rig = get_rig(rig_id)
+    return jsonify(rig.events.stats())
+
+@rig_route('/api/video_feed')
+def video_feed(rig_id=None):
+    """视频流接口，可用 width/height/quality/fps 参数指定预览配置"""
+    rig = get_rig(rig_id)
     try:
-        if not camera.start_streaming():
+        if not rig.camera.start_streaming():
             return "无法启动视频流", 500
         
-        return Response(camera.generate_frames(),
+        profile = parse_stream_profile(request.args)
+        return Response(rig.camera.generate_frames(profile),
                        mimetype='multipart/x-mixed-replace; boundary=frame')
     except Exception as e:
-        print(f"视频流出错: {e}")
+        logger.error(f"视频流出错: {e}")
         return f"视频流错误: {str(e)}", 500
 
-@app.route('/api/start_stream', methods=['POST'])
-def start_stream():
+@rig_route('/api/start_stream', methods=['POST'])
+def start_stream(rig_id=None):
     """启动视频流"""
+    rig = get_rig(rig_id)
     try:
-        if camera.start_streaming():
+        if rig.camera.start_streaming():
             return jsonify({'success': True, 'message': '视频流已启动'})
         else:
             return jsonify({'success': False, 'error': '无法启动视频流'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/stop_stream', methods=['POST'])
-def stop_stream():
+@rig_route('/api/stop_stream', methods=['POST'])
+def stop_stream(rig_id=None):
     """停止视频流"""
+    rig = get_rig(rig_id)
     try:
-        camera.stop_streaming()
+        rig.camera.stop_streaming()
         return jsonify({'success': True, 'message': '视频流已停止'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
-@app.route('/api/stream_status')
-def stream_status():
+@rig_route('/api/stream_status')
+def stream_status(rig_id=None):
     """获取视频流状态"""
+    rig = get_rig(rig_id)
+    return jsonify({
+        'streaming': rig.camera.streaming,
+        'camera_initialized': rig.camera.picam2 is not None,
+        'stream_stats': rig.camera.get_stream_stats()
+    })
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus指标：转台线程上的指标带 rig 标签，其余（例如缩略图生成）不带标签"""
+    registries = [metrics.REGISTRY] + [rig.metrics for rig in rigs.all()]
+    return Response(metrics.render_prometheus(registries),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+@app.route('/api/metrics')
+def metrics_summary():
+    """指标的JSON汇总（含p50/p95/p99），rigs 中为每台转台的指标"""
+    summary = metrics.REGISTRY.summary()
+    summary['rigs'] = {rig.id: rig.metrics.summary() for rig in rigs.all()}
+    return jsonify(summary)
+
+@rig_route('/api/upload_spool')
+def upload_spool_status(rig_id=None):
+    """待发队列状态"""
+    rig = get_rig(rig_id)
+    return jsonify(rig.teammate.spool.stats())
+
+@rig_route('/api/upload_spool/retry', methods=['POST'])
+def upload_spool_retry(rig_id=None):
+    """立即重发待发队列（忽略当前退避）"""
+    rig = get_rig(rig_id)
+    rig.teammate.spool.retry_now()
+    return jsonify({'success': True, 'pending': rig.teammate.spool.pending_count()})
+
+@rig_route('/api/photo_index')
+def photo_index(rig_id=None):
+    """按角度索引的照片，可用 scan_id 参数只看某次扫描"""
+    rig = get_rig(rig_id)
+    entries = rig.scan_jobs.photo_index.entries(scan_id=request.args.get('scan_id'))
+    return jsonify(dict(rig.scan_jobs.photo_index.stats(), tolerance=rig.scan_jobs.angle_tolerance,
+                        photos=[entry._asdict() for entry in entries]))
+
+GALLERY_RENDITIONS = ('thumb', 'medium', 'full')
+
+def _photo_angle(name, indexed):
+    """照片对应的角度：优先用照片索引，其次按 rotation_XXX.jpg 的编号推算"""
+    if name in indexed:
+        return indexed[name].angle
+    if name.startswith('rotation_') and name[9:12].isdigit():
+        return steps_to_degrees(int(name[9:12])) % 360
+    return None
+
+@rig_route('/gallery')
+def gallery(rig_id=None):
+    """扫描照片浏览页面"""
+    get_rig(rig_id)
+    return render_template('gallery.html', job_id=request.args.get('job_id'),
+                           gallery_url=url_for('gallery_list', rig_id=rig_id))
+
+@rig_route('/api/gallery')
+def gallery_list(rig_id=None):
+    """照片目录中的照片列表，可用 job_id 参数只列出某次扫描的照片；支持ETag/Last-Modified条件请求"""
+    rig = get_rig(rig_id)
+    job_id = request.args.get('job_id')
+    indexed = {entry.photo_name: entry for entry in rig.scan_jobs.photo_index.entries(scan_id=job_id)}
+    photos = []
+    latest = 0
+    for name in sorted(os.listdir(rig.camera.photos_dir)):
+        if not name.lower().endswith('.jpg') or (job_id and name not in indexed):
+            continue
+        stat = os.stat(os.path.join(rig.camera.photos_dir, name))
+        latest = max(latest, stat.st_mtime)
+        # URL带上文件版本，照片不变时浏览器可以直接使用缓存
+        version = f"?v={stat.st_mtime_ns:x}"
+        photos.append({
+            'name': name,
+            'bytes': stat.st_size,
+            'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+            'angle': _photo_angle(name, indexed),
+            **{rendition: url_for('gallery_photo', rig_id=rig_id, rendition=rendition, photo_name=name) + version
+               for rendition in GALLERY_RENDITIONS}
+        })
+    response = jsonify({'photos': photos, 'job_id': job_id})
+    response.add_etag()
+    if latest:
+        response.last_modified = datetime.fromtimestamp(int(latest))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@rig_route('/gallery/<rendition>/<photo_name>')
+def gallery_photo(rendition, photo_name, rig_id=None):
+    """照片的缩略图（thumb）、中等尺寸图（medium）或原图（full）"""
+    rig = get_rig(rig_id)
+    source = safe_join(rig.camera.photos_dir, photo_name)
+    if rendition not in GALLERY_RENDITIONS or source is None or not os.path.isfile(source):
+        abort(404)
+    # 带版本参数的URL内容不会变化，可以长期缓存；否则每次向服务器确认（304）
+    max_age = 86400 if request.args.get('v') else 0
+    if rendition == 'full':
+        return send_file(os.path.abspath(source), mimetype='image/jpeg', conditional=True, max_age=max_age)
+    found = renditions.get(source, rendition)
+    if found is None:
+        abort(404)
+    path, digest = found
+    return send_file(path, mimetype='image/jpeg', conditional=True, etag=f"{digest[:32]}-{rendition}",
+                     last_modified=os.path.getmtime(source), max_age=max_age)
+
+@app.route('/api/renditions')
+def rendition_status():
+    """缩略图缓存状态"""
+    return jsonify(renditions.stats())
+
+@app.route('/api/logs')
+def recent_logs():
+    """最近的日志，可用 level/limit/logger 参数过滤"""
+    try:
+        limit = int(request.args.get('limit', 200))
+    except ValueError:
+        limit = 200
     return jsonify({
-        'streaming': camera.streaming,
-        'camera_initialized': camera.picam2 is not None
+        'logs': app_logging.get_recent_logs(level=request.args.get('level'),
+                                            limit=max(0, limit),
+                                            logger_name=request.args.get('logger')),
+        'stats': app_logging.get_logging_stats()
     })
 
-@app.route('/api/camera_status')
-def camera_status():
+@rig_route('/api/camera_status')
+def camera_status(rig_id=None):
     """获取相机状态"""
-    return jsonify(camera.get_camera_status())
+    rig = get_rig(rig_id)
+    return jsonify(rig.camera.get_camera_status())
 
 if __name__ == '__main__':
-    print("启动服务器...")
-    print("API地址: http://你的IP:5000/api/receive_angles")
+    logger.info("启动服务器...")
+    for rig in rigs.all():
+        rig.camera.initialize_camera()  # 提前预热相机
+    logger.info("API地址: http://你的IP:5000/api/receive_angles")
     app.run(host='0.0.0.0', port=5000, debug=False)
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""
+日志模块
+基于队列的非阻塞日志：业务线程只把记录放入队列，由后台线程写控制台；
+最近的日志保存在内存环形缓冲区中，供 /api/logs 查询
+"""
+
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+LOG_FORMAT_TEXT = '%(asctime)s %(levelname)s [%(threadName)s] %(name)s: %(message)s'
+
+_ring_handler = None
+_queue_handler = None
+_listener = None
+
+
+def _record_to_dict(record):
+    entry = {
+        'time': datetime.fromtimestamp(record.created).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3],
+        'level': record.levelname,
+        'logger': record.name,
+        'thread': record.threadName,
+        'message': record.getMessage()
+    }
+    data = getattr(record, 'data', None)
+    if data:
+        entry['data'] = data
+    if record.exc_info:
+        entry['exception'] = logging.Formatter().formatException(record.exc_info)
+    return entry
+
+
+class JsonFormatter(logging.Formatter):
+    """每条日志输出为一行JSON"""
+
+    def format(self, record):
+        return json.dumps(_record_to_dict(record), ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """文本格式，附带结构化字段"""
+
+    def __init__(self):
+        super().__init__(LOG_FORMAT_TEXT)
+
+    def format(self, record):
+        text = super().format(record)
+        data = getattr(record, 'data', None)
+        if data:
+            text += ' ' + ' '.join(f"{key}={value}" for key, value in data.items())
+        return text
+
+
+class RingBufferHandler(logging.Handler):
+    """把最近的日志保存在固定大小的内存缓冲区中"""
+
+    def __init__(self, capacity=1000):
+        super().__init__()
+        self.records = deque(maxlen=capacity)
+
+    def emit(self, record):
+        self.records.append(_record_to_dict(record))
+
+    def get_records(self, level=None, limit=200, logger_name=None):
+        """最近的 limit 条日志（limit 不大于0时返回空列表）"""
+        if limit <= 0:
+            return []
+        min_level = logging.getLevelName(level.upper()) if level else logging.NOTSET
+        if not isinstance(min_level, int):
+            min_level = logging.NOTSET
+        records = [
+            r for r in list(self.records)
+            if logging.getLevelName(r['level']) >= min_level
+            and (not logger_name or r['logger'].startswith(logger_name))
+        ]
+        return records[-limit:]
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志而不是阻塞业务线程"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RateLimitedLogger:
+    """热路径日志限流：同一个 key 在 interval 秒内最多输出一次，并报告被抑制的条数"""
+
+    def __init__(self, logger, interval=5.0):
+        self.logger = logger
+        self.interval = interval
+        self._last = {}
+        self._suppressed = {}
+        self._lock = threading.Lock()
+
+    def log(self, level, key, msg, *args, **kwargs):
+        now = time.monotonic()
+        with self._lock:
+            last = self._last.get(key)
+            if last is not None and now - last < self.interval:
+                self._suppressed[key] = self._suppressed.get(key, 0) + 1
+                return
+            self._last[key] = now
+            suppressed = self._suppressed.pop(key, 0)
+        if suppressed:
+            msg = f"{msg}（{self.interval:g}秒内另有{suppressed}条相同日志被省略）"
+        self.logger.log(level, msg, *args, **kwargs)
+
+    def warning(self, key, msg, *args, **kwargs):
+        self.log(logging.WARNING, key, msg, *args, **kwargs)
+
+    def error(self, key, msg, *args, **kwargs):
+        self.log(logging.ERROR, key, msg, *args, **kwargs)
+
+
+def setup_logging(level='INFO', fmt='text', ring_capacity=1000, queue_size=10000):
+    """配置根日志：QueueHandler -> 后台线程 -> 控制台 + 环形缓冲区（重复调用无副作用）"""
+    global _ring_handler, _queue_handler, _listener
+    if _listener is not None:
+        return _ring_handler
+
+    console = logging.StreamHandler()
+    console.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    _ring_handler = RingBufferHandler(ring_capacity)
+
+    log_queue = queue.Queue(queue_size)
+    _queue_handler = DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, console, _ring_handler,
+                                               respect_handler_level=True)
+    _listener.start()
+
+    root = logging.getLogger()
+    root.setLevel(level.upper() if isinstance(level, str) else level)
+    root.addHandler(_queue_handler)
+    return _ring_handler
+
+
+def stop_logging():
+    """停止后台日志线程并写出队列中剩余的日志"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def get_recent_logs(level=None, limit=200, logger_name=None):
+    """查询环形缓冲区中的最近日志"""
+    if _ring_handler is None:
+        return []
+    return _ring_handler.get_records(level, limit, logger_name)
+
+
+def get_logging_stats():
+    return {
+        'buffered': len(_ring_handler.records) if _ring_handler else 0,
+        'capacity': _ring_handler.records.maxlen if _ring_handler else 0,
+        'dropped': _queue_handler.dropped if _queue_handler else 0
+    }
@@ -5,134 +5,354 @@ Arduino控制器模块
 """
 
 import serial
+import logging
 import time
+import queue
+import threading
+from collections import deque
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 串口读取线程遇到错误时放入行队列的标记，让等待方立即返回
+_READER_ERROR = object()
+
+# 固件协议版本：1 为单字节命令（r/q/s），2 增加批量运动程序（v/p/x），
+# 3 的运动程序支持步长（每个ACK转多个基本步），4 的运动程序可以在每步后等待主机的 'c' 再继续
+LEGACY_PROTOCOL = 1
+MOTION_PROGRAM_PROTOCOL = 2
+STRIDE_PROTOCOL = 3
+HOLD_PROTOCOL = 4
 
 class ArduinoController:
-    def __init__(self):
+    def __init__(self, port="/dev/ttyACM0", baudrate=9600, serial_factory=None,
+                 startup_delay=2, unsolicited_buffer_size=200):
         self.ser = None
-        self.port = None
-        self.baudrate = 9600
+        self.port = port  # 根据实际情况修改端口
+        self.baudrate = baudrate
         self.timeout = 1
+        self.startup_delay = startup_delay
+        # 默认使用真实串口，测试时可以传入模拟串口的工厂函数
+        self.serial_factory = serial_factory or serial.Serial
+        # 串口读取线程：阻塞 readline，把收到的行放入队列
+        self._lines = queue.Queue()
+        self.unsolicited_lines = deque(maxlen=unsolicited_buffer_size)
+        self._reader_thread = None
+        self._reader_stop = threading.Event()
+        self.protocol_version = None
+        self._command_sent_at = None  # 最近一次运动命令的发送时间，用于统计往返时间
         self._connect()
     
     
     def _connect(self):
         """连接到Arduino"""
-        self.port = "/dev/ttyACM0"  # 根据实际情况修改端口  
         try:
-            self.ser = serial.Serial(self.port, self.baudrate, timeout=self.timeout)
-            print(f"成功连接到Arduino: {self.port} (波特率: {self.baudrate})")
-            time.sleep(2)  # 等待Arduino初始化
+            self.ser = self.serial_factory(self.port, self.baudrate, timeout=self.timeout)
+            logger.info(f"成功连接到Arduino: {self.port} (波特率: {self.baudrate})")
+            time.sleep(self.startup_delay)  # 等待Arduino初始化
+            self._start_reader()
         except serial.SerialException as e:
-            print(f"连接Arduino失败: {e}")
+            logger.error(f"连接Arduino失败: {e}")
             self.ser = None
+
+    def _start_reader(self):
+        """启动串口读取线程"""
+        self._reader_stop.clear()
+        self._reader_thread = threading.Thread(target=self._reader_loop, name="serial-reader", daemon=True)
+        self._reader_thread.start()
+
+    def _reader_loop(self):
+        """阻塞读取串口行，readline 在串口超时（1秒）后返回，以便检查停止标志"""
+        while not self._reader_stop.is_set():
+            try:
+                raw = self.ser.readline()
+            except Exception as e:
+                if not self._reader_stop.is_set():
+                    logger.error(f"串口读取出错: {e}")
+                    self._lines.put(_READER_ERROR)
+                return
+            if not raw:
+                continue
+            line = raw.decode('utf-8', errors='replace').strip()
+            if line:
+                self._lines.put(line)
+
+    def _record_unsolicited(self, line):
+        """记录等待END期间收到的其他信号，用于诊断"""
+        self.unsolicited_lines.append({
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'line': line
+        })
+
+    def get_unsolicited_lines(self):
+        """返回最近收到的非END信号"""
+        return list(self.unsolicited_lines)
             
     def is_connected(self):
         """检查是否已连接"""
         return self.ser is not None and self.ser.is_open
+
+    def reconnect(self):
+        """关闭并重新打开串口（串口读取线程出错或设备重新插拔后调用）"""
+        self.close()
+        self._lines = queue.Queue()
+        self._connect()
+        return self.is_connected()
+
+    def reader_alive(self):
+        """串口读取线程是否在运行"""
+        return self._reader_thread is not None and self._reader_thread.is_alive()
     
     def send_rotate(self):
         """发送旋转命令到Arduino"""
         if not self.is_connected():
-            print("Arduino未连接,无法发送旋转命令")
+            logger.warning("Arduino未连接,无法发送旋转命令")
             return False
         
         try:
             command = "r"  # 假设'r'是旋转命令
             self.ser.write(command.encode('utf-8'))
-            print("发送旋转命令到Arduino")
+            self._command_sent_at = time.perf_counter()
+            logger.debug("发送旋转命令到Arduino")
             return True
         except Exception as e:
-            print(f"发送旋转命令时出错: {e}")
+            logger.error(f"发送旋转命令时出错: {e}")
             return False
 
     def return_start(self):
         """发送开始信号到Arduino"""
         if not self.is_connected():
-            print("Arduino未连接,无法发送开始信号")
+            logger.warning("Arduino未连接,无法发送开始信号")
             return False
         
         try:
             command = "q"  # 假设'q'是开始命令
             self.ser.write(command.encode('utf-8'))
-            print("发送开始信号到Arduino")
+            logger.debug("发送开始信号到Arduino")
             return True
         except Exception as e:
-            print(f"发送开始信号时出错: {e}")
+            logger.error(f"发送开始信号时出错: {e}")
             return False
             
+    def _wait_for_line(self, accept, timeout):
+        """在行队列上等待第一条满足 accept 的信号
+
+        返回该行；超时返回 None；读取线程出错返回 _READER_ERROR。
+        其他信号记入 unsolicited_lines。
+        """
+        deadline = time.time() + timeout
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+
+            try:
+                response = self._lines.get(timeout=remaining)
+            except queue.Empty:
+                return None
+
+            if response is _READER_ERROR or accept(response):
+                return response
+            self._record_unsolicited(response)
+            logger.debug(f"接收到信号: {response}")
+
     def recieve_end(self, timeout=30):
-        """接收Arduino发送的结束信号，持续等待直到收到END信号"""
+        """接收Arduino发送的结束信号，持续等待直到收到END信号
+
+        读取线程负责阻塞读串口，这里在行队列上等待，不占用CPU。
+        """
         if not self.is_connected():
-            print("Arduino未连接,无法接收结束信号")
+            logger.warning("Arduino未连接,无法接收结束信号")
             return False
         
-        start_time = time.time()
-        print("等待Arduino发送END信号...")
-        
+        logger.debug("等待Arduino发送END信号...")
+        response = self._wait_for_line(lambda line: line == "END", timeout)
+        if response is None:
+            logger.warning(f"等待END信号超时({timeout}秒)")
+            metrics.inc('serial_timeouts_total')
+            return False
+        if response is _READER_ERROR:
+            logger.error("接收数据时出错: 串口读取线程已停止")
+            return False
+        if self._command_sent_at is not None:
+            metrics.observe('serial_round_trip_seconds', time.perf_counter() - self._command_sent_at)
+            self._command_sent_at = None
+        logger.debug("接收到Arduino的结束信号")
+        return True
+
+    def probe_protocol(self, timeout=0.5):
+        """查询固件协议版本：新固件对 'v' 回复 'PROTO <版本>'，旧固件不回复视为版本1"""
+        if not self.is_connected():
+            return LEGACY_PROTOCOL
+        try:
+            self.ser.write(b"v")
+        except Exception as e:
+            logger.error(f"查询协议版本时出错: {e}")
+            return LEGACY_PROTOCOL
+
+        response = self._wait_for_line(lambda line: line.startswith("PROTO"), timeout)
+        version = LEGACY_PROTOCOL
+        if response not in (None, _READER_ERROR):
+            try:
+                version = int(response.split()[1])
+            except (IndexError, ValueError):
+                logger.warning(f"无法解析协议版本: {response}")
+        self.protocol_version = version
+        logger.info(f"Arduino协议版本: {version}")
+        return version
+
+    def supports_motion_program(self):
+        """固件是否支持批量运动程序（第一次调用时探测并缓存）"""
+        if self.protocol_version is None:
+            self.probe_protocol()
+        return self.protocol_version >= MOTION_PROGRAM_PROTOCOL
+
+    def run_motion_program(self, steps, dwell_ms=150, on_step=None, step_timeout=10, stride=1, hold=False):
+        """一次写入整个运动程序：旋转 steps 步，每步停留 dwell_ms 毫秒
+
+        固件每完成一步回复 'ACK <步号>'，主机在收到ACK时调用 on_step(步号) 拍照，
+        全部完成后回复 'END'。on_step 抛出异常时发送 'x' 中止程序并重新抛出。
+        stride 为每步包含的基本步数；协议3以下的固件不支持步长，每步单独下发一个 stride 个基本步、
+        停留0的程序，只在最后一个ACK时调用 on_step，电机停在该位置直到主机下发下一步。
+        hold=True 时电机在 on_step 返回之后才转下一步（拍照、等待缓冲区或上传名额时不会转走）：
+        协议4的固件停留 dwell_ms 后等待主机的 'c'；更早的固件改为每步下发一个单步程序。
+        返回完成的步数，出错时返回已完成的步数。
+        """
+        if not self.is_connected():
+            logger.warning("Arduino未连接,无法发送运动程序")
+            return 0
+
+        version = self.protocol_version or LEGACY_PROTOCOL
+        if (hold and version < HOLD_PROTOCOL) or (stride > 1 and version < STRIDE_PROTOCOL):
+            completed = 0
+            while completed < steps:
+                if not self._run_program(1, dwell_ms, on_step, step_timeout, stride, offset=completed,
+                                         log_level=logging.DEBUG):
+                    break
+                completed += 1
+            logger.info(f"逐步运动程序完成: {completed}/{steps}步")
+            return completed
+        return self._run_program(steps, dwell_ms, on_step, step_timeout, stride, hold=hold)
+
+    def _run_program(self, steps, dwell_ms, on_step, step_timeout, stride, hold=False, offset=0,
+                     log_level=logging.INFO):
+        """下发一个运动程序并跟随ACK直到END，on_step 收到的步号加上 offset"""
+        native_stride = stride == 1 or (self.protocol_version or LEGACY_PROTOCOL) >= STRIDE_PROTOCOL
+        try:
+            if hold:
+                command = f"p{steps},{dwell_ms},{stride},1\n"
+            elif stride == 1:
+                command = f"p{steps},{dwell_ms}\n"
+            elif native_stride:
+                command = f"p{steps},{dwell_ms},{stride}\n"
+            else:
+                # 模拟步长：中间的基本步不停留
+                command = f"p{steps * stride},0\n"
+            self.ser.write(command.encode('utf-8'))
+            logger.log(log_level, f"发送运动程序到Arduino: {steps}步, 步长{stride}, 每步停留{dwell_ms}ms"
+                         f"{', 每步等待主机继续' if hold else ''}")
+        except Exception as e:
+            logger.error(f"发送运动程序时出错: {e}")
+            return 0
+        ack_stride = 1 if native_stride else stride
+
+        completed = 0
+        last_ack_at = time.perf_counter()
         while True:
+            response = self._wait_for_line(
+                lambda line: line.startswith("ACK") or line == "END", step_timeout)
+            if response is None:
+                logger.warning(f"等待第{offset + completed + 1}步ACK超时({step_timeout}秒)")
+                metrics.inc('serial_timeouts_total')
+                self.abort_motion_program()
+                return completed
+            if response is _READER_ERROR:
+                logger.error("接收数据时出错: 串口读取线程已停止")
+                return completed
+            if response == "END":
+                logger.log(log_level, f"运动程序完成: {completed}/{steps}步")
+                return completed
+
             try:
-                # 检查是否超时
-                if time.time() - start_time > timeout:
-                    print(f"等待END信号超时({timeout}秒)")
-                    return False
-                
-                # 设置较短的超时时间来检查数据
-                if self.ser.in_waiting > 0:
-                    response = self.ser.readline().decode('utf-8').strip()
-                    print(response)
-                    if response == "END":
-                        print("接收到Arduino的结束信号")
-                        return True
-                    elif response:  # 如果收到其他非空信号
-                        print(f"接收到信号: {response}")
-                
-                # 短暂休眠避免CPU过度占用
-                #time.sleep(0.1)
-                
-            except Exception as e:
-                print(f"接收数据时出错: {e}")
-                return False
+                step = int(response.split()[1])
+            except (IndexError, ValueError):
+                logger.warning(f"无法解析ACK: {response}")
+                continue
+            if step % ack_stride:
+                continue  # 模拟步长：中间的基本步不拍照
+            step //= ack_stride
+            now = time.perf_counter()
+            metrics.observe('serial_round_trip_seconds', now - last_ack_at)
+            last_ack_at = now
+            completed = step
+            if on_step:
+                try:
+                    on_step(offset + step)
+                except BaseException:
+                    self.abort_motion_program()
+                    raise
+            if hold and step < steps:
+                try:
+                    self.ser.write(b"c")
+                except Exception as e:
+                    logger.error(f"发送继续命令时出错: {e}")
+                    self.abort_motion_program()
+                    return completed
+
+    def abort_motion_program(self, timeout=5):
+        """中止正在执行的运动程序并等待固件回复END"""
+        try:
+            self.ser.write(b"x")
+            logger.debug("发送中止命令到Arduino")
+        except Exception as e:
+            logger.debug(f"发送中止命令时出错: {e}")
+            return False
+        return self._wait_for_line(lambda line: line == "END", timeout) == "END"
 
     def send_angles(self, angles):
         """发送角度数据到Arduino"""       
         try:
-            print(f"发送角度到Arduino: {angles}")
+            logger.info(f"发送角度到Arduino: {angles}")
             
             for i, angle in enumerate(angles):
                 # 发送角度值
                 command = f"s {angle}"
                 self.ser.write(command.encode('utf-8'))
-                print(f"  发送角度{i+1}: {angle}°")
+                logger.debug(f"  发送角度{i+1}: {angle}°")
                 #time.sleep(0.5)  # 短暂延时确保数据发送完成
             
-            print("所有角度发送完成")
+            logger.info("所有角度发送完成")
             return True
             
         except Exception as e:
-            print(f"发送数据到Arduino时出错: {e}")
+            logger.error(f"发送数据到Arduino时出错: {e}")
             return False
     
     def send_single_angle(self, angle):
         """发送单个角度到Arduino并等待完成"""
         if not self.is_connected():
-            print("Arduino未连接,无法发送角度")
+            logger.warning("Arduino未连接,无法发送角度")
             return False
         
         try:
             command = f"s {angle}"
             self.ser.write(command.encode('utf-8'))
-            print(f"发送单个角度: {angle}°")
+            self._command_sent_at = time.perf_counter()
+            logger.debug(f"发送单个角度: {angle}°")
             return True
         except Exception as e:
-            print(f"发送单个角度时出错: {e}")
+            logger.error(f"发送单个角度时出错: {e}")
             return False
     
     def close(self):
         """关闭串口连接"""
+        self._reader_stop.set()
         if self.ser and self.ser.is_open:
             self.ser.close()
-            print("Arduino连接已关闭")
+            logger.info("Arduino连接已关闭")
+        if self._reader_thread and self._reader_thread is not threading.current_thread():
+            self._reader_thread.join(timeout=self.timeout + 1)
     
     def __del__(self):
         """析构函数，确保串口正确关闭"""
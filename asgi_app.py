@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+异步服务模式
+在事件循环上提供 app.py 的所有接口：视频流、事件流和少数只读内存的状态查询由协程处理，不占用线程；
+其余接口交给一个小线程池执行Flask，流式响应（例如归档下载）每次只在取下一块时占用线程
+
+用法:
+    pip install uvicorn
+    python asgi_app.py --port 5000
+"""
+
+import argparse
+import asyncio
+import io
+import logging
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl
+
+try:
+    import uvicorn
+except ImportError:  # 只有异步服务模式需要uvicorn
+    uvicorn = None
+
+from werkzeug.exceptions import HTTPException
+
+import app as flask_module
+from events import KEEPALIVE_SECONDS, RETRY_MS, format_sse, parse_last_event_id
+from frame_broadcaster import parse_stream_profile
+
+logger = logging.getLogger(__name__)
+
+# 直接在事件循环中执行的接口：只读取内存中的字段，不获取拍照、上传和扫描线程会持有的锁
+# （只有转台登记表的锁，它只在增删转台时短暂持有）。
+# 任务、指标、视频流和照片索引的状态查询都要获取这些线程的锁，有时锁内还在做I/O，
+# 放在事件循环中执行会让所有视频流和事件流一起卡住，因此和其他接口一样交给线程池
+INLINE_ENDPOINTS = frozenset({'get_status', 'list_rigs'})
+# 响应不超过这个大小时在线程池中一次取完，省去逐块切换线程
+_DRAIN_BYTES = 256 * 1024
+_DONE = object()
+
+
+def _wsgi_environ(scope, body):
+    """把ASGI请求转换为WSGI环境变量"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': str(client[0]),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            name = f"HTTP_{name}"
+        environ[name] = f"{environ[name]},{value}" if name in environ else value
+    return environ
+
+
+class AsyncServer:
+    """ASGI应用：视频流为协程，其余请求由Flask在线程池中处理"""
+
+    def __init__(self, flask_app, rigs, io_threads=4):
+        self.flask_app = flask_app
+        self.rigs = rigs
+        self.io_threads = io_threads
+        # 相机、串口和Flask视图的阻塞调用都在这个线程池中执行
+        self.executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="asgi-io")
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        loop = asyncio.get_running_loop()
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # 提前预热相机
+                for rig in self.rigs.all():
+                    await loop.run_in_executor(self.executor, rig.camera.initialize_camera)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False, cancel_futures=True)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return
+            body += message.get('body', b'')
+            if not message.get('more_body'):
+                break
+        environ = _wsgi_environ(scope, bytes(body))
+        try:
+            endpoint, args = self.flask_app.url_map.bind_to_environ(environ).match()
+        except HTTPException:
+            endpoint, args = None, {}
+        if endpoint == 'video_feed':
+            await self._video_feed(environ, args.get('rig_id'), receive, send)
+        elif endpoint == 'event_stream':
+            await self._event_stream(environ, args.get('rig_id'), receive, send)
+        elif endpoint in INLINE_ENDPOINTS and scope['method'] in ('GET', 'HEAD'):
+            await self._send_wsgi(self._start_wsgi(environ), receive, send, inline=True)
+        else:
+            loop = asyncio.get_running_loop()
+            started = await loop.run_in_executor(self.executor, self._start_wsgi, environ)
+            await self._send_wsgi(started, receive, send)
+
+    def _start_wsgi(self, environ):
+        """执行Flask视图，返回 (状态码, 响应头, 已取出的响应体, 剩余的响应迭代器)"""
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = headers
+
+        iterable = self.flask_app(environ, start_response)
+        length = next((value for name, value in response['headers'] if name.lower() == 'content-length'), None)
+        if length is not None and int(length) <= _DRAIN_BYTES:
+            try:
+                return response['status'], response['headers'], b''.join(iterable), None
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+        return response['status'], response['headers'], b'', iterable
+
+    async def _send_wsgi(self, started, receive, send, inline=False):
+        status, headers, body, iterable = started
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                for name, value in headers]})
+        if iterable is None:
+            await send({'type': 'http.response.body', 'body': body})
+            return
+        loop = asyncio.get_running_loop()
+        chunks = iter(iterable)
+
+        async def generate():
+            pending = None
+            try:
+                while True:
+                    if inline:
+                        chunk = next(chunks, _DONE)
+                    else:
+                        pending = self.executor.submit(next, chunks, _DONE)
+                        chunk = await asyncio.wrap_future(pending)
+                    if chunk is _DONE:
+                        return
+                    yield chunk
+            finally:
+                # 客户端断开时线程中可能正在取下一块，等它结束后再关闭迭代器
+                if pending is not None and not pending.done():
+                    await asyncio.wait([asyncio.wrap_future(pending)])
+                if hasattr(iterable, 'close'):
+                    await loop.run_in_executor(self.executor, iterable.close)
+
+        await self._stream(generate(), receive, send)
+
+    async def _stream(self, chunks, receive, send):
+        """发送流式响应体，客户端断开时停止生成"""
+        async def pump():
+            async for chunk in chunks:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+
+        async def wait_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tasks = [asyncio.ensure_future(pump()), asyncio.ensure_future(wait_disconnect())]
+        try:
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled() and task.exception():
+                    logger.warning(f"流式响应中断: {task.exception()}")
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            await chunks.aclose()
+
+    async def _send_simple(self, send, status, text):
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8')})
+
+    async def _video_feed(self, environ, rig_id, receive, send):
+        """视频流接口的协程版本，参数与 /api/video_feed 相同"""
+        rig = self.rigs.get(rig_id) if rig_id else self.rigs.default
+        if rig is None:
+            await self._send_simple(send, 404, "转台不存在")
+            return
+        loop = asyncio.get_running_loop()
+        if not await loop.run_in_executor(self.executor, rig.camera.start_streaming):
+            await self._send_simple(send, 500, "无法启动视频流")
+            return
+        profile = parse_stream_profile(dict(parse_qsl(environ['QUERY_STRING'])))
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'multipart/x-mixed-replace; boundary=frame'),
+                                (b'cache-control', b'no-cache')]})
+        await self._stream(rig.camera.generate_frames_async(profile, self.executor), receive, send)
+
+
+    async def _event_stream(self, environ, rig_id, receive, send):
+        """事件流接口的协程版本，与 /api/events 相同，等待事件时不占用线程"""
+        rig = self.rigs.get(rig_id) if rig_id else self.rigs.default
+        if rig is None:
+            await self._send_simple(send, 404, "转台不存在")
+            return
+        last_id = parse_last_event_id(environ.get('HTTP_LAST_EVENT_ID') or
+                                      dict(parse_qsl(environ['QUERY_STRING'])).get('last_event_id'))
+        loop = asyncio.get_running_loop()
+        wakeup = asyncio.Event()
+
+        def on_event(event):
+            # 在发布者的线程中调用，只唤醒事件循环
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+
+        async def generate():
+            # 先登记回调再取补发的事件，两者之间发布的事件不会漏掉
+            rig.events.add_listener(on_event)
+            try:
+                yield f"retry: {RETRY_MS}\n\n".encode()
+                events, last = rig.events.replay(last_id, rig.event_snapshot)
+                for event in events:
+                    yield format_sse(event)
+                while True:
+                    try:
+                        await asyncio.wait_for(wakeup.wait(), KEEPALIVE_SECONDS)
+                    except asyncio.TimeoutError:
+                        yield b": keepalive\n\n"
+                        continue
+                    wakeup.clear()
+                    for event in rig.events.since(last):
+                        yield format_sse(event)
+                        last = event.id
+            finally:
+                rig.events.remove_listener(on_event)
+
+        await send({'type': 'http.response.start', 'status': 200,
+                    'headers': [(b'content-type', b'text/event-stream; charset=utf-8'),
+                                (b'cache-control', b'no-cache'),
+                                (b'x-accel-buffering', b'no')]})
+        await self._stream(generate(), receive, send)
+
+
+application = AsyncServer(flask_module.app, flask_module.rigs,
+                          io_threads=int(os.environ.get('ASGI_IO_THREADS', '4')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='异步服务模式')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    args = parser.parse_args()
+    if uvicorn is None:
+        logger.error("异步服务模式需要uvicorn: pip install uvicorn")
+        return 1
+    logger.info(f"启动异步服务器 {args.host}:{args.port}，IO线程{application.io_threads}个")
+    # log_config=None：沿用 app_logging 的日志配置
+    uvicorn.run(application, host=args.host, port=args.port, log_config=None, access_log=False,
+                lifespan='on')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
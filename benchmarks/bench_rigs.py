@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+多转台吞吐量基准测试
+用模拟串口和模拟相机配置多台转台，分别让1台、2台……同时扫描，
+报告总吞吐量（扫描次数/分钟、照片/秒）随转台数量的变化
+
+用法:
+    python benchmarks/bench_rigs.py --rigs 1 2 4 --scans 2
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench_scan import run_scan  # noqa: E402
+
+
+def run_rig(client, rig_id, scans, angles, scan_params, results):
+    """在一台转台上依次扫描 scans 次（各转台在自己的线程中并行）"""
+    prefix = f"/rigs/{rig_id}"
+    for _ in range(scans):
+        results.append(run_scan(client, angles, scan_params, prefix=prefix))
+
+
+def run_round(app_module, rig_ids, scans, angles, scan_params):
+    """让 rig_ids 中的转台同时扫描，返回 (墙钟秒数, 任务列表)"""
+    results = []
+    threads = [threading.Thread(target=run_rig, args=(app_module.app.test_client(), rig_id, scans, angles,
+                                                      scan_params, results))
+               for rig_id in rig_ids]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started, results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多转台吞吐量基准测试')
+    parser.add_argument('--rigs', type=int, nargs='+', default=[1, 2, 4], help='同时扫描的转台数量')
+    parser.add_argument('--scans', type=int, default=1, help='每台转台连续扫描的次数')
+    parser.add_argument('--motion-delay', type=float, default=0.05, help='模拟电机每步运动时间（秒）')
+    parser.add_argument('--jitter', type=float, default=0.01, help='END信号的随机抖动（秒）')
+    parser.add_argument('--receiver-latency', type=float, default=0.02, help='接收端每个请求的延时（秒）')
+    parser.add_argument('--angles', type=json.loads, default=[45, 90, 135, 180],
+                        help='阶段2发送的4个角度（JSON数组）')
+    parser.add_argument('--scan-params', type=json.loads, default=None,
+                        help='扫描参数JSON，例如 \'{"steps": 30, "step_angle": 12}\'')
+    parser.add_argument('--save', help='把结果保存为JSON')
+    parser.add_argument('--verbose', action='store_true', help='显示扫描过程的输出')
+    args = parser.parse_args()
+    save_path = os.path.abspath(args.save) if args.save else None
+
+    from teammate_receiver import ReceiverServer
+
+    # 先只绑定端口，导入 app（fork 缩略图进程池）之后再启动接收端线程，见 bench_scan.py
+    receiver = ReceiverServer(latency=args.receiver_latency)
+    # 在临时目录中运行，照片不写入仓库目录
+    workdir = tempfile.mkdtemp(prefix='bench_rigs_')
+    os.chdir(workdir)
+    count = max(args.rigs)
+    with open('rigs.json', 'w') as f:
+        json.dump([{'id': f"rig{i}", 'port': f"/dev/ttyACM{i}", 'camera_index': i} for i in range(count)], f)
+    os.environ['ADVANCE_MODEL_SIMULATE'] = '1'
+    os.environ['SIM_MOTION_DELAY'] = str(args.motion_delay)
+    os.environ['SIM_MOTION_JITTER'] = str(args.jitter)
+    os.environ['TEAMMATE_URL'] = receiver.url
+    os.environ['RIGS_CONFIG'] = os.path.abspath('rigs.json')
+    os.environ.setdefault('LOG_LEVEL', 'INFO' if args.verbose else 'WARNING')
+
+    output = sys.stdout if args.verbose else io.StringIO()
+    rounds = []
+    with contextlib.redirect_stdout(output):
+        import app
+        receiver.start()
+        for rigs in args.rigs:
+            wall, jobs = run_round(app, [f"rig{i}" for i in range(rigs)], args.scans, args.angles,
+                                   args.scan_params)
+            rounds.append({'rigs': rigs, 'wall_seconds': round(wall, 3), 'jobs': jobs})
+
+    failed = [job for r in rounds for job in r['jobs'] if job['status'] != 'completed']
+    for job in failed:
+        print(f"任务 {job['job_id']} 未完成: {job['status']} {job['error']}")
+
+    print(f"每台转台扫描{args.scans}次, 电机每步{args.motion_delay * 1000:.0f}ms, "
+          f"接收端延时{args.receiver_latency * 1000:.0f}ms, 工作目录 {workdir}")
+    print(f"{'转台数':<8}{'墙钟(s)':>10}{'扫描/分钟':>12}{'照片/秒':>10}{'加速比':>8}{'并行效率':>10}")
+    base = None
+    for r in rounds:
+        photos = sum(job['checkpoint']['photos_captured'] for job in r['jobs'])
+        r['scans_per_minute'] = round(len(r['jobs']) * 60 / r['wall_seconds'], 2)
+        r['photos_per_second'] = round(photos / r['wall_seconds'], 2)
+        if base is None:
+            base = r['scans_per_minute'] / r['rigs']
+        speedup = r['scans_per_minute'] / base
+        print(f"{r['rigs']:<8}{r['wall_seconds']:>10.2f}{r['scans_per_minute']:>12.2f}"
+              f"{r['photos_per_second']:>10.2f}{speedup:>8.2f}{speedup / r['rigs']:>10.1%}")
+
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump({'args': vars(args), 'rounds': rounds}, f, indent=2, ensure_ascii=False)
+    receiver.stop()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
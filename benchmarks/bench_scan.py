@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+端到端扫描基准测试
+使用模拟串口、模拟相机和本地接收端运行完整的两阶段扫描，
+报告每个阶段的墙钟时间、CPU时间和峰值内存，并可与基线结果对比
+
+用法:
+    python benchmarks/bench_scan.py --runs 3 --save baseline.json
+    python benchmarks/bench_scan.py --runs 3 --baseline baseline.json
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STAGES = ('setup', 'stage1', 'stage2', 'stage3')
+
+
+def run_scan(client, angles, scan_params=None, poll_interval=0.01, timeout=600, prefix=''):
+    """提交一次扫描，阶段2开始时发送角度，返回结束后的任务信息
+
+    prefix 为转台的接口前缀（例如 /rigs/rig1），默认使用默认转台。
+    """
+    client.post(f'{prefix}/clear_angles')
+    job_id = client.post(f'{prefix}/start_rotation', json=scan_params or {}).get_json()['job_id']
+    angles_sent = False
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = client.get(f'{prefix}/api/jobs/{job_id}').get_json()
+        if job['stage'] == 'stage2' and not angles_sent:
+            client.post(f'{prefix}/api/receive_angles', json={'angles': angles})
+            angles_sent = True
+        if job['status'] in ('completed', 'failed', 'cancelled'):
+            return job
+        time.sleep(poll_interval)
+    raise TimeoutError(f"扫描任务超时: {job_id}")
+
+
+def summarize(jobs):
+    """对多次运行的每个阶段取平均值"""
+    summary = {}
+    for stage in STAGES + ('total',):
+        samples = [job['stage_timings'][stage] for job in jobs if stage in job['stage_timings']]
+        if not samples:
+            continue
+        summary[stage] = {
+            key: round(sum(sample[key] for sample in samples) / len(samples), 4)
+            for key in ('wall_seconds', 'cpu_seconds', 'peak_rss_mb')
+        }
+    return summary
+
+
+def add_totals(job):
+    timings = job['stage_timings']
+    timings['total'] = {
+        'wall_seconds': sum(t['wall_seconds'] for t in timings.values()),
+        'cpu_seconds': sum(t['cpu_seconds'] for t in timings.values()),
+        'peak_rss_mb': max((t['peak_rss_mb'] for t in timings.values()), default=0.0)
+    }
+    return job
+
+
+def print_report(summary, baseline=None):
+    header = f"{'阶段':<8}{'墙钟(s)':>10}{'CPU(s)':>10}{'峰值内存(MB)':>14}"
+    if baseline:
+        header += f"{'墙钟变化':>12}{'CPU变化':>10}"
+    print(header)
+    for stage, timing in summary.items():
+        line = f"{stage:<8}{timing['wall_seconds']:>10.2f}{timing['cpu_seconds']:>10.2f}{timing['peak_rss_mb']:>14.1f}"
+        if baseline and stage in baseline:
+            base = baseline[stage]
+
+            def change(key):
+                return (timing[key] - base[key]) / base[key] if base[key] else 0.0
+            line += f"{change('wall_seconds'):>12.1%}{change('cpu_seconds'):>10.1%}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='端到端扫描基准测试')
+    parser.add_argument('--runs', type=int, default=1)
+    parser.add_argument('--motion-delay', type=float, default=0.05, help='模拟电机每步运动时间（秒）')
+    parser.add_argument('--jitter', type=float, default=0.01, help='END信号的随机抖动（秒）')
+    parser.add_argument('--receiver-latency', type=float, default=0.02, help='接收端每个请求的延时（秒）')
+    parser.add_argument('--save', help='把结果保存为JSON，作为以后对比的基线')
+    parser.add_argument('--baseline', help='与之前保存的基线JSON对比')
+    parser.add_argument('--angles', type=json.loads, default=[45, 90, 135, 180],
+                        help='阶段2发送的4个角度（JSON数组），默认 [45, 90, 135, 180]')
+    parser.add_argument('--scan-params', type=json.loads, default=None,
+                        help='扫描参数JSON，例如 \'{"mode": "coarse_to_fine"}\'')
+    parser.add_argument('--static-scene', action='store_true', help='模拟相机画面不变（测试重复照片抑制）')
+    parser.add_argument('--verbose', action='store_true', help='显示扫描过程的输出')
+    args = parser.parse_args()
+    save_path = os.path.abspath(args.save) if args.save else None
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+
+    from teammate_receiver import ReceiverServer
+
+    # 先只绑定端口：导入 app 时缩略图进程池用 fork 创建，进程中不能已有其他线程，接收端线程之后再启动
+    receiver = ReceiverServer(latency=args.receiver_latency)
+    os.environ['ADVANCE_MODEL_SIMULATE'] = '1'
+    os.environ['SIM_MOTION_DELAY'] = str(args.motion_delay)
+    os.environ['SIM_MOTION_JITTER'] = str(args.jitter)
+    os.environ['TEAMMATE_URL'] = receiver.url
+    if args.static_scene:
+        os.environ['SIM_STATIC_SCENE'] = '1'
+        # 重复照片抑制默认关闭，画面不变时打开以观察效果
+        os.environ.setdefault('DEDUP_MAX_DISTANCE', '4')
+    os.environ.setdefault('LOG_LEVEL', 'INFO' if args.verbose else 'WARNING')
+
+    # 在临时目录中运行，照片不写入仓库目录
+    workdir = tempfile.mkdtemp(prefix='bench_scan_')
+    os.chdir(workdir)
+
+    output = sys.stdout if args.verbose else io.StringIO()
+    jobs = []
+    with contextlib.redirect_stdout(output):
+        import app
+        receiver.start()
+        client = app.app.test_client()
+        for _ in range(args.runs):
+            jobs.append(add_totals(run_scan(client, args.angles, args.scan_params)))
+
+    failed = [job for job in jobs if job['status'] != 'completed']
+    for job in failed:
+        print(f"任务 {job['job_id']} 未完成: {job['status']} {job['error']}")
+
+    summary = summarize(jobs)
+    for job in jobs:
+        stage1 = (job.get('result') or {}).get('stage1')
+        if stage1:
+            print(f"阶段1 {stage1['mode']}: 拍照{stage1['captures']}张 "
+                  f"(粗扫描{stage1['coarse_captures']}, 全分辨率{stage1['full_resolution_captures']})")
+        dedup = (job.get('result') or {}).get('dedup')
+        if dedup and dedup['full_photos'] + dedup['references']:
+            print(f"重复照片抑制: 完整上传{dedup['full_photos']}张, 引用{dedup['references']}张, "
+                  f"节省{dedup['bytes_saved'] / 1024:.0f}KB ({dedup['saved_ratio']:.1%})")
+        stage3 = (job.get('result') or {}).get('stage3')
+        if stage3:
+            print(f"阶段3 顺序{stage3['order']}: 转动{stage3['planned_travel_degrees']}度"
+                  f"/{stage3['planned_travel_seconds']}s (原顺序{stage3['naive_travel_degrees']}度"
+                  f"/{stage3['naive_travel_seconds']}s)，省去回起点{stage3['homings_skipped']}次，"
+                  f"复用照片{stage3['cache_hits']}张")
+    renditions = app.renditions.stats()
+    print(f"缩略图: {'进程池' if renditions['executor'] == 'process' else '线程'}生成，"
+          f"缓存{renditions['files']}个文件，失败{renditions['errors']}次")
+    print(f"{args.runs}次扫描, 电机每步{args.motion_delay * 1000:.0f}ms, "
+          f"接收端延时{args.receiver_latency * 1000:.0f}ms, 工作目录 {workdir}")
+    baseline = None
+    if baseline_path:
+        with open(baseline_path) as f:
+            baseline = json.load(f)['summary']
+    print_report(summary, baseline)
+
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump({'args': vars(args), 'summary': summary, 'jobs': jobs}, f, indent=2, ensure_ascii=False)
+    receiver.stop()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
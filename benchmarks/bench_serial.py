@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+串口等待基准测试
+对比旧的 in_waiting 忙等循环与读取线程方式在等待END期间的CPU占用
+
+用法: python benchmarks/bench_serial.py --steps 10 --delay 0.2
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from arduino_controller import ArduinoController
+from simulation import SimulatedSerial
+
+
+def busy_spin_wait(ser, timeout):
+    """旧版 recieve_end 的忙等循环（time.sleep 被注释掉）"""
+    start_time = time.time()
+    while time.time() - start_time <= timeout:
+        if ser.in_waiting > 0:
+            if ser.readline().decode('utf-8').strip() == "END":
+                return True
+    return False
+
+
+def measure(run, steps):
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    ok = all([run() for _ in range(steps)])
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    return ok, wall, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description='串口等待基准测试')
+    parser.add_argument('--steps', type=int, default=10)
+    parser.add_argument('--delay', type=float, default=0.2, help='模拟电机运动时间（秒）')
+    args = parser.parse_args()
+
+    ser = SimulatedSerial(motion_delay=args.delay)
+
+    def legacy_step():
+        ser.write(b'r')
+        return busy_spin_wait(ser, timeout=10)
+
+    arduino = ArduinoController(serial_factory=SimulatedSerial.factory(motion_delay=args.delay),
+                                startup_delay=0)
+
+    def reader_step():
+        arduino.send_rotate()
+        return arduino.recieve_end(timeout=10)
+
+    results = [('忙等循环', measure(legacy_step, args.steps)),
+               ('读取线程', measure(reader_step, args.steps))]
+    arduino.close()
+
+    print(f"\n{args.steps}步, 每步电机运动{args.delay * 1000:.0f}ms")
+    print(f"{'方式':<10}{'墙钟(s)':>10}{'CPU(s)':>10}{'CPU占用':>10}")
+    for name, (ok, wall, cpu) in results:
+        status = '' if ok else '  (超时)'
+        print(f"{name:<10}{wall:>10.2f}{cpu:>10.2f}{cpu / wall:>10.0%}{status}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+"""
+视频流负载测试
+分别用线程模式（Flask开发服务器）和异步模式（asgi_app.py）启动模拟服务器，
+打开N个并发的 /api/video_feed 客户端，同时轮询 /api/get_status，
+报告服务器的内存和线程数、首帧延迟、帧间隔和状态查询延迟
+
+用法:
+    python benchmarks/bench_streams.py --clients 50 --duration 10
+    python benchmarks/bench_streams.py --clients 10 50 100 --modes asgi
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SERVER_COMMANDS = {
+    # Flask开发服务器，每个连接一个线程
+    'threaded': [sys.executable, '-c',
+                 "import sys, app; app.app.run(host='127.0.0.1', port=int(sys.argv[1]), threaded=True)"],
+    'asgi': [sys.executable, os.path.join(ROOT, 'asgi_app.py'), '--host', '127.0.0.1', '--port']
+}
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def process_status(pid):
+    """服务器进程的常驻内存（MB）和线程数"""
+    status = {}
+    with open(f"/proc/{pid}/status") as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+    return int(status['VmRSS'].split()[0]) / 1024, int(status['Threads'])
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+async def stream_client(port, duration, result):
+    """读取MJPEG流，记录首帧延迟和帧间隔"""
+    started = time.perf_counter()
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(b"GET /api/video_feed HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    await writer.drain()
+    tail = b''
+    last = None
+    deadline = started + duration
+    try:
+        while time.perf_counter() < deadline:
+            try:
+                data = await asyncio.wait_for(reader.read(65536), timeout=deadline - time.perf_counter())
+            except asyncio.TimeoutError:
+                break
+            if not data:
+                break
+            now = time.perf_counter()
+            frames = (tail + data).count(b'--frame')
+            tail = data[-8:]
+            for _ in range(frames):
+                if last is None:
+                    result['first_frame'].append(now - started)
+                else:
+                    result['gaps'].append(now - last)
+                last = now
+                result['frames'] += 1
+    finally:
+        writer.close()
+
+
+async def status_poller(port, duration, interval, latencies):
+    """按固定间隔请求 /api/get_status（每次新建连接），记录延迟"""
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        writer.write(b"GET /api/get_status HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+        await writer.drain()
+        await reader.read()
+        latencies.append(time.perf_counter() - started)
+        writer.close()
+        await asyncio.sleep(interval)
+
+
+async def sample_server(pid, duration, samples):
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        samples.append(process_status(pid))
+        await asyncio.sleep(0.25)
+
+
+async def run_load(port, pid, clients, duration, poll_interval):
+    result = {'first_frame': [], 'gaps': [], 'frames': 0}
+    latencies = []
+    samples = []
+    idle = process_status(pid)
+    await asyncio.gather(
+        *[stream_client(port, duration, result) for _ in range(clients)],
+        status_poller(port, duration, poll_interval, latencies),
+        sample_server(pid, duration, samples),
+        return_exceptions=False)
+    return {
+        'clients': clients,
+        'idle_rss_mb': round(idle[0], 1),
+        'peak_rss_mb': round(max(s[0] for s in samples), 1),
+        'peak_threads': max(s[1] for s in samples),
+        'connected': len(result['first_frame']),
+        'fps_per_client': round(result['frames'] / clients / duration, 2),
+        'first_frame_p50_ms': round(percentile(result['first_frame'], 0.5) * 1000, 1)
+        if result['first_frame'] else None,
+        'frame_gap_p95_ms': round(percentile(result['gaps'], 0.95) * 1000, 1) if result['gaps'] else None,
+        'status_p50_ms': round(statistics.median(latencies) * 1000, 2) if latencies else None,
+        'status_p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None
+    }
+
+
+def start_server(mode, workdir, env):
+    port = free_port()
+    server = subprocess.Popen(SERVER_COMMANDS[mode] + [str(port)], cwd=workdir, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return server, port
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"{mode} 服务器启动超时")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='视频流负载测试')
+    parser.add_argument('--clients', type=int, nargs='+', default=[10, 50], help='并发视频流客户端数量')
+    parser.add_argument('--modes', nargs='+', choices=sorted(SERVER_COMMANDS), default=['threaded', 'asgi'])
+    parser.add_argument('--duration', type=float, default=10.0, help='每轮测试的秒数')
+    parser.add_argument('--poll-interval', type=float, default=0.1, help='状态查询间隔（秒）')
+    parser.add_argument('--save', help='把结果保存为JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='bench_streams_')
+    env = dict(os.environ, ADVANCE_MODEL_SIMULATE='1', LOG_LEVEL='WARNING',
+               TEAMMATE_URL='http://127.0.0.1:9', PYTHONPATH=ROOT)
+    results = []
+    for mode in args.modes:
+        for clients in args.clients:
+            server, port = start_server(mode, workdir, env)
+            try:
+                # 预热：启动视频流并等待第一帧
+                asyncio.run(run_load(port, server.pid, 1, 2.0, args.poll_interval))
+                result = asyncio.run(run_load(port, server.pid, clients, args.duration, args.poll_interval))
+            finally:
+                server.terminate()
+                server.wait(timeout=10)
+            result['mode'] = mode
+            results.append(result)
+
+    print(f"每轮{args.duration:.0f}秒，状态查询间隔{args.poll_interval * 1000:.0f}ms，工作目录 {workdir}")
+    print(f"{'模式':<10}{'客户端':>6}{'已连接':>6}{'空闲内存MB':>11}{'峰值内存MB':>11}{'峰值线程':>9}"
+          f"{'帧率/客户端':>11}{'首帧p50ms':>10}{'帧间隔p95ms':>12}{'状态p50ms':>10}{'状态p95ms':>10}")
+    for r in results:
+        print(f"{r['mode']:<10}{r['clients']:>6}{r['connected']:>6}{r['idle_rss_mb']:>11}{r['peak_rss_mb']:>11}"
+              f"{r['peak_threads']:>9}{r['fps_per_client']:>11}{r['first_frame_p50_ms']!s:>10}"
+              f"{r['frame_gap_p95_ms']!s:>12}{r['status_p50_ms']!s:>10}{r['status_p95_ms']!s:>10}")
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'args': vars(args), 'results': results}, f, indent=2, ensure_ascii=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+照片上传基准测试
+对比逐张发送与批量发送到本地接收端的耗时
+
+用法: python benchmarks/bench_upload.py --photos 90 --latency 0.02
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from teammate_receiver import ReceiverServer
+from teammate_sender import TeammateSender
+
+
+def make_photos(count, size):
+    """生成与1920x1080 JPEG大小相近的随机数据"""
+    return [os.urandom(size) for _ in range(count)]
+
+
+def run_single(url, photos, mode):
+    sender = TeammateSender(url, transfer_mode=mode)
+    start = time.perf_counter()
+    ok = all([sender.send_photo(photo, i + 1) for i, photo in enumerate(photos)])
+    elapsed = time.perf_counter() - start
+    sender.shutdown_uploads()
+    return ok, elapsed
+
+
+def run_batch(url, photos, batch_count, batch_bytes):
+    sender = TeammateSender(url, transfer_mode='multipart',
+                            batch_max_count=batch_count, batch_max_bytes=batch_bytes)
+    items = [{'photo': photo, 'rotation_number': i + 1} for i, photo in enumerate(photos)]
+    start = time.perf_counter()
+    ok = all(sender.send_photos(items))
+    elapsed = time.perf_counter() - start
+    sender.shutdown_uploads()
+    return ok, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='照片上传基准测试')
+    parser.add_argument('--photos', type=int, default=90)
+    parser.add_argument('--size', type=int, default=400 * 1024, help='每张照片字节数')
+    parser.add_argument('--latency', type=float, default=0.02, help='接收端每个请求的模拟延时（秒）')
+    args = parser.parse_args()
+
+    photos = make_photos(args.photos, args.size)
+    cases = [
+        ('逐张 json', lambda url: run_single(url, photos, 'json')),
+        ('逐张 multipart', lambda url: run_single(url, photos, 'multipart')),
+        ('逐张 raw', lambda url: run_single(url, photos, 'raw')),
+        ('批量 5张', lambda url: run_batch(url, photos, 5, 64 * 1024 * 1024)),
+        ('批量 10张', lambda url: run_batch(url, photos, 10, 64 * 1024 * 1024)),
+        ('批量 4MB', lambda url: run_batch(url, photos, 1000, 4 * 1024 * 1024)),
+    ]
+
+    print(f"{args.photos}张照片, 每张{args.size // 1024}KB, 接收端延时{args.latency * 1000:.0f}ms")
+    print(f"{'方式':<16}{'耗时(s)':>10}{'张/秒':>10}{'请求数':>8}")
+    for name, run in cases:
+        with ReceiverServer(latency=args.latency) as receiver:
+            ok, elapsed = run(receiver.url)
+            requests_made = receiver.app.test_client().get('/api/stats').get_json()['requests'] - 1
+        status = '' if ok else '  (有失败)'
+        print(f"{name:<16}{elapsed:>10.2f}{args.photos / elapsed:>10.1f}{requests_made:>8}{status}")
+
+
+if __name__ == '__main__':
+    main()
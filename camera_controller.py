@@ -4,58 +4,156 @@
 负责拍照功能
 """
 
-from picamera2 import Picamera2
+import asyncio
 import os
+import logging
 from datetime import datetime
 import time
 import io
-from threading import Lock
+from threading import RLock
 import cv2
 import numpy as np
 
+from frame_broadcaster import FrameBroadcaster, DEFAULT_STREAM_PROFILE
+from photo_writer import PhotoBufferPool
+import metrics
+from app_logging import RateLimitedLogger
+
+logger = logging.getLogger(__name__)
+# 逐帧出错时限流，避免刷屏
+frame_error_logger = RateLimitedLogger(logger)
+
+try:
+    from picamera2 import Picamera2
+except ImportError:  # 开发机上没有picamera2，可以传入模拟相机
+    Picamera2 = None
+
+try:
+    from picamera2.encoders import MJPEGEncoder, Quality
+    from picamera2.outputs import FileOutput
+except ImportError:  # 旧版picamera2没有硬件编码器接口
+    MJPEGEncoder = None
+
+# 预览使用的低分辨率流尺寸
+LORES_SIZE = (640, 480)
+
 class CameraController:
-    def __init__(self, camera_index=0):
+    def __init__(self, camera_index=0, buffer_count=6, photo_writer=None, camera_factory=None,
+                 photos_dir="photos"):
         self.camera_index = camera_index
         self.picam2 = None
-        self.photos_dir = "photos"
+        # 默认使用真实的Picamera2，测试时可以传入模拟相机类
+        self.camera_factory = camera_factory or Picamera2
+        self.photos_dir = photos_dir
+        # 内存拍照：JPEG编码到可复用缓冲区，落盘交给可选的异步写入器
+        self.buffer_pool = PhotoBufferPool(buffer_count)
+        self.photo_writer = photo_writer
         self.streaming = False
-        self.frame_lock = Lock()
-        self.latest_frame = None
+        # 每种预览配置一个帧生产者，观看同一配置的客户端共享
+        self.frame_lock = RLock()
+        self.broadcasters = {}
+        self.use_hardware_encoder = MJPEGEncoder is not None and camera_factory is None
+        self._hardware_encoder = None
+        self._stream_started_at = None
+        self._stream_cpu_start = None
+        # 相机在进程生命周期内保持打开，在预览和拍照配置之间快速切换
+        self.camera_lock = RLock()
+        self.preview_config = None
+        self.still_config = None
+        self.mode = None  # 'preview' / 'still'
+        self.ready_timeout = 2.0
+        # 最近一次拍照时相机返回的元数据（曝光时间、增益等）
+        self.last_capture_metadata = {}
+        self._metrics_scope = metrics.bind_current_scope()
         self._ensure_photos_dir()
     
     def _ensure_photos_dir(self):
         """确保照片目录存在"""
         if not os.path.exists(self.photos_dir):
             os.makedirs(self.photos_dir)
-            print(f"创建照片目录: {self.photos_dir}")
+            logger.info(f"创建照片目录: {self.photos_dir}")
     
     def initialize_camera(self):
-        """初始化摄像头"""
-        # 如果相机已经初始化，先释放
-        if self.picam2:
-            self.release_camera()
+        """初始化摄像头（已打开时直接返回，相机在进程内保持常开）"""
+        with self.camera_lock:
+            if self.picam2:
+                return True
             
-        try:
-            print("正在初始化相机...")
-            self.picam2 = Picamera2()
-            
-            # 配置相机
-            config = self.picam2.create_still_configuration(
-                main={"size": (1920, 1080)},  # 高分辨率拍照
-                lores={"size": (640, 480)},   # 低分辨率预览
-                display="lores"
-            )
-            self.picam2.configure(config)
-            
-            # 启动相机
-            self.picam2.start()
-            time.sleep(2)  # 等待相机稳定
-            
-            print(f"PiCamera2 初始化成功")
-            return True
-        except Exception as e:
-            print(f"初始化相机失败: {e}")
-            return False
+            try:
+                logger.info(f"正在初始化相机{self.camera_index}...")
+                if self.camera_factory is None:
+                    raise RuntimeError("未安装picamera2")
+                # 一台主机接多个相机时按编号打开
+                self.picam2 = self.camera_factory(self.camera_index)
+                
+                # 预览配置：lores流用于视频流
+                self.preview_config = self.picam2.create_preview_configuration(
+                    main={"size": (1280, 720)},
+                    lores={"size": LORES_SIZE},
+                    display="lores"
+                )
+                # 拍照配置：高分辨率主流，同时保留lores流让预览继续
+                self.still_config = self.picam2.create_still_configuration(
+                    main={"size": (1920, 1080)},  # 高分辨率拍照
+                    lores={"size": LORES_SIZE},   # 低分辨率预览
+                    display="lores"
+                )
+                self.picam2.configure(self.preview_config)
+                self.mode = 'preview'
+                
+                # 启动相机
+                self.picam2.start()
+                self._wait_until_ready()
+                
+                logger.info(f"PiCamera2 初始化成功")
+                return True
+            except Exception as e:
+                logger.error(f"初始化相机失败: {e}")
+                self.picam2 = None
+                return False
+    
+    def _wait_until_ready(self):
+        """等待第一帧到达且自动曝光稳定，代替固定的等待时间"""
+        deadline = time.time() + self.ready_timeout
+        while time.time() < deadline:
+            metadata = self.picam2.capture_metadata()
+            # 没有 AeLocked 字段的旧版libcamera收到第一帧即可
+            if metadata.get('AeLocked', True):
+                return
+    
+    def _hardware_broadcasters(self):
+        with self.frame_lock:
+            return [b for b in self.broadcasters.values() if b.hardware]
+    
+    def _switch_mode(self, mode):
+        """在预览和拍照配置之间切换，切换期间暂停硬件编码器"""
+        with self.camera_lock:
+            if not self.picam2:
+                return False
+            if self.mode == mode:
+                return True
+            paused = self._hardware_broadcasters()
+            for broadcaster in paused:
+                broadcaster.pause()
+            try:
+                self.picam2.switch_mode(self.still_config if mode == 'still' else self.preview_config)
+                self.mode = mode
+                logger.info(f"相机切换到{'拍照' if mode == 'still' else '预览'}配置")
+                return True
+            except Exception as e:
+                logger.error(f"切换相机配置失败: {e}")
+                return False
+            finally:
+                for broadcaster in paused:
+                    broadcaster.resume()
+    
+    def enter_still_mode(self):
+        """切换到拍照配置（扫描开始时调用），预览继续使用lores流"""
+        return self._switch_mode('still')
+    
+    def enter_preview_mode(self):
+        """切换回预览配置（扫描结束时调用）"""
+        return self._switch_mode('preview')
     
     def take_photo(self, photo_name=None):
         """拍照并保存"""
@@ -71,93 +169,309 @@ class CameraController:
             
             photo_path = os.path.join(self.photos_dir, photo_name)
             
-            # 拍照并保存
-            self.picam2.capture_file(photo_path)
-            print(f"照片已保存: {photo_path}")
+            # 拍照期间持有相机锁，软件预览暂停
+            self._capture_still(photo_path)
+            logger.debug(f"照片已保存: {photo_path}")
             return photo_path
                 
         except Exception as e:
-            print(f"拍照时出错: {e}")
+            logger.error(f"拍照时出错: {e}")
             return None
     
+    def _capture_still(self, target, **kwargs):
+        """用拍照配置的主流拍一张，target 为文件路径或文件对象"""
+        with self.camera_lock, metrics.timed('capture_seconds'):
+            if self.mode == 'still':
+                self.last_capture_metadata = self.picam2.capture_file(target, **kwargs) or {}
+            else:
+                # 预览配置下临时切换到拍照配置拍一张再切回
+                paused = self._hardware_broadcasters()
+                for broadcaster in paused:
+                    broadcaster.pause()
+                try:
+                    self.last_capture_metadata = self.picam2.switch_mode_and_capture_file(
+                        self.still_config, target, **kwargs) or {}
+                finally:
+                    for broadcaster in paused:
+                        broadcaster.resume()
+    
+    def capture_to_buffer(self, photo_name=None):
+        """拍照并编码到内存缓冲区，不经过SD卡
+
+        返回 PhotoBuffer，使用者用完后调用 release()。
+        配置了 photo_writer 时在后台异步保存到照片目录。
+        """
+        if not self.picam2:
+            if not self.initialize_camera():
+                return None
+        
+        if not photo_name:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            photo_name = f"photo_{timestamp}.jpg"
+        
+        # 缓冲区全部在用（上传或落盘未完成）时在这里等待
+        buffer = self.buffer_pool.acquire(photo_name)
+        try:
+            self._capture_still(buffer.file, format='jpeg')
+        except Exception as e:
+            logger.error(f"拍照时出错: {e}")
+            buffer.release()
+            return None
+        
+        if self.photo_writer:
+            self.photo_writer.write(os.path.join(self.photos_dir, photo_name), buffer.retain())
+        return buffer
+    
+    def capture_rotation_to_buffer(self, rotation_number):
+        """为特定旋转编号拍照到内存缓冲区"""
+        return self.capture_to_buffer(f"rotation_{rotation_number:03d}.jpg")
+    
+    def capture_preview_to_buffer(self, photo_name, quality=80):
+        """从lores流拍一张低分辨率照片到内存缓冲区（粗扫描用，不切换相机配置）"""
+        if not self.picam2:
+            if not self.initialize_camera():
+                return None
+        
+        buffer = self.buffer_pool.acquire(photo_name)
+        try:
+            with self.camera_lock, metrics.timed('capture_seconds'):
+                frame = self.picam2.capture_array("lores")
+            ret, encoded = cv2.imencode('.jpg', self._lores_to_bgr(frame),
+                                        [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ret:
+                raise RuntimeError("JPEG编码失败")
+            buffer.file.write(encoded.tobytes())
+        except Exception as e:
+            logger.error(f"拍摄低分辨率照片时出错: {e}")
+            buffer.release()
+            return None
+        
+        if self.photo_writer:
+            self.photo_writer.write(os.path.join(self.photos_dir, photo_name), buffer.retain())
+        return buffer
+    
     def take_rotation_photo(self, rotation_number):
         """为特定旋转编号拍照"""
         photo_name = f"rotation_{rotation_number:03d}.jpg"
         return self.take_photo(photo_name)
     
     def start_streaming(self):
-        """开始视频流"""
-        # 停止任何现有的流
-        self.stop_streaming()
+        """开始视频流（已在运行时直接返回，不影响正在观看的客户端）"""
+        if self.streaming:
+            return True
         
         if not self.picam2:
             if not self.initialize_camera():
-                print("无法初始化相机用于视频流")
+                logger.warning("无法初始化相机用于视频流")
                 return False
         
-        try:
-            self.streaming = True
-            print("视频流已启动")
-            return True
-        except Exception as e:
-            print(f"启动视频流失败: {e}")
-            self.streaming = False
-            return False
+        self.streaming = True
+        self._stream_started_at = time.time()
+        self._stream_cpu_start = time.process_time()
+        logger.info("视频流已启动")
+        return True
     
     def stop_streaming(self):
         """停止视频流"""
         self.streaming = False
-        print("视频流已停止")
+        with self.frame_lock:
+            broadcasters = list(self.broadcasters.values())
+            self.broadcasters = {}
+        for broadcaster in broadcasters:
+            broadcaster.stop()
+        logger.info("视频流已停止")
     
-    def get_frame(self):
-        """获取当前帧（JPEG格式）"""
+    def get_broadcaster(self, profile=None):
+        """获取（必要时启动）指定预览配置的帧生产者"""
+        profile = profile or DEFAULT_STREAM_PROFILE
+        with self.frame_lock:
+            broadcaster = self.broadcasters.get(profile)
+            if broadcaster is None:
+                hardware = (self.use_hardware_encoder and self._hardware_encoder is None
+                            and (profile.width, profile.height) == LORES_SIZE)
+                with self._metrics_scope:
+                    broadcaster = FrameBroadcaster(
+                        profile,
+                        self.encode_preview_frame,
+                        start_hardware=self._start_hardware_encoder if hardware else None,
+                        stop_hardware=self._stop_hardware_encoder if hardware else None
+                    )
+                self.broadcasters[profile] = broadcaster
+                broadcaster.start()
+            return broadcaster
+    
+    def _add_client(self, profile):
+        """获取帧生产者并登记客户端（在同一把锁内，避免被空闲回收）"""
+        with self.frame_lock:
+            broadcaster = self.get_broadcaster(profile)
+            return broadcaster, broadcaster.add_client()
+    
+    def _release_broadcaster(self, broadcaster, client_id):
+        """客户端断开；没有客户端的配置（包括默认配置）停止采集，下一个客户端连接时重新启动"""
+        with self.frame_lock:
+            remaining = broadcaster.remove_client(client_id)
+            idle = remaining <= 0
+            if idle and self.broadcasters.get(broadcaster.profile) is broadcaster:
+                del self.broadcasters[broadcaster.profile]
+            else:
+                idle = False
+        if idle:
+            broadcaster.stop()
+    
+    def _start_hardware_encoder(self, profile, output):
+        """在lores流上启动硬件MJPEG编码器，返回是否成功"""
+        if not self.picam2 or MJPEGEncoder is None:
+            return False
+        if profile.quality >= 90:
+            quality = Quality.VERY_HIGH
+        elif profile.quality >= 75:
+            quality = Quality.HIGH
+        elif profile.quality >= 50:
+            quality = Quality.MEDIUM
+        else:
+            quality = Quality.LOW
+        encoder = MJPEGEncoder()
+        self.picam2.start_encoder(encoder, FileOutput(output), quality=quality, name="lores")
+        self._hardware_encoder = encoder
+        return True
+    
+    def _stop_hardware_encoder(self):
+        """停止硬件MJPEG编码器"""
+        encoder = self._hardware_encoder
+        self._hardware_encoder = None
+        if encoder and self.picam2:
+            try:
+                self.picam2.stop_encoder(encoder)
+            except TypeError:  # 旧版 stop_encoder 不接受参数
+                self.picam2.stop_encoder()
+    
+    def encode_preview_frame(self, profile, quality=None, scale=1.0):
+        """从lores流采集并编码一帧预览（JPEG格式），主流只用于拍照
+
+        quality 和 scale 由码率控制器给出，用于在编码超时时降低质量或分辨率。
+        """
         if not self.picam2 or not self.streaming:
             return None
         
         try:
-            # 捕获当前帧
-            frame = self.picam2.capture_array()
+            # lores流默认为YUV420格式；拍照时相机锁被占用，预览在此等待
+            with self.camera_lock:
+                frame = self.picam2.capture_array("lores")
+            encode_start = time.perf_counter()
+            frame_bgr = self._lores_to_bgr(frame)
             
-            # 转换为BGR格式（OpenCV标准）
-            if len(frame.shape) == 3 and frame.shape[2] == 3:
-                frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-            else:
-                frame_bgr = frame
+            size = (int(profile.width * scale), int(profile.height * scale))
+            if (frame_bgr.shape[1], frame_bgr.shape[0]) != size:
+                frame_bgr = cv2.resize(frame_bgr, size, interpolation=cv2.INTER_AREA)
             
             # 编码为JPEG
-            ret, buffer = cv2.imencode('.jpg', frame_bgr, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            ret, buffer = cv2.imencode('.jpg', frame_bgr,
+                                       [cv2.IMWRITE_JPEG_QUALITY, quality or profile.quality])
+            metrics.observe('encode_seconds', time.perf_counter() - encode_start)
             if ret:
                 return buffer.tobytes()
             else:
                 return None
                 
         except Exception as e:
-            print(f"获取帧失败: {e}")
+            frame_error_logger.error('get_frame', f"获取帧失败: {e}")
             return None
     
-    def generate_frames(self):
+    def _lores_to_bgr(self, frame):
+        """lores流（默认YUV420）转换为BGR"""
+        if len(frame.shape) == 2:
+            return cv2.cvtColor(frame, cv2.COLOR_YUV420p2BGR)
+        if frame.shape[2] == 3:
+            return cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
+        return cv2.cvtColor(frame, cv2.COLOR_BGRA2BGR)
+    
+    def get_frame(self):
+        """获取默认预览配置的最新一帧（JPEG格式），没有客户端观看时返回None"""
+        with self.frame_lock:
+            broadcaster = self.broadcasters.get(DEFAULT_STREAM_PROFILE)
+        return broadcaster.get_frame() if broadcaster else None
+    
+    def generate_frames(self, profile=None):
         """生成视频流帧（用于Flask streaming）"""
-        while self.streaming:
-            frame = self.get_frame()
-            if frame:
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
-            time.sleep(0.1)  # 控制帧率
+        broadcaster, client_id = self._add_client(profile)
+        try:
+            last_seq = 0
+            while self.streaming and broadcaster.running:
+                seq, frame = broadcaster.wait_for_frame(last_seq)
+                if frame:
+                    # 发送期间产生的新帧不会排队，下次直接取最新一帧
+                    broadcaster.record_sent(client_id, last_seq, seq)
+                    last_seq = seq
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        finally:
+            self._release_broadcaster(broadcaster, client_id)
+    
+    async def generate_frames_async(self, profile=None, executor=None):
+        """generate_frames 的协程版本（异步服务模式）
+
+        等待新帧时不占用线程：生产者发布新帧后通过回调唤醒事件循环。
+        可能阻塞的操作（停止空闲的生产者）交给 executor 执行。
+        """
+        loop = asyncio.get_running_loop()
+        new_frame = asyncio.Event()
+
+        def notify():
+            try:
+                loop.call_soon_threadsafe(new_frame.set)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+
+        broadcaster, client_id = self._add_client(profile)
+        broadcaster.add_listener(notify)
+        new_frame.set()  # 已有的最新一帧立即发送
+        try:
+            last_seq = 0
+            while self.streaming and broadcaster.running:
+                try:
+                    await asyncio.wait_for(new_frame.wait(), timeout=1.0)
+                except asyncio.TimeoutError:
+                    continue
+                new_frame.clear()
+                seq, frame = broadcaster.latest()
+                if frame and seq != last_seq:
+                    broadcaster.record_sent(client_id, last_seq, seq)
+                    last_seq = seq
+                    yield (b'--frame\r\n'
+                           b'Content-Type: image/jpeg\r\n\r\n' + frame + b'\r\n')
+        finally:
+            broadcaster.remove_listener(notify)
+            await loop.run_in_executor(executor, self._release_broadcaster, broadcaster, client_id)
+
+    def get_stream_stats(self):
+        """视频流统计：每种预览配置的帧率，以及整个进程每个CPU核每秒产出的帧数"""
+        with self.frame_lock:
+            profiles = [broadcaster.stats() for broadcaster in self.broadcasters.values()]
+        stats = {'profiles': profiles, 'process_cpu_cores': None, 'process_fps_per_core': None}
+        if self.streaming and self._stream_started_at:
+            elapsed = time.time() - self._stream_started_at
+            cpu_cores = (time.process_time() - self._stream_cpu_start) / elapsed if elapsed > 0 else 0.0
+            total_fps = sum(profile['fps'] for profile in profiles)
+            stats['process_cpu_cores'] = round(cpu_cores, 4)
+            if cpu_cores > 0:
+                stats['process_fps_per_core'] = round(total_fps / cpu_cores, 1)
+        return stats
     
     def release_camera(self):
-        """释放摄像头资源"""
+        """释放摄像头资源（进程退出时调用）"""
         self.stop_streaming()  # 先停止视频流
-        if self.picam2:
-            try:
-                print("正在释放相机资源...")
-                self.picam2.stop()
-                self.picam2.close()
-                print("相机资源已释放")
-            except Exception as e:
-                print(f"释放相机资源时出错: {e}")
-            finally:
-                self.picam2 = None
-                time.sleep(1)  # 给系统一点时间释放资源
+        with self.camera_lock:
+            if self.picam2:
+                try:
+                    logger.info("正在释放相机资源...")
+                    self.picam2.stop()
+                    self.picam2.close()
+                    logger.info("相机资源已释放")
+                except Exception as e:
+                    logger.error(f"释放相机资源时出错: {e}")
+                finally:
+                    self.picam2 = None
+                    self.mode = None
     
     def __del__(self):
         """析构函数"""
@@ -172,5 +486,6 @@ class CameraController:
         return {
             'initialized': self.picam2 is not None,
             'streaming': self.streaming,
+            'mode': self.mode,
             'photos_dir': self.photos_dir
         }
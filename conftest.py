@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+测试共用的夹具
+app 模块在导入时创建转台、相机和缩略图进程池，整个测试会话只导入一次，使用模拟硬件和临时目录
+"""
+
+import json
+import os
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def app_module(tmp_path_factory):
+    root = tmp_path_factory.mktemp('app')
+    config = root / 'rigs.json'
+    config.write_text(json.dumps([{
+        'id': 'rig0',
+        'port': 'sim0',
+        'camera_index': 0,
+        'photos_dir': str(root / 'photos'),
+        'checkpoint_dir': str(root / 'checkpoints'),
+        'spool': str(root / 'spool' / 'uploads.db'),
+        'job_prefix': ''
+    }]))
+    os.environ.update(ADVANCE_MODEL_SIMULATE='1', SIM_MOTION_DELAY='0.002', SIM_MOTION_JITTER='0',
+                      RIGS_CONFIG=str(config), RENDITION_CACHE=str(root / 'renditions'),
+                      TEAMMATE_URL='http://127.0.0.1:9', LOG_LEVEL='WARNING')
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+事件总线模块
+进程内的状态变化（任务进度、收到角度、错误）发布到总线：扫描线程据此立即唤醒，
+浏览器和队友通过 Server-Sent Events 接口 /api/events 订阅，不再轮询
+"""
+
+import itertools
+import json
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+Event = namedtuple('Event', ['id', 'type', 'data', 'time'])
+
+# SSE连接空闲时发送注释行的间隔（秒），防止代理断开连接
+KEEPALIVE_SECONDS = 15
+# 浏览器断线后重连的等待时间（毫秒）
+RETRY_MS = 3000
+
+
+def format_sse(event):
+    """事件的SSE文本（id/event/data 三行加空行）"""
+    data = json.dumps(event.data, ensure_ascii=False, separators=(',', ':'))
+    return f"id: {event.id}\nevent: {event.type}\ndata: {data}\n\n".encode('utf-8')
+
+
+def parse_last_event_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class EventBus:
+    """事件总线
+
+    保留最近 history 条事件，订阅者重连时按 Last-Event-ID 补发错过的事件。
+    线程中的订阅者用 wait() 阻塞等待；监听回调在发布者的线程中同步调用，
+    必须立即返回（例如唤醒条件变量或事件循环）。
+    """
+
+    def __init__(self, history=500):
+        self._cond = threading.Condition()
+        self._events = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._listeners = []
+        self.last_id = 0
+        self.published = 0
+
+    def publish(self, event_type, data):
+        with self._cond:
+            event = Event(next(self._ids), event_type, data, time.time())
+            self._events.append(event)
+            self.last_id = event.id
+            self.published += 1
+            listeners = list(self._listeners)
+            self._cond.notify_all()
+        for callback in listeners:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.warning(f"事件回调出错: {e}")
+        return event
+
+    def add_listener(self, callback):
+        with self._cond:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._cond:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def since(self, last_id):
+        """id 大于 last_id 的事件（已不在历史中的不再补发）"""
+        with self._cond:
+            return [event for event in self._events if event.id > last_id]
+
+    def replay(self, last_id, snapshot):
+        """订阅开始时要发送的事件，返回 (事件列表, 之后等待的起点)
+
+        重连时（last_id 有效）补发错过的事件；新连接、服务器重启过（last_id 比最新的还大）
+        或错过的事件已不在历史中时，改为发送一个 snapshot 事件，数据由 snapshot() 给出
+        """
+        with self._cond:
+            current = self.last_id
+            oldest = self._events[0].id if self._events else current + 1
+            if last_id is not None and oldest - 1 <= last_id <= current:
+                return [event for event in self._events if event.id > last_id], current
+        return [Event(current, 'snapshot', snapshot(), time.time())], current
+
+    def wait(self, last_id, timeout=None):
+        """等待 id 大于 last_id 的事件，超时返回空列表"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.last_id > last_id, timeout=timeout)
+            return [event for event in self._events if event.id > last_id]
+
+    def stats(self):
+        with self._cond:
+            return {
+                'last_id': self.last_id,
+                'published': self.published,
+                'history': len(self._events),
+                'listeners': len(self._listeners)
+            }
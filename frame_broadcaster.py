@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+"""
+视频流帧广播模块
+每种预览配置只有一个生产者采集并编码帧，所有观看该配置的客户端共享最新一帧
+"""
+
+import io
+import logging
+import time
+from collections import namedtuple
+from threading import Lock, Condition, Thread, current_thread
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 预览配置：分辨率、JPEG质量、目标帧率
+StreamProfile = namedtuple('StreamProfile', ['width', 'height', 'quality', 'fps'])
+DEFAULT_STREAM_PROFILE = StreamProfile(640, 480, 85, 10)
+
+
+def parse_stream_profile(args, default=DEFAULT_STREAM_PROFILE):
+    """从请求参数解析预览配置，超出范围的值会被限制到合法区间"""
+    def _get(name, default_value, low, high):
+        try:
+            value = int(args.get(name, default_value))
+        except (TypeError, ValueError):
+            value = default_value
+        return max(low, min(high, value))
+
+    return StreamProfile(
+        width=_get('width', default.width, 160, 1920),
+        height=_get('height', default.height, 120, 1080),
+        quality=_get('quality', default.quality, 10, 95),
+        fps=_get('fps', default.fps, 1, 30)
+    )
+
+
+class StreamRateController:
+    """视频流自适应码率控制
+
+    根据每帧采集+编码耗时调整睡眠时间以达到目标帧率；
+    编码耗时超过预算时先降低JPEG质量，质量降到下限后再降低分辨率，
+    耗时明显低于预算时按相反顺序逐步恢复。
+    """
+
+    def __init__(self, profile, budget_ratio=0.6, min_quality=40, quality_step=5,
+                 min_scale=0.5, scale_step=0.125, smoothing=0.2):
+        self.profile = profile
+        self.interval = 1.0 / profile.fps
+        self.budget = self.interval * budget_ratio
+        self.min_quality = min(min_quality, profile.quality)
+        self.quality_step = quality_step
+        self.min_scale = min_scale
+        self.scale_step = scale_step
+        self.smoothing = smoothing
+        self.quality = profile.quality
+        self.scale = 1.0
+        self.encode_time = None  # 平滑后的单帧采集+编码耗时（秒）
+        self.frame_period = None  # 平滑后的实际帧间隔（秒）
+        self._last_frame_at = None
+
+    def _smooth(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.smoothing * (sample - current)
+
+    def record(self, encode_seconds, now=None):
+        """记录一帧的耗时，调整质量/分辨率，返回到下一帧前应睡眠的秒数"""
+        now = now or time.time()
+        self.encode_time = self._smooth(self.encode_time, encode_seconds)
+        if self._last_frame_at is not None:
+            self.frame_period = self._smooth(self.frame_period, now - self._last_frame_at)
+        self._last_frame_at = now
+
+        if self.encode_time > self.budget:
+            if self.quality > self.min_quality:
+                self.quality = max(self.min_quality, self.quality - self.quality_step)
+            elif self.scale > self.min_scale:
+                self.scale = max(self.min_scale, self.scale - self.scale_step)
+        elif self.encode_time < self.budget * 0.5:
+            if self.scale < 1.0:
+                self.scale = min(1.0, self.scale + self.scale_step)
+            elif self.quality < self.profile.quality:
+                self.quality = min(self.profile.quality, self.quality + self.quality_step)
+
+        return max(0.0, self.interval - encode_seconds)
+
+    @property
+    def achieved_fps(self):
+        return 1.0 / self.frame_period if self.frame_period else 0.0
+
+    def stats(self):
+        return {
+            'achieved_fps': round(self.achieved_fps, 2),
+            'encode_ms': round(self.encode_time * 1000, 2) if self.encode_time is not None else None,
+            'encode_budget_ms': round(self.budget * 1000, 2),
+            'current_quality': self.quality,
+            'scale': self.scale
+        }
+
+
+class JpegFrameOutput(io.BufferedIOBase):
+    """硬件MJPEG编码器的输出，每次 write 都是一帧完整的JPEG"""
+
+    def __init__(self, broadcaster):
+        super().__init__()
+        self.broadcaster = broadcaster
+
+    def writable(self):
+        return True
+
+    def write(self, buf):
+        self.broadcaster.publish(bytes(buf), throttle=True)
+        return len(buf)
+
+
+class FrameBroadcaster:
+    """单个预览配置的帧生产者
+
+    软件路径：一个采集线程调用 encode_frame(profile, quality, scale)，
+    由 StreamRateController 控制帧率、质量和分辨率；
+    硬件路径：相机的MJPEG编码器把帧写入 JpegFrameOutput。
+    客户端总是取最新一帧，跟不上的客户端直接丢帧，不会积压。
+    """
+
+    def __init__(self, profile, encode_frame, start_hardware=None, stop_hardware=None):
+        self.profile = profile
+        self.encode_frame = encode_frame
+        self.start_hardware = start_hardware
+        self.stop_hardware = stop_hardware
+        self.hardware = False
+        self.running = False
+        self.clients = 0
+        self.frame_lock = Lock()
+        self.latest_frame = None
+        self.frame_seq = 0
+        self._frame_cond = Condition(self.frame_lock)
+        self._thread = None
+        self._last_publish = 0.0
+        self._output = None
+        self._hardware_paused = False
+        # 统计信息
+        self.frames = 0
+        self.encode_cpu_time = 0.0
+        self.started_at = None
+        self.rate = StreamRateController(profile)
+        self.dropped_frames = 0
+        self.client_stats = {}
+        self._client_ids = 0
+        self._metrics_scope = metrics.bind_current_scope()
+        # 有新帧或停止时调用的回调（协程客户端用它唤醒事件循环，不占用线程等待）
+        self._listeners = []
+
+    def start(self):
+        """启动生产者，优先使用硬件编码器"""
+        if self.running:
+            return
+        self.running = True
+        self.started_at = time.time()
+        self.frames = 0
+        self.encode_cpu_time = 0.0
+
+        if self.start_hardware:
+            try:
+                self._output = JpegFrameOutput(self)
+                self.hardware = self.start_hardware(self.profile, self._output)
+            except Exception as e:
+                logger.warning("启动硬件MJPEG编码器失败，使用软件编码: %s", e)
+                self.hardware = False
+        if not self.hardware:
+            self._thread = Thread(target=self._capture_loop, name="frame-capture", daemon=True)
+            self._thread.start()
+        logger.info("预览流已启动: %dx%d q%d %dfps (%s编码)", self.profile.width, self.profile.height,
+                    self.profile.quality, self.profile.fps, '硬件' if self.hardware else '软件')
+
+    def stop(self):
+        """停止生产者并唤醒所有等待的客户端"""
+        with self._frame_cond:
+            self.running = False
+            self.latest_frame = None
+            self._frame_cond.notify_all()
+        self._notify_listeners()
+        if self.hardware and self.stop_hardware:
+            try:
+                self.stop_hardware()
+            except Exception as e:
+                logger.warning("停止硬件MJPEG编码器时出错: %s", e)
+            self.hardware = False
+        thread = self._thread
+        if thread and thread.is_alive() and thread is not current_thread():
+            thread.join(timeout=2)
+        self._thread = None
+
+    def pause(self):
+        """暂停硬件编码器（相机切换配置前调用），客户端保持连接"""
+        if self.hardware and not self._hardware_paused:
+            self.stop_hardware()
+            self._hardware_paused = True
+
+    def resume(self):
+        """相机切换配置后恢复硬件编码器"""
+        if self._hardware_paused and self.running:
+            self._hardware_paused = False
+            self.start_hardware(self.profile, self._output)
+
+    def publish(self, frame, throttle=False, cpu_time=0.0):
+        """发布新的一帧；throttle 为 True 时按目标帧率丢弃多余的帧"""
+        now = time.time()
+        if throttle and now - self._last_publish < 1.0 / self.profile.fps:
+            return
+        with self._frame_cond:
+            if not self.running:
+                return
+            self._last_publish = now
+            self.latest_frame = frame
+            self.frame_seq += 1
+            self.frames += 1
+            self.encode_cpu_time += cpu_time
+            self._frame_cond.notify_all()
+        self._notify_listeners()
+
+    def add_listener(self, callback):
+        """登记新帧回调（在生产者线程中调用，回调必须立即返回）"""
+        with self.frame_lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self.frame_lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def _notify_listeners(self):
+        with self.frame_lock:
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback()
+            except Exception as e:
+                logger.debug("新帧回调出错: %s", e)
+
+    def _capture_loop(self):
+        """软件路径：每帧只采集、编码一次，睡眠时间扣除本帧耗时"""
+        with self._metrics_scope:
+            while self.running:
+                start = time.time()
+                cpu_start = time.thread_time()
+                frame = self.encode_frame(self.profile, self.rate.quality, self.rate.scale)
+                if frame:
+                    self.publish(frame, cpu_time=time.thread_time() - cpu_start)
+                elapsed = time.time() - start
+                metrics.observe('stream_frame_seconds', elapsed)
+                time.sleep(self.rate.record(elapsed))
+
+    def get_frame(self):
+        with self.frame_lock:
+            return self.latest_frame
+
+    def latest(self):
+        """最新一帧及其序号 (帧序号, 帧)"""
+        with self.frame_lock:
+            return self.frame_seq, self.latest_frame
+
+    def wait_for_frame(self, last_seq, timeout=1.0):
+        """等待比 last_seq 更新的一帧，返回 (帧序号, 帧)
+
+        客户端总是拿到最新一帧，处理慢的客户端会自动跳过中间的帧。
+        超时或生产者停止时帧为 None。
+        """
+        with self._frame_cond:
+            self._frame_cond.wait_for(
+                lambda: not self.running or (self.latest_frame is not None and self.frame_seq != last_seq),
+                timeout=timeout
+            )
+            if not self.running or self.frame_seq == last_seq:
+                return last_seq, None
+            return self.frame_seq, self.latest_frame
+
+    def add_client(self):
+        """登记一个客户端，返回客户端ID"""
+        with self.frame_lock:
+            self._client_ids += 1
+            client_id = self._client_ids
+            self.clients += 1
+            self.client_stats[client_id] = {'sent': 0, 'dropped': 0}
+        return client_id
+
+    def remove_client(self, client_id):
+        """客户端断开，返回剩余客户端数"""
+        with self.frame_lock:
+            self.client_stats.pop(client_id, None)
+            self.clients -= 1
+            return self.clients
+
+    def record_sent(self, client_id, last_seq, seq):
+        """记录客户端发送了第 seq 帧，中间跳过的帧计为丢帧"""
+        dropped = max(0, seq - last_seq - 1) if last_seq else 0
+        with self.frame_lock:
+            stats = self.client_stats.get(client_id)
+            if stats is not None:
+                stats['sent'] += 1
+                stats['dropped'] += dropped
+            self.dropped_frames += dropped
+        if dropped:
+            with self._metrics_scope:
+                metrics.inc('stream_dropped_frames_total', dropped)
+
+    def stats(self):
+        """帧率和CPU占用统计，fps_per_core 为每个CPU核每秒能产出的帧数"""
+        elapsed = time.time() - self.started_at if self.started_at else 0.0
+        fps = self.frames / elapsed if elapsed > 0 else 0.0
+        cpu_cores = self.encode_cpu_time / elapsed if elapsed > 0 else 0.0
+        return {
+            'width': self.profile.width,
+            'height': self.profile.height,
+            'quality': self.profile.quality,
+            'target_fps': self.profile.fps,
+            'hardware_encoder': self.hardware,
+            'clients': self.clients,
+            'frames': self.frames,
+            'fps': round(fps, 2),
+            'cpu_cores': round(cpu_cores, 4),
+            'fps_per_core': round(fps / cpu_cores, 1) if cpu_cores > 0 else None,
+            'dropped_frames': self.dropped_frames,
+            'client_stats': [dict(stats, client_id=client_id)
+                             for client_id, stats in list(self.client_stats.items())],
+            **self.rate.stats()
+        }
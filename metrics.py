@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+性能指标模块
+轻量级的计数器和直方图，按Prometheus文本格式导出，并为每个扫描任务提供JSON汇总
+
+热路径上只有一次加锁和一次二分查找；百分位数在导出时才根据最近的样本计算。
+每台转台有一个带 rig 标签的注册表，转台线程上记录的指标写入它而不是全局注册表，
+导出时与全局注册表合并为同名指标的不同标签序列。
+"""
+
+import bisect
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PREFIX = 'advance_model_'
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+# 指标定义：名称 -> (类型, 说明)
+DEFINITIONS = {
+    'serial_round_trip_seconds': ('histogram', '串口往返时间（发送运动命令到收到END/ACK）'),
+    'capture_seconds': ('histogram', '拍一张照片的耗时'),
+    'encode_seconds': ('histogram', '预览帧JPEG编码耗时'),
+    'upload_seconds': ('histogram', '一次照片上传请求的耗时'),
+    'stream_frame_seconds': ('histogram', '视频流每帧采集加编码的耗时'),
+    'photo_hash_seconds': ('histogram', '计算一张照片感知哈希的耗时'),
+    'rendition_seconds': ('histogram', '在后台进程中生成一张照片缩略图的耗时（含排队）'),
+    'angle_wakeup_seconds': ('histogram', '收到角度数据到阶段2的扫描线程被唤醒的延迟'),
+    'uploads_total': ('counter', '上传成功的照片数'),
+    'upload_failures_total': ('counter', '上传失败的照片数'),
+    'upload_bytes_total': ('counter', '上传的照片字节数'),
+    'serial_timeouts_total': ('counter', '等待END/ACK超时次数'),
+    'stream_dropped_frames_total': ('counter', '慢客户端跳过的视频帧数'),
+    'spooled_total': ('counter', '发送失败后写入待发队列的照片和状态消息数'),
+    'spool_delivered_total': ('counter', '从待发队列重发成功的记录数'),
+    'photo_references_total': ('counter', '以"与第N张相同"引用代替完整照片发送的次数'),
+    'upload_bytes_saved_total': ('counter', '以引用代替完整照片节省的上传字节数'),
+    'photo_write_errors_total': ('counter', '照片文件写入或fsync失败的次数'),
+}
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help = help_text
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def summary(self):
+        return self.value
+
+
+class Histogram:
+    """固定桶直方图，另外保留最近 reservoir_size 个样本用于计算百分位数"""
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS, reservoir_size=1024):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets)
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最后一个为 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=reservoir_size)
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.bucket_counts[index] += 1
+            self.count += 1
+            self.sum += value
+            self.samples.append(value)
+
+    def quantiles(self):
+        with self._lock:
+            samples = sorted(self.samples)
+        if not samples:
+            return {q: None for q in QUANTILES}
+        return {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+
+    def summary(self):
+        quantiles = self.quantiles()
+        with self._lock:
+            count, total = self.count, self.sum
+        return {
+            'count': count,
+            'sum': round(total, 6),
+            'mean': round(total / count, 6) if count else None,
+            'p50': quantiles[0.5],
+            'p95': quantiles[0.95],
+            'p99': quantiles[0.99]
+        }
+
+
+class MetricsRegistry:
+    """一组指标：全局一个，每台转台一个（带 rig 标签），每个扫描任务另有一个
+
+    带标签的注册表在 scoped() 中代替全局注册表，而不是额外记录一份，
+    这样导出的各标签序列相加正好是整个进程的值。
+    """
+
+    def __init__(self, labels=None):
+        self.metrics = {}
+        self.labels = dict(labels or {})
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        metric = self.metrics.get(name)
+        if metric is None:
+            kind, help_text = DEFINITIONS[name]
+            with self._lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = Histogram(name, help_text) if kind == 'histogram' else Counter(name, help_text)
+                    self.metrics[name] = metric
+        return metric
+
+    def summary(self):
+        """JSON汇总"""
+        return {name: metric.summary() for name, metric in sorted(self.metrics.items())}
+
+    def render_prometheus(self):
+        """Prometheus文本格式"""
+        return render_prometheus([self])
+
+
+def _label_text(labels, **extra):
+    items = list(labels.items()) + list(extra.items())
+    if not items:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in items) + '}'
+
+
+def render_prometheus(registries):
+    """把多个注册表按指标名合并导出，每个注册表的 labels 成为各自序列的标签"""
+    names = sorted({name for registry in registries for name in registry.metrics})
+    lines = []
+    for name in names:
+        full_name = PREFIX + name
+        series = [(registry.labels, registry.metrics[name]) for registry in registries
+                  if name in registry.metrics]
+        help_text = series[0][1].help
+        if isinstance(series[0][1], Counter):
+            lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} counter")
+            for labels, metric in series:
+                lines.append(f"{full_name}{_label_text(labels)} {metric.value}")
+            continue
+
+        lines.append(f"# HELP {full_name} {help_text}")
+        lines.append(f"# TYPE {full_name} histogram")
+        for labels, metric in series:
+            with metric._lock:
+                bucket_counts = list(metric.bucket_counts)
+                count, total = metric.count, metric.sum
+            cumulative = 0
+            for bound, bucket_count in zip(metric.buckets, bucket_counts):
+                cumulative += bucket_count
+                lines.append(f'{full_name}_bucket{_label_text(labels, le=bound)} {cumulative}')
+            lines.append(f'{full_name}_bucket{_label_text(labels, le="+Inf")} {count}')
+            lines.append(f"{full_name}_sum{_label_text(labels)} {total}")
+            lines.append(f"{full_name}_count{_label_text(labels)} {count}")
+        lines.append(f"# HELP {full_name}_quantile {help_text}（最近样本的百分位数）")
+        lines.append(f"# TYPE {full_name}_quantile gauge")
+        for labels, metric in series:
+            for q, value in metric.quantiles().items():
+                if value is not None:
+                    lines.append(f'{full_name}_quantile{_label_text(labels, quantile=q)} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+# 线程内额外记录指标的注册表（例如当前扫描任务的注册表）
+_scopes = threading.local()
+
+
+def current_scopes():
+    """当前线程的额外注册表，提交后台任务时传给 scoped() 以便继续记录"""
+    return getattr(_scopes, 'registries', ())
+
+
+@contextmanager
+def scoped(registries):
+    """在此上下文中记录的指标同时写入 registries"""
+    previous = current_scopes()
+    combined = previous
+    for registry in registries:
+        if registry not in combined:
+            combined += (registry,)
+    _scopes.registries = combined
+    try:
+        yield
+    finally:
+        _scopes.registries = previous
+
+
+class BoundScope:
+    """构造时捕获的额外注册表，可以在任意线程中反复进入"""
+
+    def __init__(self, registries):
+        self.registries = tuple(registries)
+        self._contexts = threading.local()
+
+    def __enter__(self):
+        context = scoped(self.registries)
+        context.__enter__()
+        self._contexts.__dict__.setdefault('stack', []).append(context)
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._contexts.stack.pop().__exit__(*exc_info)
+
+
+def bind_current_scope():
+    """捕获当前线程的额外注册表
+
+    转台的组件在 Rig 的 scoped() 中构造，但指标多在组件自己的后台线程（工作线程、上传线程、
+    采集线程等）中记录，那里没有转台的注册表。组件在构造函数中调用本函数保存返回值，
+    在后台线程中用 `with self._metrics_scope:` 把指标继续记到所属转台。
+    """
+    return BoundScope(current_scopes())
+
+
+def _registries():
+    """本线程要写入的注册表：有带标签的注册表（转台）时由它代替全局注册表"""
+    scopes = current_scopes()
+    if any(registry.labels for registry in scopes):
+        return scopes
+    return (REGISTRY,) + scopes
+
+
+def observe(name, value):
+    """记录一个直方图样本"""
+    for registry in _registries():
+        registry.get(name).observe(value)
+
+
+def inc(name, amount=1):
+    """计数器加 amount"""
+    for registry in _registries():
+        registry.get(name).inc(amount)
+
+
+@contextmanager
+def timed(name):
+    """记录代码块耗时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+"""
+感知哈希模块
+在缩小的灰度画面上计算64位 dHash / pHash，用汉明距离判断两张照片是否几乎相同
+"""
+
+import cv2
+import numpy as np
+
+HASH_METHODS = ('dhash', 'phash')
+
+
+def decode_gray(jpeg_bytes):
+    """解码JPEG为1/8尺寸的灰度图（解码器直接缩小，比完整解码快得多）"""
+    return cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_8)
+
+
+def _pack_bits(bits):
+    return int.from_bytes(np.packbits(bits.flatten()).tobytes(), 'big')
+
+
+def dhash(gray, hash_size=8):
+    """差异哈希：缩小到 (hash_size+1) x hash_size，比较每行相邻像素的亮度"""
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _pack_bits(small[:, 1:] > small[:, :-1])
+
+
+def phash(gray, hash_size=8, highfreq_factor=4):
+    """感知哈希：缩小后做DCT，低频系数与中位数（不含直流分量）比较"""
+    size = hash_size * highfreq_factor
+    small = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:hash_size, :hash_size]
+    return _pack_bits(low > np.median(low.flatten()[1:]))
+
+
+def image_hash(jpeg_bytes, method='dhash'):
+    """JPEG照片的感知哈希（整数），无法解码时返回 None"""
+    if method not in HASH_METHODS:
+        raise ValueError(f"未知的哈希方法: {method}")
+    gray = decode_gray(jpeg_bytes)
+    if gray is None:
+        return None
+    return dhash(gray) if method == 'dhash' else phash(gray)
+
+
+def hamming_distance(a, b):
+    return bin(a ^ b).count('1')
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""
+照片角度索引模块
+按实际拍摄角度索引已拍的全分辨率照片，阶段3可以直接复用角度足够接近的照片而不必转动电机
+"""
+
+import bisect
+import os
+import threading
+import time
+from collections import namedtuple
+
+# 一张已索引的照片；exposure 为相机返回的曝光信息（曝光时间、增益），没有时为空字典
+IndexedPhoto = namedtuple('IndexedPhoto', ['angle', 'photo_name', 'path', 'scan_id', 'captured_at',
+                                           'exposure', 'kind'])
+
+# 从相机元数据中保留的曝光字段
+EXPOSURE_FIELDS = ('ExposureTime', 'AnalogueGain', 'DigitalGain', 'Lux')
+
+
+def angle_distance(a, b):
+    """两个角度在圆周上的距离（0~180度）"""
+    diff = abs(a - b) % 360
+    return min(diff, 360 - diff)
+
+
+class PhotoIndex:
+    """按角度排序的照片索引
+
+    同一个文件被新照片覆盖时旧记录随之删除，因此索引中的记录总是对应磁盘上的当前内容。
+    查询默认只在同一次扫描内进行：不同扫描之间转台上的物体可能已经变化。
+    """
+
+    def __init__(self, max_entries=2000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._angles = []   # 与 _entries 一一对应的角度，用于二分查找
+        self._entries = []
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, angle, photo_name, path, scan_id=None, exposure=None, kind='full', captured_at=None):
+        """索引一张照片，返回索引记录"""
+        angle = float(angle) % 360
+        exposure = {key: exposure[key] for key in EXPOSURE_FIELDS if key in exposure} if exposure else {}
+        entry = IndexedPhoto(angle, photo_name, path, scan_id, captured_at or time.time(), exposure, kind)
+        with self._lock:
+            self._remove_path(path)
+            if len(self._entries) >= self.max_entries:
+                # 删除最早拍摄的记录
+                oldest = min(range(len(self._entries)), key=lambda i: self._entries[i].captured_at)
+                del self._angles[oldest], self._entries[oldest]
+            position = bisect.bisect_right(self._angles, angle)
+            self._angles.insert(position, angle)
+            self._entries.insert(position, entry)
+        return entry
+
+    def _remove_path(self, path):
+        for i in range(len(self._entries) - 1, -1, -1):
+            if self._entries[i].path == path:
+                del self._angles[i], self._entries[i]
+
+    def lookup(self, angle, tolerance, scan_id=None):
+        """角度差不超过 tolerance 的最接近的照片（文件必须存在），没有时返回 None"""
+        angle = float(angle) % 360
+        with self._lock:
+            if scan_id is None and self._entries:
+                # 最接近的只可能在插入点两侧（跨越0度时是首尾两条）
+                position = bisect.bisect_left(self._angles, angle)
+                indexes = {position - 1, position % len(self._entries), 0, len(self._entries) - 1}
+            else:
+                indexes = [i for i, entry in enumerate(self._entries) if entry.scan_id == scan_id]
+            candidates = sorted((angle_distance(self._entries[i].angle, angle), i) for i in indexes)
+            for distance, i in candidates:
+                if distance > tolerance:
+                    break
+                entry = self._entries[i]
+                if entry.path and os.path.exists(entry.path):
+                    self.hits += 1
+                    return entry
+            self.misses += 1
+            return None
+
+    def get(self, path):
+        """文件对应的索引记录（文件已被其他照片覆盖或从未索引时返回 None）"""
+        with self._lock:
+            for entry in self._entries:
+                if entry.path == path:
+                    return entry
+            return None
+
+    def entries(self, scan_id=None):
+        with self._lock:
+            return [entry for entry in self._entries if scan_id is None or entry.scan_id == scan_id]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'scans': len({entry.scan_id for entry in self._entries}),
+                'hits': self.hits,
+                'misses': self.misses
+            }
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+"""
+内存照片缓冲与异步落盘模块
+照片编码到可复用的内存缓冲区，上传直接读取缓冲区，落盘在后台线程批量完成
+"""
+
+import errno
+import io
+import logging
+import os
+import queue
+import threading
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class PhotoBuffer:
+    """可复用的JPEG内存缓冲区，引用计数归零后回到缓冲池"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.file = io.BytesIO()
+        self.name = None
+        self._refs = 0
+        self._lock = threading.Lock()
+
+    def reset(self, name=None):
+        self.file.seek(0)
+        self.file.truncate(0)
+        self.name = name
+        self.file.name = name
+        self._refs = 1
+
+    def retain(self):
+        """增加一个使用者（上传、落盘等）"""
+        with self._lock:
+            self._refs += 1
+        return self
+
+    def release(self):
+        """使用者用完后调用，最后一个使用者释放时缓冲区回到缓冲池"""
+        with self._lock:
+            self._refs -= 1
+            done = self._refs <= 0
+        if done:
+            self.pool.put_back(self)
+
+    def size(self):
+        return self.file.getbuffer().nbytes
+
+    def rewind(self):
+        """把读取位置移回开头，交给上传前调用"""
+        self.file.seek(0)
+        return self.file
+
+
+class PhotoBufferPool:
+    """固定数量的照片缓冲区；全部在用时 acquire 阻塞，形成背压"""
+
+    def __init__(self, count=6):
+        self.count = count
+        self._free = queue.Queue()
+        for _ in range(count):
+            self._free.put(PhotoBuffer(self))
+
+    def acquire(self, name=None, timeout=None):
+        try:
+            buffer = self._free.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        buffer.reset(name)
+        return buffer
+
+    def put_back(self, buffer):
+        self._free.put(buffer)
+
+    def available(self):
+        return self._free.qsize()
+
+
+class AsyncPhotoWriter:
+    """后台批量写照片文件
+
+    fsync 策略：
+        'none'  - 只写入页缓存，由系统决定何时落盘
+        'batch' - 每批写完后对每个文件和目录 fsync 一次
+        'each'  - 每个文件写完立即 fsync
+
+    on_written(路径) 在照片写完（按策略 fsync 之后）由写入线程调用，例如用于生成缩略图。
+    """
+
+    def __init__(self, fsync='batch', batch_size=8, on_written=None):
+        if fsync not in ('none', 'batch', 'each'):
+            raise ValueError(f"未知的fsync策略: {fsync}")
+        self.fsync = fsync
+        self.batch_size = batch_size
+        self.on_written = on_written
+        self.written = 0
+        self.bytes_written = 0
+        self.errors = 0
+        self._queue = queue.Queue()
+        self._metrics_scope = metrics.bind_current_scope()
+        self._thread = threading.Thread(target=self._loop, name="photo-writer", daemon=True)
+        self._thread.start()
+
+    def write(self, path, data):
+        """提交一次写入；data 为 bytes 或 PhotoBuffer（写完后自动 release）"""
+        self._queue.put((path, data))
+
+    def flush(self):
+        """等待已提交的写入全部完成"""
+        self._queue.join()
+
+    def pending(self):
+        return self._queue.unfinished_tasks
+
+    def _loop(self):
+        with self._metrics_scope:
+            self._drain()
+
+    def _drain(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch(batch)
+            except Exception:
+                # 写入线程不能退出，否则之后的缓冲区永远不会释放，flush() 也会一直等待
+                logger.exception("批量保存照片出错")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _write_batch(self, batch):
+        opened = []
+        written = []
+        try:
+            for path, data in batch:
+                try:
+                    f = open(path, 'wb')
+                    opened.append((path, f))
+                    if isinstance(data, PhotoBuffer):
+                        with data.file.getbuffer() as view:
+                            f.write(view)
+                            size = view.nbytes
+                    else:
+                        f.write(data)
+                        size = len(data)
+                    if self.fsync == 'each':
+                        f.flush()
+                        os.fsync(f.fileno())
+                    self.written += 1
+                    self.bytes_written += size
+                    written.append(path)
+                except Exception as e:
+                    self._record_error(path, e)
+                finally:
+                    if isinstance(data, PhotoBuffer):
+                        data.release()
+
+            if self.fsync == 'batch':
+                for path, f in opened:
+                    if path not in written:
+                        continue
+                    try:
+                        f.flush()
+                        os.fsync(f.fileno())
+                    except OSError as e:
+                        self._record_error(path, e)
+                        written.remove(path)
+                failed_dirs = self._fsync_dirs(set(os.path.dirname(path) or '.' for path in written))
+                for path in [path for path in written if (os.path.dirname(path) or '.') in failed_dirs]:
+                    self._record_error(path, '目录fsync失败')
+                    written.remove(path)
+        finally:
+            for path, f in opened:
+                try:
+                    f.close()
+                except OSError as e:
+                    if path in written:
+                        self._record_error(path, e)
+                        written.remove(path)
+        if self.on_written:
+            for path in written:
+                try:
+                    self.on_written(path)
+                except Exception as e:
+                    logger.error("照片写入回调出错: %s: %s", path, e)
+
+    def _record_error(self, path, error):
+        """一张照片没有写入（或没有落盘）：计数并记录日志，不调用 on_written"""
+        self.errors += 1
+        metrics.inc('photo_write_errors_total')
+        logger.error("保存照片失败: %s: %s", path, error)
+
+    def _fsync_dirs(self, dirs):
+        """fsync 目录，保证新文件的目录项也落盘；返回 fsync 失败的目录
+
+        打不开的目录和不支持对目录 fsync 的文件系统（EINVAL）视为成功
+        """
+        failed = set()
+        for directory in dirs:
+            try:
+                fd = os.open(directory, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                os.fsync(fd)
+            except OSError as e:
+                if e.errno not in (errno.EINVAL, errno.ENOTSUP):
+                    logger.error("目录fsync失败: %s: %s", directory, e)
+                    failed.add(directory)
+            finally:
+                os.close(fd)
+        return failed
+
+    def stats(self):
+        return {
+            'fsync': self.fsync,
+            'written': self.written,
+            'bytes_written': self.bytes_written,
+            'errors': self.errors,
+            'pending': self.pending()
+        }
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+照片缩略图模块
+在后台进程池中为每张照片生成缩略图和中等尺寸图，按原图内容摘要存放在有容量上限的缓存目录中
+"""
+
+import hashlib
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import cv2
+import numpy as np
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 缩略图规格：名称 -> (最大宽度, 最大高度, JPEG质量)
+RENDITION_SIZES = {
+    'thumb': (320, 180, 75),
+    'medium': (960, 540, 85),
+}
+
+_REDUCED_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                  (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def rendition_path(cache_dir, digest, name):
+    """缓存文件路径：按摘要前两位分目录，同一内容的照片只生成一次"""
+    return os.path.join(cache_dir, digest[:2], f"{digest}_{name}.jpg")
+
+
+def _init_worker():
+    # 每个工作进程只用一个OpenCV线程，避免和主进程争抢CPU
+    cv2.setNumThreads(1)
+
+
+def build_renditions(source_path, cache_dir, sizes):
+    """在工作进程中执行：读取原图，生成缺少的各尺寸缩略图
+
+    返回 (原图摘要, {名称: (缓存文件路径, 字节数)})。
+    """
+    with open(source_path, 'rb') as f:
+        data = np.frombuffer(f.read(), dtype=np.uint8)
+    digest = hashlib.sha256(data).hexdigest()
+    missing = {name: spec for name, spec in sizes.items()
+               if not os.path.exists(rendition_path(cache_dir, digest, name))}
+    if missing:
+        # 先用1/8解码得到大致尺寸，再按最大的缩略图选择解码器的缩小倍数，只完整解码一次
+        preview = cv2.imdecode(data, cv2.IMREAD_REDUCED_GRAYSCALE_8)
+        if preview is None:
+            raise ValueError(f"无法解码照片: {source_path}")
+        width, height = preview.shape[1] * 8, preview.shape[0] * 8
+        scales = {name: min(w / width, h / height, 1.0) for name, (w, h, _) in missing.items()}
+        largest = max(scales.values())
+        flag = next((flag for factor, flag in _REDUCED_FLAGS if largest * factor <= 1.0), cv2.IMREAD_COLOR)
+        image = cv2.imdecode(data, flag)
+        for name, (_, _, quality) in missing.items():
+            target = (max(1, round(width * scales[name])), max(1, round(height * scales[name])))
+            resized = image if (image.shape[1], image.shape[0]) == target else cv2.resize(
+                image, target, interpolation=cv2.INTER_AREA)
+            ok, encoded = cv2.imencode('.jpg', resized, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                raise ValueError(f"缩略图编码失败: {source_path}")
+            path = rendition_path(cache_dir, digest, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                f.write(encoded.tobytes())
+            os.replace(tmp_path, path)
+    results = {}
+    for name in sizes:
+        path = rendition_path(cache_dir, digest, name)
+        results[name] = (path, os.path.getsize(path))
+    return digest, results
+
+
+class RenditionCache:
+    """缩略图缓存
+
+    submit() 在后台进程池中生成缩略图（照片落盘后调用），get() 返回缓存文件，
+    缺少时同步等待生成。缓存文件以原图内容的SHA-256命名，总大小超过 max_bytes 时
+    删除最久未使用的文件。工作进程异常退出（例如生成缩略图时内存不足被杀）后进程池不能再用，
+    此时进程中已有其他线程，不能再 fork 新的进程池，改用线程生成缩略图。
+    """
+
+    def __init__(self, cache_dir='cache/renditions', max_bytes=64 * 1024 * 1024, workers=1,
+                 sizes=None):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = max_bytes
+        self.workers = workers
+        self.sizes = dict(sizes or RENDITION_SIZES)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._executor = None
+        # 原图路径 -> (mtime_ns, 字节数, 摘要)，原图被覆盖后重新计算
+        self._sources = {}
+        self._pending = {}
+        # 缓存文件 -> 字节数，按最近使用排序
+        self._files = OrderedDict()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.errors = 0
+        self._load_existing()
+
+    def _load_existing(self):
+        """启动时登记已有的缓存文件，按修改时间作为使用顺序"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                if name.endswith('.tmp'):
+                    os.remove(path)
+                    continue
+                stat = os.stat(path)
+                found.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(found):
+            self._files[path] = size
+            self._total_bytes += size
+        self._evict()
+
+    def start(self):
+        """创建进程池并立即启动全部工作进程
+
+        工作进程用 fork 创建（spawn/forkserver 会在子进程中重新导入 app.py 并再次初始化硬件），
+        必须在进程启动任何其他线程（日志、串口、相机、上传、HTTP）之前调用：
+        fork 一个多线程进程时，子进程可能继承被其他线程持有的锁而死锁。
+        """
+        executor = self._get_executor()
+        if isinstance(executor, ProcessPoolExecutor):
+            # fork 方式下第一次提交时一次创建全部工作进程
+            executor.submit(_init_worker).result()
+        return self
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                if 'fork' not in multiprocessing.get_all_start_methods():
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="rendition")
+                elif threading.active_count() > 1:
+                    # 没有在启动时创建进程池：此时已有其他线程，fork 不安全，改用线程
+                    logger.warning("缩略图进程池未在启动时创建，改用线程生成缩略图")
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers,
+                                                        thread_name_prefix="rendition")
+                else:
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers,
+                                                         mp_context=multiprocessing.get_context('fork'),
+                                                         initializer=_init_worker)
+            return self._executor
+
+    def _replace_broken_pool(self):
+        """进程池已损坏（工作进程异常退出）时换成线程池"""
+        with self._lock:
+            executor = self._executor
+            if not isinstance(executor, ProcessPoolExecutor):
+                return
+            logger.warning("缩略图工作进程异常退出，改用线程生成缩略图")
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="rendition")
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def _submit_build(self, source_path):
+        try:
+            return self._get_executor().submit(build_renditions, source_path, self.cache_dir, self.sizes)
+        except BrokenProcessPool:
+            self._replace_broken_pool()
+            return self._get_executor().submit(build_renditions, source_path, self.cache_dir, self.sizes)
+
+    def _source_key(self, source_path):
+        stat = os.stat(source_path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def submit(self, source_path):
+        """在后台生成照片的缩略图，返回 Future（已是最新时返回 None）"""
+        try:
+            key = self._source_key(source_path)
+        except OSError:
+            return None
+        with self._lock:
+            known = self._sources.get(source_path)
+            if known and known[:2] == key and self._has_all(known[2]):
+                return None
+            pending = self._pending.get(source_path)
+            if pending and pending[0] == key:
+                return pending[1]
+        started = time.perf_counter()
+        future = self._submit_build(source_path)
+        with self._lock:
+            self._pending[source_path] = (key, future)
+        future.add_done_callback(lambda f: self._on_built(source_path, key, started, f))
+        return future
+
+    def _has_all(self, digest):
+        return all(rendition_path(self.cache_dir, digest, name) in self._files for name in self.sizes)
+
+    def _on_built(self, source_path, key, started, future):
+        with self._lock:
+            if self._pending.get(source_path, (None, None))[1] is future:
+                del self._pending[source_path]
+        try:
+            digest, results = future.result()
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"生成缩略图失败: {source_path}: {e}")
+            if isinstance(e, BrokenProcessPool):
+                self._replace_broken_pool()
+            return
+        metrics.observe('rendition_seconds', time.perf_counter() - started)
+        with self._lock:
+            self._sources[source_path] = (key[0], key[1], digest)
+            for path, size in results.values():
+                if path not in self._files:
+                    self._files[path] = size
+                    self._total_bytes += size
+                self._files.move_to_end(path)
+        self._evict()
+
+    def _evict(self):
+        """总大小超过上限时删除最久未使用的缓存文件"""
+        with self._lock:
+            while self._total_bytes > self.max_bytes and len(self._files) > 1:
+                path, size = self._files.popitem(last=False)
+                self._total_bytes -= size
+                self.evicted += 1
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def get(self, source_path, name, timeout=30):
+        """返回 (缓存文件路径, 原图摘要)；原图不存在时返回 None，缺少缩略图时同步生成"""
+        if name not in self.sizes:
+            raise ValueError(f"未知的缩略图规格: {name}")
+        try:
+            key = self._source_key(source_path)
+        except OSError:
+            return None
+        with self._lock:
+            known = self._sources.get(source_path)
+            if known and known[:2] == key:
+                path = rendition_path(self.cache_dir, known[2], name)
+                if path in self._files and os.path.exists(path):
+                    self._files.move_to_end(path)
+                    self.hits += 1
+                    return path, known[2]
+            self.misses += 1
+        future = self.submit(source_path)
+        if future is None:
+            with self._lock:
+                known = self._sources.get(source_path)
+            digest = known[2] if known else None
+        else:
+            # 完成回调可能还没有登记结果，直接使用任务的返回值
+            try:
+                digest, _ = self._wait_built(source_path, future, timeout)
+            except Exception:
+                return None
+        if digest is None:
+            return None
+        path = rendition_path(self.cache_dir, digest, name)
+        return (path, digest) if os.path.exists(path) else None
+
+    def _wait_built(self, source_path, future, timeout):
+        """等待生成结果；任务因进程池损坏而失败时在新的执行器上重新生成一次"""
+        try:
+            return future.result(timeout=timeout)
+        except BrokenProcessPool:
+            self._replace_broken_pool()
+            with self._lock:
+                if self._pending.get(source_path, (None, None))[1] is future:
+                    del self._pending[source_path]
+            retry = self.submit(source_path)
+            if retry is not None:
+                return retry.result(timeout=timeout)
+            # 其他请求已经重新生成
+            with self._lock:
+                known = self._sources.get(source_path)
+            if known is None:
+                raise
+            return known[2], None
+
+    def stats(self):
+        with self._lock:
+            return {
+                'cache_dir': self.cache_dir,
+                # process 为启动时 fork 的进程池，thread 为回退的线程池，None 为尚未创建
+                'executor': None if self._executor is None else (
+                    'process' if isinstance(self._executor, ProcessPoolExecutor) else 'thread'),
+                'files': len(self._files),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'pending': len(self._pending),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evicted': self.evicted,
+                'errors': self.errors
+            }
+
+    def close(self):
+        with self._lock:
+            executor = self._executor
+            self._executor = None
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+多转台模块
+一台主机同时驱动多套转台和相机：每套（rig）有自己的串口、相机编号、队友地址、
+照片目录和扫描工作线程，各套之间的扫描并行且互不影响
+"""
+
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+
+import metrics
+from arduino_controller import ArduinoController
+from camera_controller import CameraController
+from events import EventBus
+from photo_writer import AsyncPhotoWriter
+from scan_jobs import ScanJobManager
+from teammate_sender import TeammateSender
+from upload_spool import UploadSpool
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEAMMATE_URL = "http://192.168.235.41:5000"
+
+_RIG_ID = re.compile(r'^[A-Za-z0-9_-]{1,32}$')
+
+
+def parse_rig_configs(data, teammate_url=None):
+    """校验多转台配置列表，返回补全默认值的配置，配置无效时抛出 ValueError
+
+    每项为 {"id": "rig1", "port": "/dev/ttyACM1", "camera_index": 1, "teammate_url": "..."}，
+    可选 photos_dir（默认 photos/<id>）、checkpoint_dir（默认 checkpoints/<id>）、
+    spool（默认 spool/uploads_<id>.db）。各转台的串口、相机编号和目录不能重复。
+    """
+    if not isinstance(data, list) or not data:
+        raise ValueError("转台配置应为非空列表")
+    configs = []
+    for i, item in enumerate(data):
+        if not isinstance(item, dict):
+            raise ValueError(f"第{i + 1}个转台配置不是对象")
+        rig_id = str(item.get('id', f"rig{i}"))
+        if not _RIG_ID.match(rig_id):
+            raise ValueError(f"转台ID只能包含字母、数字、-和_: {rig_id}")
+        try:
+            camera_index = int(item.get('camera_index', i))
+        except (TypeError, ValueError):
+            raise ValueError(f"转台{rig_id}的 camera_index 不是整数")
+        configs.append({
+            'id': rig_id,
+            'port': item.get('port') or f"/dev/ttyACM{i}",
+            'camera_index': camera_index,
+            'teammate_url': item.get('teammate_url') or teammate_url or DEFAULT_TEAMMATE_URL,
+            'photos_dir': item.get('photos_dir') or f"photos/{rig_id}",
+            'checkpoint_dir': item.get('checkpoint_dir') or f"checkpoints/{rig_id}",
+            'spool': item.get('spool') or f"spool/uploads_{rig_id}.db",
+            'job_prefix': item.get('job_prefix', f"{rig_id}-")
+        })
+    for key in ('id', 'port', 'camera_index', 'photos_dir', 'checkpoint_dir', 'spool'):
+        values = [config[key] for config in configs]
+        if len(set(values)) != len(values):
+            raise ValueError(f"转台配置中的 {key} 有重复")
+    return configs
+
+
+def load_rig_configs(path, teammate_url=None):
+    """从JSON文件读取转台配置（列表，或 {"rigs": [...]}）"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        data = data.get('rigs')
+    return parse_rig_configs(data, teammate_url=teammate_url)
+
+
+class Rig:
+    """一套转台和相机，以及它独占的扫描任务队列"""
+
+    def __init__(self, config, serial_factory=None, camera_factory=None, startup_delay=2,
+                 on_photo_written=None, **manager_options):
+        self.id = config['id']
+        self.config = dict(config)
+        # 本转台的指标带 rig 标签：各组件在这里构造，它们的后台线程记到这个注册表而不是全局注册表
+        self.metrics = metrics.MetricsRegistry(labels={'rig': self.id})
+        with metrics.scoped([self.metrics]):
+            self.arduino = ArduinoController(port=config['port'], serial_factory=serial_factory,
+                                             startup_delay=startup_delay)
+            self.camera = CameraController(camera_index=config['camera_index'],
+                                           photo_writer=AsyncPhotoWriter(fsync='batch', on_written=on_photo_written),
+                                           camera_factory=camera_factory, photos_dir=config['photos_dir'])
+            self.teammate = TeammateSender(config['teammate_url'], spool=UploadSpool(config['spool']))
+            # 阶段2等待的角度数据，由 /rigs/<id>/api/receive_angles 更新
+            self.latest_angles = {
+                'angles': None,
+                'timestamp': None,
+                'status': '等待数据'
+            }
+            # 本转台的事件总线，/rigs/<id>/api/events 订阅
+            self.events = EventBus()
+            self.scan_jobs = ScanJobManager(self.arduino, self.camera, self.teammate, self.latest_angles,
+                                            events=self.events, checkpoint_dir=config['checkpoint_dir'],
+                                            job_prefix=config['job_prefix'],
+                                            worker_name=f"scan-worker-{self.id}", **manager_options)
+
+    def to_dict(self):
+        current = self.scan_jobs.current_job
+        return {
+            'id': self.id,
+            'port': self.config['port'],
+            'camera_index': self.config['camera_index'],
+            'teammate_url': self.config['teammate_url'],
+            'photos_dir': self.config['photos_dir'],
+            'serial_connected': self.arduino.is_connected(),
+            'camera_initialized': self.camera.picam2 is not None,
+            'current_job': current.job_id if current else None,
+            'angles': self.latest_angles['angles']
+        }
+
+    def event_snapshot(self):
+        """SSE新连接先收到的当前状态：角度数据和当前（或最近一次）任务"""
+        job = self.scan_jobs.current_job or next(reversed(self.scan_jobs.list_jobs()), None)
+        return {
+            'rig': self.id,
+            'angles': dict(self.latest_angles),
+            'job': job.event_data() if job else None
+        }
+
+    def close(self):
+        self.camera.release_camera()
+        self.arduino.close()
+        # 等排队中的上传完成（失败的写入待发队列），再停止重发线程、关闭连接池会话和待发队列；
+        # 未送达的记录留在数据库中，下次启动时重发
+        self.teammate.shutdown_uploads(wait_for_pending=True)
+        self.teammate.spool.close()
+
+
+class RigRegistry:
+    """按ID登记的转台，第一个登记的为默认转台（旧的不带前缀的接口使用它）"""
+
+    def __init__(self):
+        self._rigs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def add(self, rig):
+        with self._lock:
+            if rig.id in self._rigs:
+                raise ValueError(f"转台ID重复: {rig.id}")
+            self._rigs[rig.id] = rig
+        logger.info(f"登记转台 {rig.id}: 串口{rig.config['port']}，相机{rig.config['camera_index']}")
+        return rig
+
+    def get(self, rig_id):
+        with self._lock:
+            return self._rigs.get(rig_id)
+
+    @property
+    def default(self):
+        with self._lock:
+            return next(iter(self._rigs.values()), None)
+
+    def all(self):
+        with self._lock:
+            return list(self._rigs.values())
+
+    def __len__(self):
+        return len(self._rigs)
+
+    def close(self):
+        for rig in self.all():
+            try:
+                rig.close()
+            except Exception as e:
+                logger.warning(f"关闭转台{rig.id}出错: {e}")
@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+扫描归档导出模块
+把一次扫描的照片和JSON清单打包成TAR或ZIP边读边发，不在内存或临时文件中生成整个归档
+
+归档的布局（每个成员的头部、数据和结尾的位置）在发送前全部算好，因此总长度已知，
+Range请求可以直接定位到对应的文件偏移，内存占用与扫描大小无关。
+"""
+
+import hashlib
+import io
+import json
+import os
+import struct
+import tarfile
+import time
+import zlib
+from datetime import datetime
+
+from scan_planning import steps_to_degrees
+
+ARCHIVE_FORMATS = ('tar', 'zip')
+CHUNK_SIZE = 64 * 1024
+
+# ZIP 不使用 ZIP64 扩展时的上限
+_ZIP_LIMIT = 0xFFFFFFFF
+_ZIP_FLAGS = 0x0808  # 数据后带描述符（CRC在发送数据时计算）+ 文件名为UTF-8
+_ZIP_VERSION = 20
+
+
+class ArchiveError(Exception):
+    """照片在发送过程中被修改或删除，归档无法按预先计算的布局继续发送"""
+
+
+def scan_photos(job, photo_index):
+    """扫描任务在磁盘上的照片和清单
+
+    照片来自照片索引中属于该任务、且文件仍为该任务拍摄内容的记录（后续扫描覆盖同名文件时
+    索引记录随之删除）。返回 (清单字典, [(归档内文件名, 路径, os.stat结果), ...])。
+    """
+    members = []
+    photos = []
+    for entry in sorted(photo_index.entries(scan_id=job.job_id), key=lambda e: e.photo_name):
+        try:
+            stat = os.stat(entry.path)
+        except OSError:
+            continue
+        name = f"photos/{entry.photo_name}"
+        members.append((name, entry.path, stat))
+        step = None
+        if entry.photo_name.startswith('rotation_') and entry.photo_name[9:12].isdigit():
+            step = int(entry.photo_name[9:12])
+        photos.append({
+            'file': name,
+            'kind': entry.kind,
+            'step': step,
+            'angle': entry.angle,
+            'captured_at': datetime.fromtimestamp(entry.captured_at).isoformat(timespec='milliseconds'),
+            'bytes': stat.st_size,
+            'exposure': entry.exposure
+        })
+    files = {name for name, _, _ in members}
+
+    checkpoint = job.checkpoint_snapshot()
+    angles = checkpoint['angles']
+    stage3_photos = checkpoint['stage3_photos'] or []
+    uploads = checkpoint['uploads']
+    # 阶段3的角度照片：复用阶段1照片时指向该照片，不重复打包
+    stage3 = []
+    for i, photo in enumerate(stage3_photos):
+        if not photo:
+            continue
+        source = photo.get('cached_photo') or photo['photo']
+        stage3.append({
+            'angle_number': i + 1,
+            'angle': angles[i] if angles and i < len(angles) else None,
+            'source': photo['source'],
+            'file': f"photos/{source}" if f"photos/{source}" in files else None
+        })
+
+    manifest = {
+        'job_id': job.job_id,
+        'status': job.status,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+        'params': job.params,
+        'angles': angles,
+        'step_degrees': steps_to_degrees(1),
+        'photos': photos,
+        'stage3': stage3,
+        'uploads': uploads
+    }
+    return manifest, members
+
+
+def _dos_datetime(mtime):
+    t = time.localtime(max(mtime, 315532800))  # ZIP时间从1980年开始
+    return ((t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+            ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday)
+
+
+class StreamingArchive:
+    """预先计算布局的TAR/ZIP归档
+
+    布局为一串片段：内存中的字节（头部、清单）、磁盘上的照片、以及ZIP中依赖CRC的
+    数据描述符和中央目录（发送到时才生成）。照片的大小和修改时间在布局时记录，
+    发送时不一致则抛出 ArchiveError。
+    """
+
+    def __init__(self, fmt, root, manifest, members):
+        if fmt not in ARCHIVE_FORMATS:
+            raise ValueError(f"未知的归档格式: {fmt}")
+        self.format = fmt
+        self.root = root
+        self.manifest_bytes = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        manifest_mtime = max([stat.st_mtime for _, _, stat in members] or [0])
+        # (归档内文件名, 路径, 大小, 修改时间, mtime_ns)；路径为 None 的是清单
+        self.members = [(f"{root}/manifest.json", None, len(self.manifest_bytes), manifest_mtime, 0)]
+        self.members += [(f"{root}/{name}", path, stat.st_size, stat.st_mtime, stat.st_mtime_ns)
+                         for name, path, stat in members]
+        self._parts = []  # (起始偏移, 长度, 类型, 内容)
+        self.size = 0
+        self._crcs = {0: zlib.crc32(self.manifest_bytes)}
+        if fmt == 'tar':
+            self._layout_tar()
+        else:
+            self._layout_zip()
+        digest = hashlib.sha1(fmt.encode())
+        digest.update(self.manifest_bytes)
+        for name, _, size, _, mtime_ns in self.members:
+            digest.update(f"{name}\0{size}\0{mtime_ns}\0".encode())
+        self.etag = digest.hexdigest()[:32]
+        self.last_modified = manifest_mtime
+
+    @property
+    def mimetype(self):
+        return 'application/x-tar' if self.format == 'tar' else 'application/zip'
+
+    def _add(self, kind, length, content):
+        if length:
+            self._parts.append((self.size, length, kind, content))
+            self.size += length
+
+    def _add_member_data(self, index):
+        _, path, size, _, mtime_ns = self.members[index]
+        if path is None:
+            self._add('bytes', size, self.manifest_bytes)
+        else:
+            self._add('file', size, (index, path, mtime_ns))
+
+    def _layout_tar(self):
+        for index, (name, _, size, mtime, _) in enumerate(self.members):
+            info = tarfile.TarInfo(name)
+            info.size = size
+            info.mtime = int(mtime)
+            info.mode = 0o644
+            header = info.tobuf(format=tarfile.USTAR_FORMAT)
+            self._add('bytes', len(header), header)
+            self._add_member_data(index)
+            self._add('bytes', -size % tarfile.BLOCKSIZE, bytes(-size % tarfile.BLOCKSIZE))
+        # 结尾两个空块，并补齐到tar记录大小
+        end = 2 * tarfile.BLOCKSIZE
+        end += -(self.size + end) % tarfile.RECORDSIZE
+        self._add('bytes', end, bytes(end))
+
+    def _layout_zip(self):
+        if len(self.members) >= 0xFFFF:
+            raise ValueError("照片数量超过ZIP上限，请使用 tar 格式")
+        offsets = []
+        for index, (name, _, size, mtime, _) in enumerate(self.members):
+            encoded = name.encode('utf-8')
+            dos_time, dos_date = _dos_datetime(mtime)
+            offsets.append(self.size)
+            header = struct.pack('<IHHHHHIIIHH', 0x04034b50, _ZIP_VERSION, _ZIP_FLAGS, 0,
+                                 dos_time, dos_date, 0, 0, 0, len(encoded), 0) + encoded
+            self._add('bytes', len(header), header)
+            self._add_member_data(index)
+            self._add('lazy', 16, ('descriptor', index))
+        directory_offset = self.size
+        directory_size = sum(46 + len(name.encode('utf-8')) for name, *_ in self.members)
+        if directory_offset + directory_size > _ZIP_LIMIT:
+            raise ValueError("归档超过4GB，请使用 tar 格式")
+        self._zip_offsets = offsets
+        self._add('lazy', directory_size, ('directory', None))
+        end = struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(self.members), len(self.members),
+                          directory_size, directory_offset, 0)
+        self._add('bytes', len(end), end)
+
+    # ---- CRC 与ZIP结构 ----
+
+    def _crc(self, index):
+        """成员的CRC32：发送数据时已算出则直接使用，否则读取文件计算（例如从中间续传）"""
+        crc = self._crcs.get(index)
+        if crc is None:
+            crc = 0
+            for chunk in self._read_file(index, 0, self.members[index][2]):
+                crc = zlib.crc32(chunk, crc)
+            self._crcs[index] = crc
+        return crc
+
+    def _lazy_bytes(self, content):
+        kind, index = content
+        if kind == 'descriptor':
+            size = self.members[index][2]
+            return struct.pack('<IIII', 0x08074b50, self._crc(index), size, size)
+        directory = io.BytesIO()
+        for index, (name, _, size, mtime, _) in enumerate(self.members):
+            encoded = name.encode('utf-8')
+            dos_time, dos_date = _dos_datetime(mtime)
+            directory.write(struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | _ZIP_VERSION,
+                                        _ZIP_VERSION, _ZIP_FLAGS, 0, dos_time, dos_date,
+                                        self._crc(index), size, size, len(encoded), 0, 0, 0, 0,
+                                        0o100644 << 16, self._zip_offsets[index]))
+            directory.write(encoded)
+        return directory.getvalue()
+
+    # ---- 发送 ----
+
+    def _read_file(self, index, start, end):
+        """读取成员文件 [start, end) 的内容，文件已被修改时抛出 ArchiveError"""
+        name, path, size, _, mtime_ns = self.members[index]
+        try:
+            f = open(path, 'rb')
+        except OSError as e:
+            raise ArchiveError(f"照片已不存在: {name}") from e
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size != size or stat.st_mtime_ns != mtime_ns:
+                raise ArchiveError(f"照片在导出过程中被修改: {name}")
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise ArchiveError(f"照片在导出过程中被截断: {name}")
+                remaining -= len(chunk)
+                yield chunk
+
+    def iter_bytes(self, start=0, end=None):
+        """按块生成归档 [start, end) 的内容"""
+        end = self.size if end is None else min(end, self.size)
+        for offset, length, kind, content in self._parts:
+            if offset + length <= start:
+                continue
+            if offset >= end:
+                break
+            lo, hi = max(start, offset) - offset, min(end, offset + length) - offset
+            if kind == 'bytes':
+                for i in range(lo, hi, CHUNK_SIZE):
+                    yield content[i:min(hi, i + CHUNK_SIZE)]
+            elif kind == 'lazy':
+                yield self._lazy_bytes(content)[lo:hi]
+            else:
+                index = content[0]
+                # 从头发送完整个文件时顺便计算CRC，ZIP描述符和中央目录不必再读一遍
+                whole = lo == 0 and hi == length and index not in self._crcs
+                crc = 0
+                for chunk in self._read_file(index, lo, hi):
+                    if whole:
+                        crc = zlib.crc32(chunk, crc)
+                    yield chunk
+                if whole:
+                    self._crcs[index] = crc
@@ -0,0 +1,1010 @@
+#!/usr/bin/env python3
+"""
+扫描任务引擎
+由单个工作线程独占Arduino和相机，按提交顺序执行两阶段旋转扫描任务
+"""
+
+import itertools
+import json
+import logging
+import os
+import queue
+import resource
+import threading
+import time
+from datetime import datetime
+
+import metrics
+from app_logging import RateLimitedLogger
+from events import EventBus
+from photo_index import PhotoIndex, angle_distance
+from photo_hash import image_hash, hamming_distance
+from scan_planning import (BASE_STEPS_PER_REVOLUTION, parse_scan_params, initial_plan, plan_runs,
+                           rotation_number, steps_to_degrees, degrees_to_steps, frame_signature,
+                           interesting_intervals, fine_positions_for_intervals,
+                           fine_positions_for_ranges, positions_to_ranges, plan_angle_order,
+                           travel_degrees)
+
+logger = logging.getLogger(__name__)
+upload_error_logger = RateLimitedLogger(logger)
+
+# 可以继续执行的任务状态（interrupted 为进程重启前未完成的任务）
+RESUMABLE_STATUSES = ('failed', 'cancelled', 'interrupted')
+
+
+class ScanCancelled(Exception):
+    """任务被取消"""
+
+
+class ScanError(Exception):
+    """扫描过程中的硬件或流程错误"""
+
+
+class ScanJob:
+    """一次扫描任务及其进度"""
+
+    def __init__(self, job_id, params=None):
+        self.job_id = job_id
+        self.params = params or {}
+        self.status = 'queued'  # queued / running / completed / failed / cancelled / interrupted
+        self.stage = None
+        self.progress = {'current': 0, 'total': 0}
+        self.message = '排队中'
+        self.error = None
+        self.result = None
+        self.created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+        # 状态变化回调 listener(job, fields)，由任务队列设置，用于发布事件
+        self.listener = None
+        # 每个阶段的墙钟时间、进程CPU时间和峰值内存
+        self.stage_timings = {}
+        self._stage_start = None
+        # 本任务的延迟指标（串口、拍照、上传等）
+        self.metrics = metrics.MetricsRegistry()
+        # 检查点：每完成一步更新，继续执行时从这里开始
+        self.checkpoint = {
+            'stage1_plan': None,     # 阶段1拍照计划 [[位置, 类型, 步长], ...]
+            'stage1_completed': 0,   # 已完成的计划条目数
+            'stage1_refined': False, # 先粗后细模式是否已追加细扫描计划
+            'stage1_done': False,
+            'position': 0,           # 阶段1中距起点的基本步数
+            'current_angle': 0,      # 最近一次确认的转台角度
+            'coarse_signatures': {}, # 粗扫描位置 -> 画面特征
+            'coarse_differences': None,
+            'fine_ranges': None,     # 细扫描的角度区间
+            'uploads': {},           # 照片文件名 -> 上传结果（None 为上传中）
+            'angles': None,          # 阶段2收到的角度
+            'stage3_plan': None,     # 阶段3的访问顺序和转动距离估算
+            'stage3_completed': 0,   # 阶段3按访问顺序已完成的角度数
+            'stage3_seconds': None,  # 阶段3每个角度的耗时（按收到的顺序）
+            'stage3_photos': None,   # 阶段3每个角度的照片及来源（按收到的顺序）
+            'homings_skipped': 0,    # 已在起点而省去的回起点次数
+            # 重复照片抑制：上一张完整上传的照片（哈希、编号、文件名）和累计字节数
+            'dedup': {'hash': None, 'rotation_number': None, 'filename': None,
+                      'photos': 0, 'references': 0, 'bytes_sent': 0, 'bytes_saved': 0},
+            'retries': 0,
+            'resumes': 0
+        }
+
+    @classmethod
+    def from_checkpoint(cls, data):
+        """从检查点文件恢复任务，运行中或排队中的任务标记为 interrupted"""
+        job = cls(data['job_id'], data.get('params'))
+        job.checkpoint.update(data['checkpoint'])
+        job.created_at = data.get('created_at', job.created_at)
+        job.error = data.get('error')
+        status = data.get('status')
+        if status in ('failed', 'cancelled'):
+            job.status = status
+            job.message = '任务失败，可以继续执行' if status == 'failed' else '任务已取消，可以继续执行'
+        else:
+            job.status = 'interrupted'
+            job.message = '程序重启前未完成，可以继续执行'
+        return job
+
+    def checkpoint_snapshot(self):
+        """检查点的副本，上传线程之后的更新不影响它"""
+        with self._lock:
+            return dict(self.checkpoint, uploads=dict(self.checkpoint['uploads']))
+
+    def checkpoint_state(self):
+        """写入检查点文件的内容"""
+        checkpoint = self.checkpoint_snapshot()
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'params': self.params,
+                'status': self.status,
+                'error': self.error,
+                'created_at': self.created_at,
+                'checkpoint': checkpoint
+            }
+
+    def update_checkpoint(self, **fields):
+        with self._lock:
+            self.checkpoint.update(fields)
+
+    def record_upload(self, photo_name, success):
+        """记录照片上传结果（上传线程中调用）"""
+        with self._lock:
+            self.checkpoint['uploads'][photo_name] = success
+
+    def checkpoint_summary(self):
+        with self._lock:
+            cp = self.checkpoint
+            uploads = list(cp['uploads'].values())
+            return {
+                'stage1_planned': len(cp['stage1_plan'] or []),
+                'stage1_completed': cp['stage1_completed'],
+                'fine_ranges': cp['fine_ranges'],
+                'current_angle': cp['current_angle'],
+                'photos_captured': len(uploads),
+                'photos_uploaded': sum(1 for value in uploads if value),
+                'angles': cp['angles'],
+                'stage3_completed': cp['stage3_completed'],
+                'retries': cp['retries'],
+                'resumes': cp['resumes']
+            }
+
+    def update(self, **fields):
+        """更新任务字段（线程安全），并通知监听者"""
+        with self._lock:
+            for key, value in fields.items():
+                setattr(self, key, value)
+        if self.listener:
+            self.listener(self, fields)
+
+    def event_data(self):
+        """推送给订阅者的任务状态（to_dict 的精简版）"""
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': dict(self.progress),
+                'message': self.message,
+                'error': self.error,
+                'resumable': self.status in RESUMABLE_STATUSES
+            }
+
+    def set_progress(self, stage, current, total, message, **extra):
+        """更新当前阶段和进度，进入新阶段时结束上一阶段的计时；extra 为附加的进度字段"""
+        if stage != self.stage:
+            self.end_stage()
+            self._stage_start = (stage, time.perf_counter(), time.process_time())
+        self.update(stage=stage, progress=dict(extra, current=current, total=total), message=message)
+
+    def end_stage(self):
+        """结束当前阶段计时"""
+        if self._stage_start is None:
+            return
+        stage, wall_start, cpu_start = self._stage_start
+        self._stage_start = None
+        timing = {
+            'wall_seconds': round(time.perf_counter() - wall_start, 4),
+            'cpu_seconds': round(time.process_time() - cpu_start, 4),
+            # Linux 上 ru_maxrss 单位为KB
+            'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+        }
+        with self._lock:
+            self.stage_timings[stage] = timing
+        logger.info(f"阶段结束: {stage}", extra={'data': dict(timing, job_id=self.job_id, stage=stage)})
+
+    def check_cancelled(self):
+        """在步骤之间检查是否已被取消"""
+        if self.cancel_event.is_set():
+            raise ScanCancelled()
+
+    @property
+    def finished(self):
+        return self.status in ('completed', 'failed', 'cancelled', 'interrupted')
+
+    def to_dict(self):
+        checkpoint = self.checkpoint_summary()
+        with self._lock:
+            return {
+                'job_id': self.job_id,
+                'status': self.status,
+                'stage': self.stage,
+                'progress': dict(self.progress),
+                'message': self.message,
+                'error': self.error,
+                'result': self.result,
+                'params': self.params,
+                'stage_timings': {stage: dict(timing) for stage, timing in self.stage_timings.items()},
+                'metrics': self.metrics.summary(),
+                'resumable': self.status in RESUMABLE_STATUSES,
+                'created_at': self.created_at,
+                'started_at': self.started_at,
+                'finished_at': self.finished_at,
+                'checkpoint': checkpoint
+            }
+
+
+class ScanJobManager:
+    """扫描任务队列
+
+    所有任务由同一个工作线程顺序执行，硬件忙时新提交的任务排队等待，
+    因此两个扫描不会同时驱动同一个串口。
+    """
+
+    def __init__(self, arduino, camera, teammate, angle_state, max_history=50, capture_dwell_ms=150,
+                 in_memory_capture=True, step_retries=2, retry_delay=1.0, step_timeout=10,
+                 checkpoint_dir='checkpoints', motor_speed=20.0, photo_index=None, angle_tolerance=1.0,
+                 dedup_max_distance=-1, dedup_hash='dhash', job_prefix='', worker_name='scan-worker',
+                 events=None):
+        self.arduino = arduino
+        self.camera = camera
+        self.teammate = teammate
+        self.angle_state = angle_state
+        self.max_history = max_history
+        # 运动程序模式下每步的停留时间，需要覆盖一次拍照的耗时
+        self.capture_dwell_ms = capture_dwell_ms
+        # 拍照直接编码到内存缓冲区交给上传，不在关键路径上读写SD卡
+        self.in_memory_capture = in_memory_capture
+        self.jobs = {}
+        self.current_job = None
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._worker = None
+        # 多台转台各有一个任务队列：任务ID加前缀以便区分，工作线程按转台命名
+        self.job_prefix = job_prefix
+        self.worker_name = worker_name
+        self._metrics_scope = metrics.bind_current_scope()
+        # 事件总线：任务状态变化发布为 'job' 事件（出错时另发 'error'）；
+        # 收到 'angles' 事件时通过条件变量立即唤醒等待角度的阶段2
+        self.events = events if events is not None else EventBus()
+        self.angle_condition = threading.Condition()
+        self._angles_received_at = None
+        self.events.add_listener(self._on_event)
+        # 单步失败（未收到END、发送失败、拍照失败）时的重试次数和间隔
+        self.step_retries = step_retries
+        self.retry_delay = retry_delay
+        self.step_timeout = step_timeout  # 阶段1每步等待END/ACK的秒数
+        # 转台转速（度/秒），用于估算阶段3规划前后的运动时间
+        self.motor_speed = motor_speed
+        # 已拍照片按角度建立索引；阶段3的角度与某张照片相差不超过 angle_tolerance 度时
+        # 直接复用该照片而不转动电机，None 表示不复用
+        self.photo_index = photo_index if photo_index is not None else PhotoIndex()
+        self.angle_tolerance = angle_tolerance
+        # 阶段1的照片与上一张完整上传的照片感知哈希（64位）相差不超过 dedup_max_distance 位时
+        # 只发送引用，None 或负数（默认）表示不抑制：转动4度的不同视角也可能只差几位，需要用实际数据确定阈值
+        self.dedup_max_distance = dedup_max_distance
+        self.dedup_hash = dedup_hash
+        # 每步完成后把检查点写到 checkpoint_dir/<job_id>.json，None 表示不持久化
+        self.checkpoint_dir = checkpoint_dir
+        if checkpoint_dir:
+            self._load_checkpoints()
+
+    def _ensure_worker(self):
+        """懒启动工作线程"""
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._worker_loop, name=self.worker_name, daemon=True)
+                self._worker.start()
+
+    def submit(self, params=None):
+        """提交扫描任务，立即返回任务对象；扫描参数无效时抛出 ValueError"""
+        settings = parse_scan_params(params)
+        job_id = f"{self.job_prefix}{datetime.now().strftime('%Y%m%d%H%M%S')}-{next(self._ids):04d}"
+        job = ScanJob(job_id, settings)
+        job.listener = self._publish_job
+        with self._lock:
+            self.jobs[job_id] = job
+            self._trim_history()
+        self._queue.put(job)
+        self._ensure_worker()
+        logger.info(f"扫描任务已提交: {job_id}")
+        self._publish_job(job, {'status': job.status})
+        return job
+
+    def _publish_job(self, job, fields):
+        data = job.event_data()
+        data['queue_position'] = self.queue_position(job)
+        self.events.publish('job', data)
+        if fields.get('error'):
+            self.events.publish('error', {'job_id': job.job_id, 'stage': data['stage'], 'error': fields['error']})
+
+    def _on_event(self, event):
+        if event.type == 'angles':
+            self._angles_received_at = event.time
+            self.notify_angles()
+
+    def notify_angles(self):
+        """角度数据有变化（或任务被取消）时唤醒等待角度的阶段2"""
+        with self.angle_condition:
+            self.angle_condition.notify_all()
+
+    def _trim_history(self):
+        """只保留最近的已结束任务"""
+        finished = [job_id for job_id, job in self.jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_history)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self):
+        with self._lock:
+            return list(self.jobs.values())
+
+    def queue_position(self, job):
+        """返回排队任务前面还有几个任务（运行中的任务算一个）"""
+        with self._lock:
+            queued = [j for j in self.jobs.values() if j.status == 'queued']
+        if job.status != 'queued':
+            return 0
+        ahead = queued.index(job) if job in queued else 0
+        return ahead + (1 if self.current_job else 0)
+
+    def cancel(self, job_id):
+        """取消任务：排队中的任务直接取消，运行中的任务在下一步之前停止"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        self.notify_angles()
+        if job.status == 'queued':
+            job.update(status='cancelled', message='任务已取消',
+                       finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        else:
+            job.update(message='正在取消...')
+        logger.info(f"取消扫描任务: {job_id}")
+        return True
+
+    def resume(self, job_id):
+        """继续执行失败、取消或中断的任务，从检查点记录的位置开始"""
+        job = self.get(job_id)
+        if job is None or job.status not in RESUMABLE_STATUSES:
+            return None
+        job.cancel_event = threading.Event()
+        job.update_checkpoint(resumes=job.checkpoint['resumes'] + 1)
+        job.update(status='queued', message='等待继续执行', error=None, finished_at=None)
+        self._queue.put(job)
+        self._ensure_worker()
+        logger.info(f"继续扫描任务: {job_id}")
+        return job
+
+    def _worker_loop(self):
+        with self._metrics_scope:
+            while True:
+                job = self._queue.get()
+                try:
+                    if job.cancel_event.is_set():
+                        continue
+                    self.current_job = job
+                    self._execute(job)
+                finally:
+                    self.current_job = None
+                    self._queue.task_done()
+
+    def _execute(self, job):
+        job.update(status='running', message='任务开始',
+                   started_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        self._save_checkpoint(job)
+        outcome = {}
+        try:
+            with metrics.scoped([job.metrics]):
+                result = self.run_two_stage_scan(job)
+            outcome = dict(status='completed', message='旋转任务完成', result=result)
+        except ScanCancelled:
+            logger.info(f"扫描任务已取消: {job.job_id}")
+            outcome = dict(status='cancelled', message='任务已取消')
+        except ScanError as e:
+            logger.error(f"旋转任务失败: {e}")
+            outcome = dict(status='failed', message='任务失败', error=str(e))
+        except Exception as e:
+            logger.exception(f"旋转任务出错: {e}")
+            outcome = dict(status='failed', message='任务出错', error=str(e))
+        finally:
+            # 先结束最后一个阶段的计时再发布结束状态，看到结束状态的一方能拿到完整的阶段耗时
+            job.end_stage()
+            job.update(finished_at=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), **outcome)
+            if job.status == 'completed':
+                self._remove_checkpoint(job)
+            else:
+                self._save_checkpoint(job)
+
+    def run_two_stage_scan(self, job):
+        """两阶段旋转：完整旋转拍照 + 角度精确旋转
+
+        每完成一步都写入检查点，继续执行（resume）时跳过已完成的步骤。
+        """
+        camera = self.camera
+        teammate = self.teammate
+        cp = job.checkpoint
+        settings = parse_scan_params(job.params)
+
+        logger.info("开始两阶段旋转任务..." if not cp['resumes'] else
+                    f"继续旋转任务: 阶段1已拍{cp['stage1_completed']}张，"
+                    f"阶段3已完成{cp['stage3_completed']}个角度")
+
+        job.set_progress('setup', 0, 0, '准备相机')
+        # 相机常开：切换到拍照配置，视频流可以继续观看
+        if not camera.initialize_camera():
+            raise ScanError("无法初始化相机")
+        camera.enter_still_mode()
+
+        upload_report = stage3_report = None
+        try:
+            if not cp['stage1_done']:
+                # 阶段1：旋转拍照（按扫描参数的步数、步角，或先粗后细）
+                logger.info("=== 阶段1：完整旋转拍照 ===")
+                self._run_stage1(job, settings)
+
+            # 等待阶段1的照片全部上传和落盘完成
+            upload_report = teammate.flush_uploads()
+            if camera.photo_writer:
+                camera.photo_writer.flush()
+            for result in upload_report['results']:
+                if not result['success'] and not result['spooled']:
+                    upload_error_logger.warning('upload', f"照片上传失败: 旋转{result['rotation_number']} ({result['photo_path']})")
+
+            angles = cp['angles']
+            if angles is None:
+                logger.info("=== 阶段2：等待角度数据 ===")
+                job.set_progress('stage2', 0, 1, '等待角度数据')
+
+                # 等待角度数据：接收角度的接口发布 'angles' 事件后立即唤醒，取消任务时同样唤醒
+                wait_timeout = 300  # 5分钟
+                deadline = time.time() + wait_timeout
+
+                waited = False
+                with self.angle_condition:
+                    while True:
+                        job.check_cancelled()
+                        if self.angle_state['angles'] is not None:
+                            angles = self.angle_state['angles']
+                            break
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            raise ScanError("等待角度数据超时")
+                        self.angle_condition.wait(remaining)
+                        waited = True
+                # 从接收角度到阶段2继续执行的延迟（角度在进入阶段2前已到达时不计）
+                received_at = self._angles_received_at
+                if waited and received_at:
+                    metrics.observe('angle_wakeup_seconds', max(0.0, time.time() - received_at))
+                logger.info(f"收到角度数据: {angles}")
+                job.update_checkpoint(angles=angles)
+                self._save_checkpoint(job)
+
+            logger.info("=== 阶段3：角度精确旋转 ===")
+            if cp['stage3_plan'] is None:
+                job.update_checkpoint(stage3_plan=self._plan_stage3(job, angles),
+                                      stage3_seconds=[None] * len(angles),
+                                      stage3_photos=[None] * len(angles))
+                self._save_checkpoint(job)
+            elif cp['stage3_photos'] is None:
+                job.update_checkpoint(stage3_photos=[None] * len(angles))
+            order = cp['stage3_plan']['order']
+            cached = cp['stage3_plan'].get('cached', {})
+
+            def cache_hits():
+                return sum(1 for photo in cp['stage3_photos'] if photo and photo['source'] == 'cache')
+
+            # 所有角度都复用照片时也进入阶段3，计时和进度照常报告
+            job.set_progress('stage3', cp['stage3_completed'], len(order), '阶段3：角度精确旋转',
+                             cache_hits=cache_hits())
+            # 索引中有角度足够接近的照片时直接复用，其余按规划的顺序转到各角度拍照
+            # （绝对角度，重试时重新发送同一角度是安全的）
+            for visit in range(cp['stage3_completed'], len(order)):
+                job.check_cancelled()
+                i = order[visit]
+                angle = angles[i]
+                angle_number = i + 1
+                started = time.perf_counter()
+                photo = self._serve_cached(job, angle_number, angle, cached[str(i)]) if str(i) in cached else None
+                if photo is None:
+                    job.set_progress('stage3', visit + 1, len(order),
+                                     f"角度旋转 {visit + 1}/{len(order)} (角度{angle_number}: {angle}度)",
+                                     cache_hits=cache_hits())
+                    logger.info(f"角度旋转 {visit + 1}/{len(order)} (角度{angle_number}: {angle}度)...")
+                    self._with_retries(job, f"角度{angle_number}",
+                                       lambda angle=angle, n=angle_number: self._rotate_to_angle(angle, n))
+                    job.update_checkpoint(current_angle=angle)
+                    photo = self._capture_angle(job, angle_number, angle)
+                seconds = list(cp['stage3_seconds'])
+                seconds[i] = round(time.perf_counter() - started, 3)
+                photos = list(cp['stage3_photos'])
+                photos[i] = photo
+                job.update_checkpoint(stage3_completed=visit + 1, stage3_seconds=seconds, stage3_photos=photos)
+                self._save_checkpoint(job)
+                if photo['source'] == 'cache':
+                    job.set_progress('stage3', visit + 1, len(order),
+                                     f"复用照片 {visit + 1}/{len(order)} (角度{angle_number}: {angle}度)",
+                                     cache_hits=cache_hits())
+
+            logger.info("=== 旋转任务完成 ===")
+            self._return_home(job)
+            stage3_report = teammate.flush_uploads()
+            plan = cp['stage1_plan'] or []
+            stage3_plan = cp['stage3_plan']
+            stage3_photos = cp['stage3_photos']
+            return {
+                'angles': angles,
+                'stage1': {
+                    'mode': settings['mode'],
+                    'captures': len(plan),
+                    'coarse_captures': sum(1 for _, kind, _ in plan if kind == 'coarse'),
+                    'full_resolution_captures': sum(1 for _, kind, _ in plan if kind != 'coarse'),
+                    'fine_ranges': cp['fine_ranges']
+                },
+                'stage3': {
+                    # 访问顺序（角度编号）；angle_seconds 仍按收到的顺序排列
+                    'order': [i + 1 for i in order],
+                    'start_angle': stage3_plan['start_angle'],
+                    'planned_travel_degrees': stage3_plan['planned_degrees'],
+                    'naive_travel_degrees': stage3_plan['naive_degrees'],
+                    'planned_travel_seconds': self._travel_seconds(stage3_plan['planned_degrees']),
+                    'naive_travel_seconds': self._travel_seconds(stage3_plan['naive_degrees']),
+                    'saved_travel_seconds': self._travel_seconds(
+                        stage3_plan['naive_degrees'] - stage3_plan['planned_degrees']),
+                    'angle_seconds': cp['stage3_seconds'],
+                    'homings_skipped': cp['homings_skipped'],
+                    # 每个角度的照片，source 为 'cache'（复用阶段1照片）或 'camera'
+                    'photos': stage3_photos,
+                    'cache_hits': cache_hits(),
+                    'uploads': {key: stage3_report[key] for key in ('total', 'succeeded', 'spooled', 'failed')}
+                },
+                'dedup': self._dedup_summary(cp['dedup']),
+                'retries': cp['retries'],
+                'resumes': cp['resumes'],
+                'uploads': {
+                    'total': upload_report['total'],
+                    'succeeded': upload_report['succeeded'],
+                    'spooled': upload_report['spooled'],
+                    'failed': upload_report['failed'],
+                    'failed_rotations': [r['rotation_number'] for r in upload_report['results']
+                                         if not r['success'] and not r['spooled']],
+                    'spooled_rotations': [r['rotation_number'] for r in upload_report['results']
+                                          if r['spooled']]
+                }
+            }
+        finally:
+            if stage3_report is None:
+                # 中途失败或取消时也要等已拍的照片上传完，避免混入下一个任务的报告
+                teammate.flush_uploads()
+            camera.enter_preview_mode()
+
+    # ---- 单步执行与重试 ----
+
+    def _with_retries(self, job, label, action, delay=None):
+        """执行一步操作，失败（ScanError）时最多重试 step_retries 次"""
+        for attempt in range(self.step_retries + 1):
+            job.check_cancelled()
+            try:
+                return action()
+            except ScanError as e:
+                if attempt >= self.step_retries:
+                    raise ScanError(f"{e}（已重试{self.step_retries}次）") from e
+                self._note_retry(job, label, e, delay)
+
+    def _note_retry(self, job, label, error, delay=None):
+        """记录一次重试，等待 delay（默认 retry_delay）秒并在需要时重新连接串口"""
+        delay = self.retry_delay if delay is None else delay
+        job.update_checkpoint(retries=job.checkpoint['retries'] + 1)
+        logger.warning(f"{label}失败: {error}，{delay:g}秒后重试")
+        job.cancel_event.wait(delay)
+        job.check_cancelled()
+        arduino = self.arduino
+        if not arduino.is_connected() or not arduino.reader_alive():
+            logger.warning("串口连接异常，尝试重新连接Arduino")
+            arduino.reconnect()
+
+    def _rotate_one_step(self, job, position):
+        """旧协议：旋转一个基本步并等待END，失败时重试"""
+        arduino = self.arduino
+        state = {'sent': False}
+
+        def rotate():
+            # 上一次只是END迟到时电机已经转过这一步，不能再发一次
+            if state['sent'] and arduino.recieve_end(timeout=self.retry_delay):
+                return
+            if not arduino.send_rotate():
+                raise ScanError(f"旋转命令{position}失败")
+            state['sent'] = True
+            if not arduino.recieve_end(timeout=self.step_timeout):
+                raise ScanError(f"旋转{position}未收到END信号")
+
+        self._with_retries(job, f"旋转{position}", rotate)
+
+    def _set_position(self, job, position):
+        job.update_checkpoint(position=position,
+                              current_angle=steps_to_degrees(position % BASE_STEPS_PER_REVOLUTION))
+
+    def _drive(self, job, positions, stride, dwell_ms, on_arrive=None):
+        """依次转到 positions（相邻间隔 stride 个基本步），每到一个位置调用 on_arrive(位置)
+
+        新固件用一个运动程序走完，中断时从最后确认的位置重新下发剩余部分；
+        有 on_arrive 时电机等它返回后才转下一步（拍照可能等待缓冲区或上传名额，不能按固定停留时间继续）；
+        旧固件逐个基本步发送 'r'。
+        """
+        arduino = self.arduino
+        cp = job.checkpoint
+        if not arduino.supports_motion_program():
+            for position in positions:
+                while cp['position'] < position:
+                    job.check_cancelled()
+                    self._rotate_one_step(job, cp['position'] + 1)
+                    self._set_position(job, cp['position'] + 1)
+                if on_arrive:
+                    on_arrive(position)
+            return
+
+        failed_position, attempts = None, 0
+        while True:
+            remaining = [position for position in positions if position > cp['position']]
+            if not remaining:
+                return
+
+            def on_step(step, start=cp['position']):
+                job.check_cancelled()
+                position = start + step * stride
+                self._set_position(job, position)
+                if on_arrive:
+                    on_arrive(position)
+
+            arduino.run_motion_program(len(remaining), dwell_ms=dwell_ms, on_step=on_step,
+                                       step_timeout=self.step_timeout, stride=stride,
+                                       hold=on_arrive is not None)
+            if cp['position'] >= positions[-1]:
+                return
+            position = cp['position'] + stride
+            attempts = attempts + 1 if position == failed_position else 1
+            failed_position = position
+            if attempts > self.step_retries:
+                raise ScanError(f"运动程序在位置{position}中断（已重试{self.step_retries}次）")
+            self._note_retry(job, f"旋转{position}", "运动程序中断")
+
+    def _move_steps(self, job, steps):
+        """不拍照地转 steps 个基本步"""
+        current = job.checkpoint['position']
+        self._drive(job, list(range(current + 1, current + steps + 1)), 1, 0)
+
+    def _run_stage1(self, job, settings):
+        """按拍照计划旋转拍照；先粗后细模式在粗扫描结束后追加细扫描计划"""
+        cp = job.checkpoint
+        if cp['stage1_plan'] is None:
+            job.update_checkpoint(stage1_plan=initial_plan(settings))
+        elif cp['position']:
+            self._reposition(job, cp['position'])
+
+        while True:
+            self._capture_plan(job)
+            if settings['mode'] != 'coarse_to_fine' or cp['stage1_refined']:
+                break
+            fine_plan = self._plan_fine_pass(job, settings)
+            # 细扫描从起点重新计数
+            self._return_home(job)
+            job.update_checkpoint(stage1_plan=cp['stage1_plan'] + fine_plan, stage1_refined=True)
+            self._save_checkpoint(job)
+
+        # 阶段3使用绝对角度，直接从当前角度出发，不必先回起点；
+        # 只有转台已在起点（例如刚好转满一圈）时才算省去了一次回起点
+        skipped = 1 if cp['current_angle'] % 360 == 0 else 0
+        job.update_checkpoint(stage1_done=True, homings_skipped=cp['homings_skipped'] + skipped)
+        self._save_checkpoint(job)
+
+    def _capture_plan(self, job):
+        """执行拍照计划中剩余的条目，每次取一段等间隔的位置交给一个运动程序"""
+        cp = job.checkpoint
+        while cp['stage1_completed'] < len(cp['stage1_plan']):
+            remaining = cp['stage1_plan'][cp['stage1_completed']:]
+            _, kind, stride = remaining[0]
+            positions = []
+            for position, entry_kind, _ in remaining:
+                if entry_kind != kind:
+                    break
+                positions.append(position)
+
+            if positions[0] < cp['position']:
+                raise ScanError(f"拍照计划与当前位置不一致: {positions[0]} < {cp['position']}")
+            if positions[0] == cp['position']:
+                # 细扫描在起点拍0度，或上次在这个位置拍照失败，原地拍照
+                self._capture_at(job, positions[0], kind)
+                continue
+
+            transit, run_stride, run_positions = plan_runs(positions, stride, cp['position'])[0]
+            if transit:
+                self._move_steps(job, transit)
+            self._drive(job, run_positions, run_stride, self.capture_dwell_ms,
+                        on_arrive=lambda position, kind=kind: self._capture_at(job, position, kind))
+
+    def _capture_at(self, job, position, kind):
+        """在当前位置拍照并更新检查点"""
+        cp = job.checkpoint
+        index = cp['stage1_completed'] + 1
+        total = len(cp['stage1_plan'])
+        job.set_progress('stage1', index, total,
+                         f"旋转 {index}/{total} ({steps_to_degrees(rotation_number(position)) % 360}度)")
+        self._capture_rotation(job, position, kind, f"{index}/{total}")
+        job.update_checkpoint(stage1_completed=index)
+        self._save_checkpoint(job)
+
+    def _plan_fine_pass(self, job, settings):
+        """根据粗扫描结果（或指定的角度区间）生成细扫描计划"""
+        cp = job.checkpoint
+        fine_stride = degrees_to_steps(settings['fine_step_angle'])
+        differences = None
+        if settings['fine_ranges'] is not None:
+            positions = fine_positions_for_ranges(settings['fine_ranges'], fine_stride)
+        else:
+            coarse = [position for position, kind, _ in cp['stage1_plan'] if kind == 'coarse']
+            intervals, differences = interesting_intervals(
+                [cp['coarse_signatures'].get(str(position)) for position in coarse],
+                settings['interest_threshold'])
+            positions = fine_positions_for_intervals(coarse, intervals, fine_stride)
+        ranges = positions_to_ranges(positions, fine_stride)
+        job.update_checkpoint(fine_ranges=ranges, coarse_differences=differences)
+        logger.info(f"粗扫描完成，细扫描{len(positions)}个位置: {ranges}")
+        return [(position, 'fine', fine_stride) for position in positions]
+
+    def _plan_stage3(self, job, angles):
+        """规划阶段3：照片索引能满足的角度直接复用，其余角度规划访问顺序
+
+        同时记录与原来的做法（先回起点再按收到的顺序逐个转动）相比的转动距离。
+        """
+        cp = job.checkpoint
+        start = cp['current_angle']
+        cached = {}
+        if cp['stage3_completed']:
+            # 旧检查点没有规划，已按收到的顺序完成了一部分
+            order = list(range(len(angles)))
+        else:
+            if self.angle_tolerance is not None and self.angle_tolerance >= 0:
+                for i, angle in enumerate(angles):
+                    entry = self.photo_index.lookup(angle, self.angle_tolerance, scan_id=job.job_id)
+                    if entry:
+                        cached[str(i)] = entry._asdict()
+            moving = [i for i in range(len(angles)) if str(i) not in cached]
+            order = [int(i) for i in cached] + [
+                moving[k] for k in plan_angle_order([angles[i] for i in moving], current=start, home=0)]
+        moves = [angles[i] for i in order if str(i) not in cached]
+        planned = travel_degrees([start] + moves + [0])
+        naive = travel_degrees([start, 0] + list(angles) + [0])
+        logger.info(f"阶段3访问顺序: {[i + 1 for i in order]}，复用照片{len(cached)}张，"
+                    f"转动{planned}度（原顺序{naive}度）")
+        return {'order': order, 'cached': cached, 'start_angle': start,
+                'planned_degrees': planned, 'naive_degrees': naive}
+
+    def _serve_cached(self, job, angle_number, angle, cached):
+        """复用索引中的照片作为该角度的照片上传，不转动电机
+
+        照片已被覆盖或删除（例如程序重启后继续执行）时返回 None，由调用方转动拍照。
+        """
+        entry = self.photo_index.get(cached['path'])
+        if entry is None or entry.scan_id != cached['scan_id'] or not os.path.exists(cached['path']):
+            logger.warning(f"索引中的照片已不可用，改为转动拍照: {cached['path']}")
+            return None
+        photo_name = f"angle_{angle_number}.jpg"
+        offset = round(angle_distance(cached['angle'], angle), 3)
+        metadata = {
+            'rotation_type': 'angle_rotation',
+            'angle': angle,
+            'source': 'cache',
+            'cached_photo': cached['photo_name'],
+            'cached_angle': cached['angle'],
+            'captured_at': cached['captured_at'],
+            'exposure': cached['exposure'],
+            'scan_id': cached['scan_id']
+        }
+        logger.info(f"角度{angle_number}({angle}度)复用照片 {cached['photo_name']}（相差{offset}度），不转动电机")
+        job.record_upload(photo_name, None)
+        self.teammate.enqueue_photo(cached['path'], angle_number, metadata, filename=photo_name,
+                                    on_complete=lambda success: job.record_upload(photo_name, success))
+        return {'photo': photo_name, 'source': 'cache', 'cached_photo': cached['photo_name'],
+                'angle_offset': offset}
+
+    def _capture_angle(self, job, angle_number, angle):
+        """在阶段3的角度拍照，照片同样加入索引"""
+        photo_name = f"angle_{angle_number}.jpg"
+        metadata = {'rotation_type': 'angle_rotation', 'angle': angle, 'source': 'camera'}
+        self._with_retries(job, f"角度{angle_number}拍照",
+                           lambda: self._capture_photo(job, photo_name, angle_number, metadata, 'stage3'))
+        return {'photo': photo_name, 'source': 'camera'}
+
+    def _travel_seconds(self, degrees):
+        return round(degrees / self.motor_speed, 3) if self.motor_speed else None
+
+    def _return_home(self, job):
+        """回到起点；转台已在起点（例如刚好转满一圈）时不再发送回起点命令"""
+        cp = job.checkpoint
+        if cp['current_angle'] % 360 == 0:
+            job.update_checkpoint(homings_skipped=cp['homings_skipped'] + 1)
+            logger.debug("转台已在起点，跳过回起点")
+        else:
+            self.arduino.return_start()
+        self._set_position(job, 0)
+
+    def _rotate_to_angle(self, angle, angle_number):
+        arduino = self.arduino
+        if not arduino.send_single_angle(angle):
+            raise ScanError(f"发送角度{angle_number}失败")
+        if not arduino.recieve_end(timeout=30):
+            raise ScanError(f"角度{angle_number}旋转超时")
+
+    def _capture_rotation(self, job, position, kind, progress):
+        """拍一张照片放入后台上传队列，拍照失败时重试，电机立即进入下一步
+
+        kind 为 'coarse' 时从lores流拍低分辨率照片，并记录画面特征用于规划细扫描。
+        """
+        camera = self.camera
+        number = rotation_number(position)
+        metadata = {
+            'rotation_type': 'coarse_rotation' if kind == 'coarse' else 'full_rotation',
+            'progress': progress,
+            'angle': steps_to_degrees(number) % 360
+        }
+
+        def capture():
+            if kind != 'coarse':
+                self._capture_photo(job, f"rotation_{number:03d}.jpg", number, metadata, kind)
+                return
+            buffer = camera.capture_preview_to_buffer(f"coarse_{number:03d}.jpg")
+            if not buffer:
+                raise ScanError(f"旋转{number}拍照失败")
+            with buffer.file.getbuffer() as view:
+                signature = frame_signature(view)
+            with job._lock:
+                job.checkpoint['coarse_signatures'][str(position)] = signature
+            self._enqueue_buffer(job, buffer, number, metadata)
+
+        # 运动程序模式下固件按固定停留时间继续转动，拍照只能立即重试
+        self._with_retries(job, f"旋转{number}拍照", capture, delay=0)
+
+    def _capture_photo(self, job, photo_name, number, metadata, kind):
+        """拍一张全分辨率照片放入后台上传队列，落盘的照片按 metadata['angle'] 加入照片索引
+
+        阶段1的照片与上一张完整上传的照片几乎相同时只发送"与第N张相同"的引用。
+        """
+        camera = self.camera
+        dedup = kind in ('full', 'fine')
+        if self.in_memory_capture:
+            # 内存拍照：缓冲区直接交给上传线程，上传完成后回到缓冲池
+            buffer = camera.capture_to_buffer(photo_name)
+            if not buffer:
+                raise ScanError(f"{photo_name}拍照失败")
+            reference = None
+            if dedup:
+                with buffer.file.getbuffer() as view:
+                    reference = self._duplicate_reference(job, view, number, photo_name)
+            if reference:
+                buffer.release()
+                self._enqueue_reference(job, photo_name, number, metadata, reference)
+            else:
+                self._enqueue_buffer(job, buffer, number, metadata)
+            # 没有配置落盘时照片只在内存中，不能复用
+            path = os.path.join(camera.photos_dir, photo_name) if camera.photo_writer else None
+        else:
+            path = camera.take_photo(photo_name)
+            if not path:
+                raise ScanError(f"{photo_name}拍照失败")
+            reference = None
+            if dedup:
+                with open(path, 'rb') as f:
+                    reference = self._duplicate_reference(job, f.read(), number, photo_name)
+            if reference:
+                self._enqueue_reference(job, photo_name, number, metadata, reference)
+            else:
+                job.record_upload(photo_name, None)
+                self.teammate.enqueue_photo(path, number, metadata,
+                                            on_complete=lambda success: job.record_upload(photo_name, success))
+        if path:
+            self.photo_index.add(metadata['angle'], photo_name, path, scan_id=job.job_id,
+                                 exposure=camera.last_capture_metadata, kind=kind)
+
+    def _duplicate_reference(self, job, data, number, photo_name):
+        """计算照片的感知哈希并与上一张完整上传的照片比较
+
+        汉明距离不超过 dedup_max_distance 时返回引用信息（调用方只发送引用）；
+        否则这张照片成为新的比较对象，返回 None。队友不支持引用时始终返回 None。
+        """
+        if self.dedup_max_distance is None or self.dedup_max_distance < 0:
+            return None
+        if not self.teammate.supports_photo_references():
+            return None
+        with metrics.timed('photo_hash_seconds'):
+            photo_hash = image_hash(data, self.dedup_hash)
+        size = len(data)
+        state = job.checkpoint['dedup']
+        if photo_hash is not None and state['hash'] is not None:
+            distance = hamming_distance(photo_hash, int(state['hash'], 16))
+            if distance <= self.dedup_max_distance:
+                job.update_checkpoint(dedup=dict(state, references=state['references'] + 1,
+                                                 bytes_saved=state['bytes_saved'] + size))
+                metrics.inc('upload_bytes_saved_total', size)
+                return {'same_as': state['rotation_number'], 'same_as_filename': state['filename'],
+                        'hash_distance': distance}
+        job.update_checkpoint(dedup=dict(state, hash=None if photo_hash is None else f"{photo_hash:016x}",
+                                         rotation_number=number, filename=photo_name,
+                                         photos=state['photos'] + 1, bytes_sent=state['bytes_sent'] + size))
+        return None
+
+    def _dedup_summary(self, state):
+        """重复照片抑制的效果：完整上传和引用的张数，以及节省的上传字节数"""
+        total = state['bytes_sent'] + state['bytes_saved']
+        return {
+            'max_distance': self.dedup_max_distance,
+            'hash': self.dedup_hash,
+            'full_photos': state['photos'],
+            'references': state['references'],
+            'bytes_sent': state['bytes_sent'],
+            'bytes_saved': state['bytes_saved'],
+            'saved_ratio': round(state['bytes_saved'] / total, 4) if total else 0.0
+        }
+
+    def _enqueue_reference(self, job, photo_name, number, metadata, reference):
+        logger.debug(f"{photo_name} 与第{reference['same_as']}张几乎相同（距离{reference['hash_distance']}），只发送引用")
+        job.record_upload(photo_name, None)
+        self.teammate.enqueue_photo_reference(number, reference, metadata, filename=photo_name,
+                                              on_complete=lambda success: job.record_upload(photo_name, success))
+
+    def _enqueue_buffer(self, job, buffer, number, metadata):
+        def on_uploaded(success, key=buffer.name):
+            buffer.release()
+            job.record_upload(key, success)
+
+        job.record_upload(buffer.name, None)
+        self.teammate.enqueue_photo(buffer.rewind(), number, metadata,
+                                    filename=buffer.name, on_complete=on_uploaded)
+
+    def _reposition(self, job, position):
+        """继续扫描前先回到起点，再不拍照地转到断点位置
+
+        中断期间电机可能被移动或断电，回到起点重新计数比相信记录的位置可靠。
+        """
+        job.set_progress('reposition', 0, position, f"回到断点位置: {steps_to_degrees(position)}度")
+        logger.info(f"回到起点后转到断点位置: 第{position}步")
+        self.arduino.return_start()
+        self._set_position(job, 0)
+        self._move_steps(job, position)
+
+    # ---- 检查点 ----
+
+    def _checkpoint_path(self, job_id):
+        return os.path.join(self.checkpoint_dir, f"{job_id}.json")
+
+    def _save_checkpoint(self, job):
+        """原子地写入检查点文件（先写临时文件再改名）"""
+        if not self.checkpoint_dir:
+            return
+        data = job.checkpoint_state()
+        path = self._checkpoint_path(job.job_id)
+        tmp_path = path + '.tmp'
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"保存检查点失败: {e}")
+
+    def _remove_checkpoint(self, job):
+        if not self.checkpoint_dir:
+            return
+        try:
+            os.remove(self._checkpoint_path(job.job_id))
+        except FileNotFoundError:
+            pass
+
+    def _load_checkpoints(self):
+        """启动时载入上次未完成的任务，状态为 interrupted，可以继续执行"""
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        for name in sorted(os.listdir(self.checkpoint_dir)):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.checkpoint_dir, name), encoding='utf-8') as f:
+                    data = json.load(f)
+                job = ScanJob.from_checkpoint(data)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"无法读取检查点 {name}: {e}")
+                continue
+            job.listener = self._publish_job
+            self.jobs[job.job_id] = job
+            logger.info(f"载入未完成的扫描任务: {job.job_id} ({job.status})")
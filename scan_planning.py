@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+扫描规划模块
+阶段1的拍照位置规划：可配置步数和步角，以及先粗后细的扫描模式；
+阶段3目标角度的访问顺序规划
+
+位置以固件的基本步为单位（一圈90步，每步4度），从起点开始计数。
+"""
+
+import math
+
+import cv2
+import numpy as np
+
+BASE_STEPS_PER_REVOLUTION = 90
+BASE_STEP_DEGREES = 360 / BASE_STEPS_PER_REVOLUTION
+
+SCAN_MODES = ('full', 'coarse_to_fine')
+
+# 粗扫描画面特征的尺寸（灰度缩略图）
+SIGNATURE_SIZE = (16, 12)
+
+
+def degrees_to_steps(angle):
+    """角度换算为基本步数（四舍五入，至少1步）"""
+    return max(1, int(round(float(angle) / BASE_STEP_DEGREES)))
+
+
+def steps_to_degrees(steps):
+    return round(steps * BASE_STEP_DEGREES, 3)
+
+
+def rotation_number(position):
+    """位置对应的旋转编号（1~90，与 rotation_001..090.jpg 一致）"""
+    return (position - 1) % BASE_STEPS_PER_REVOLUTION + 1
+
+
+def parse_scan_params(data):
+    """解析并校验扫描参数，返回规范化的参数字典，参数无效时抛出 ValueError
+
+    mode              - 'full'（默认）或 'coarse_to_fine'
+    step_angle        - full 模式每次拍照间隔的角度，默认4度
+    steps             - full 模式拍照次数，默认转满一圈
+    coarse_step_angle - 粗扫描的步角，默认24度
+    fine_step_angle   - 细扫描的步角，默认4度
+    interest_threshold - 相邻粗扫描画面差异超过中位数的多少倍时细扫描该区间，默认1.5
+    fine_ranges       - 直接指定细扫描的角度区间 [[起始, 结束], ...]（例如由接收端给出）
+    """
+    data = data or {}
+    mode = data.get('mode') or 'full'
+    if mode not in SCAN_MODES:
+        raise ValueError(f"未知的扫描模式: {mode}")
+
+    def _number(name, default, low, high, cast=float):
+        value = data.get(name)
+        if value in (None, ''):
+            return default
+        try:
+            value = cast(value)
+        except (TypeError, ValueError):
+            raise ValueError(f"参数 {name} 不是数字: {value}")
+        if not low <= value <= high:
+            raise ValueError(f"参数 {name} 超出范围({low}~{high}): {value}")
+        return value
+
+    step_stride = degrees_to_steps(_number('step_angle', BASE_STEP_DEGREES, BASE_STEP_DEGREES / 2, 360))
+    max_steps = BASE_STEPS_PER_REVOLUTION // step_stride
+    steps = _number('steps', max_steps, 1, max_steps, int)
+    coarse_stride = degrees_to_steps(_number('coarse_step_angle', 24, BASE_STEP_DEGREES, 180))
+    fine_stride = degrees_to_steps(_number('fine_step_angle', BASE_STEP_DEGREES, BASE_STEP_DEGREES / 2, 90))
+    if mode == 'coarse_to_fine' and fine_stride >= coarse_stride:
+        raise ValueError("细扫描步角必须小于粗扫描步角")
+
+    fine_ranges = data.get('fine_ranges')
+    if fine_ranges is not None:
+        try:
+            fine_ranges = [[float(start), float(end)] for start, end in fine_ranges]
+        except (TypeError, ValueError):
+            raise ValueError("fine_ranges 应为 [[起始角度, 结束角度], ...]")
+
+    return {
+        'mode': mode,
+        'step_angle': steps_to_degrees(step_stride),
+        'steps': steps,
+        'coarse_step_angle': steps_to_degrees(coarse_stride),
+        'fine_step_angle': steps_to_degrees(fine_stride),
+        'interest_threshold': _number('interest_threshold', 1.5, 0, 100),
+        'fine_ranges': fine_ranges
+    }
+
+
+def initial_plan(settings):
+    """第一遍的拍照计划：[(位置, 类型, 步长), ...]
+
+    full 模式为等间隔的全分辨率照片；coarse_to_fine 模式先按粗步角拍低分辨率照片。
+    """
+    if settings['mode'] == 'coarse_to_fine':
+        stride = degrees_to_steps(settings['coarse_step_angle'])
+        count = BASE_STEPS_PER_REVOLUTION // stride
+        return [(stride * i, 'coarse', stride) for i in range(1, count + 1)]
+    stride = degrees_to_steps(settings['step_angle'])
+    return [(stride * i, 'full', stride) for i in range(1, settings['steps'] + 1)]
+
+
+def plan_runs(positions, stride, current):
+    """把递增的拍照位置分成若干段等间隔的运动程序
+
+    返回 [(过渡步数, 步长, [位置...]), ...]：先不拍照地转过渡步数，
+    再以步长为间隔逐个到达并拍照。位置与当前位置相同时步长为0（原地拍照）。
+    """
+    runs = []
+    for position in positions:
+        if runs and runs[-1][1] == stride and position - runs[-1][2][-1] == stride:
+            runs[-1][2].append(position)
+            continue
+        previous = runs[-1][2][-1] if runs else current
+        gap = position - previous
+        if gap >= stride:
+            runs.append((gap - stride, stride, [position]))
+        else:
+            runs.append((0, gap, [position]))
+    return runs
+
+
+def frame_signature(jpeg_bytes):
+    """照片的灰度缩略图，用于比较相邻粗扫描画面的差异"""
+    image = cv2.imdecode(np.frombuffer(jpeg_bytes, dtype=np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if image is None:
+        return None
+    return cv2.resize(image, SIGNATURE_SIZE, interpolation=cv2.INTER_AREA).flatten().tolist()
+
+
+def interesting_intervals(signatures, threshold):
+    """相邻粗扫描画面（首尾相接）差异较大的区间
+
+    signatures 为按位置排列的画面特征；区间 i 表示第 i 张到第 i+1 张之间。
+    差异不低于所有区间中位数的 threshold 倍时认为该区间值得细扫描。
+    返回 (区间序号列表, 各区间差异)。
+    """
+    frames = [np.asarray(s, dtype=np.float32) if s is not None else None for s in signatures]
+    count = len(frames)
+    diffs = []
+    for i in range(count):
+        a, b = frames[i], frames[(i + 1) % count]
+        # 缺少画面时视为差异很大，宁可多扫
+        diffs.append(float(np.mean(np.abs(a - b))) if a is not None and b is not None else math.inf)
+    finite = [d for d in diffs if math.isfinite(d)]
+    median = float(np.median(finite)) if finite else 0.0
+    if median <= 0:
+        selected = [i for i, d in enumerate(diffs) if d > 0]
+    else:
+        selected = [i for i, d in enumerate(diffs) if d >= threshold * median]
+    return selected, [round(d, 3) if math.isfinite(d) else None for d in diffs]
+
+
+def fine_positions_for_intervals(coarse_positions, intervals, fine_stride):
+    """粗扫描区间对应的细扫描位置（包含区间两端），按位置排序
+
+    细扫描从起点出发，0度（一圈的终点）记为位置0排在最前面，在起点直接拍摄，不必再转一圈回来。
+    """
+    positions = set()
+    count = len(coarse_positions)
+    for i in intervals:
+        start = coarse_positions[i]
+        end = coarse_positions[(i + 1) % count]
+        if end <= start:
+            end += BASE_STEPS_PER_REVOLUTION
+        for position in range(start, end + 1, fine_stride):
+            positions.add(position % BASE_STEPS_PER_REVOLUTION)
+    return sorted(positions)
+
+
+def fine_positions_for_ranges(ranges, fine_stride):
+    """指定角度区间对应的细扫描位置（0度和360度都是起点的位置0）"""
+    positions = set()
+    for start, end in ranges:
+        first = math.ceil(start / BASE_STEP_DEGREES)
+        last = math.floor(end / BASE_STEP_DEGREES)
+        if last < first:
+            last += BASE_STEPS_PER_REVOLUTION
+        for position in range(first, last + 1, fine_stride):
+            positions.add(position % BASE_STEPS_PER_REVOLUTION)
+    return sorted(positions)
+
+
+def positions_to_ranges(positions, stride=1):
+    """把位置列表合并为连续的角度区间 [[起始, 结束], ...]"""
+    ranges = []
+    # 第90步即0度，排在最前面以便与第1步合并
+    for position in sorted(position % BASE_STEPS_PER_REVOLUTION for position in positions):
+        if ranges and position - ranges[-1][1] <= stride:
+            ranges[-1][1] = position
+        else:
+            ranges.append([position, position])
+    return [[steps_to_degrees(start), steps_to_degrees(end)] for start, end in ranges]
+
+
+def travel_degrees(path):
+    """依次转到 path 中各绝对角度的总转动角度（绝对角度之间直接转动，不经过0度另一侧）"""
+    return round(sum(abs(b - a) for a, b in zip(path, path[1:])), 3)
+
+
+def plan_angle_order(angles, current=0.0, home=0.0):
+    """阶段3目标角度的访问顺序，使从 current 出发经过所有角度、最后回到 home 的总转动最少
+
+    绝对角度在一条直线上，最优路线必然是先转到最小（或最大）的角度再单向扫过其余角度，
+    取两者中较短的一个（相同时取升序）。返回按访问顺序排列的原始序号。
+    """
+    ascending = sorted(range(len(angles)), key=lambda i: angles[i])
+
+    def cost(order):
+        return travel_degrees([current] + [angles[i] for i in order] + [home])
+    return min([ascending, ascending[::-1]], key=cost)
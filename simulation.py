@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+硬件模拟模块
+在没有Arduino和树莓派相机的开发机上模拟串口和相机行为，用于测试和基准测试
+"""
+
+import random
+import threading
+import time
+from collections import deque
+
+import cv2
+import numpy as np
+
+# 固件每个基本步转动的角度
+STEP_DEGREES = 4
+
+
+class SimulatedSerial:
+    """模拟Arduino串口，接口与 serial.Serial 的常用部分一致
+
+    收到 'r'（旋转一步）命令后，经过 motion_delay 秒（加上 0~jitter 秒的随机抖动）发送一行 END；
+    's <角度>'（转到绝对角度）的耗时按转动距离计算（每4度 motion_delay 秒）；
+    'q'（回到起点）不回复，但电机回到起点之前后续命令要排队等待。
+    protocol_version >= 2 时还支持批量运动程序：
+    'v' 回复 'PROTO <版本>'；'p<步数>,<停留毫秒>'（以换行结束）每步回复 'ACK <步号>'，
+    结束后回复 END；'x' 中止正在执行的程序。protocol_version >= 3 时 'p' 命令可带第三个参数步长；
+    protocol_version >= 4 时第四个参数为1表示每步停留后等待主机发送 'c' 再转下一步。
+    drop_rate 为 'r' / 's' 命令丢失END回复的概率，用于测试重试。
+    """
+
+    def __init__(self, port=None, baudrate=9600, timeout=1, motion_delay=0.2, protocol_version=4,
+                 jitter=0.0, drop_rate=0.0):
+        self.port = port
+        self.baudrate = baudrate
+        self.timeout = timeout
+        self.motion_delay = motion_delay
+        self.jitter = jitter
+        self.drop_rate = drop_rate
+        self.dropped_replies = 0
+        self.is_open = True
+        self.written = []
+        self._rx = deque()
+        self._rx_cond = threading.Condition()
+        self._tx_buffer = ''
+        self.protocol_version = protocol_version
+        self._program_abort = threading.Event()
+        self._program_continue = threading.Semaphore(0)
+        self.angle = 0.0            # 转台当前角度（运动完成后的值）
+        self._motor_free_at = 0.0   # 已排队的运动全部完成的时刻
+        self._motor_lock = threading.Lock()
+
+    @classmethod
+    def factory(cls, **options):
+        """返回可传给 ArduinoController(serial_factory=...) 的工厂函数"""
+        def create(port, baudrate, timeout=1):
+            return cls(port, baudrate, timeout=timeout, **options)
+        return create
+
+    # ---- 主机侧接口 ----
+
+    @property
+    def in_waiting(self):
+        with self._rx_cond:
+            return sum(len(line) for line in self._rx)
+
+    def write(self, data):
+        if not self.is_open:
+            raise OSError("串口已关闭")
+        text = data.decode('utf-8')
+        self.written.append(text)
+        self._tx_buffer += text
+        self._parse_commands()
+        return len(data)
+
+    def readline(self):
+        """阻塞读取一行，超过 timeout 返回空字节串"""
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        with self._rx_cond:
+            while not self._rx:
+                if not self.is_open:
+                    return b''
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return b''
+                self._rx_cond.wait(remaining)
+            return self._rx.popleft()
+
+    def close(self):
+        with self._rx_cond:
+            self.is_open = False
+            self._rx_cond.notify_all()
+
+    # ---- 固件侧模拟 ----
+
+    def _parse_commands(self):
+        """解析主机发送的命令（旧协议命令没有结束符，按命令字母切分）"""
+        while self._tx_buffer:
+            command = self._tx_buffer[0]
+            if command in 'rq':
+                self._tx_buffer = self._tx_buffer[1:]
+                if command == 'r':
+                    self._schedule_end(self._queue_motion((self.angle + STEP_DEGREES) % 360, 1))
+                else:
+                    self._queue_motion(0.0, self.angle / STEP_DEGREES)
+            elif command in 'vxc':
+                self._tx_buffer = self._tx_buffer[1:]
+                if self.protocol_version < 2:
+                    continue
+                if command == 'v':
+                    self.emit(f"PROTO {self.protocol_version}")
+                elif command == 'c':
+                    self._program_continue.release()
+                else:
+                    self._program_abort.set()
+            elif command == 'p':
+                if '\n' not in self._tx_buffer:
+                    return  # 等待完整的一行
+                line, self._tx_buffer = self._tx_buffer[1:].split('\n', 1)
+                if self.protocol_version < 2:
+                    continue
+                values = [int(value) for value in line.split(',')]
+                steps, dwell_ms = values[:2]
+                stride = values[2] if len(values) > 2 and self.protocol_version >= 3 else 1
+                hold = len(values) > 3 and values[3] == 1 and self.protocol_version >= 4
+                self._program_abort.clear()
+                self._program_continue = threading.Semaphore(0)
+                threading.Thread(target=self._run_program, args=(steps, dwell_ms, stride, hold),
+                                 daemon=True).start()
+            elif command == 's':
+                # 's <角度>'，角度在下一个命令字母之前结束
+                rest = self._tx_buffer[1:]
+                end = 0
+                while end < len(rest) and rest[end] not in 'rqsvpxc':
+                    end += 1
+                self._tx_buffer = rest[end:]
+                try:
+                    target = float(rest[:end])
+                except ValueError:
+                    target = self.angle
+                self._schedule_end(self._queue_motion(target, abs(target - self.angle) / STEP_DEGREES))
+            else:
+                self._tx_buffer = self._tx_buffer[1:]
+
+    def _motion_time(self):
+        """一次运动的耗时，含随机抖动"""
+        return self.motion_delay + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+
+    def _queue_motion(self, target, steps):
+        """排在已有运动之后转到 target（转动 steps 个基本步），返回距运动完成的秒数"""
+        duration = self.motion_delay * steps + (random.uniform(0, self.jitter) if self.jitter else 0.0)
+        with self._motor_lock:
+            now = time.time()
+            self._motor_free_at = max(now, self._motor_free_at) + duration
+            self.angle = target
+            return self._motor_free_at - now
+
+    def _run_program(self, steps, dwell_ms, stride=1, hold=False):
+        """执行批量运动程序，每步转 stride 个基本步；hold 时每步停留后等待主机的 'c'"""
+        if self._program_abort.wait(max(0.0, self._motor_free_at - time.time())):
+            self.emit('END')
+            return
+        for step in range(1, steps + 1):
+            if self._program_abort.wait(self._motion_time() * stride):
+                break
+            with self._motor_lock:
+                self.angle = (self.angle + STEP_DEGREES * stride) % 360
+                self._motor_free_at = time.time()
+            self.emit(f"ACK {step}")
+            if self._program_abort.wait(dwell_ms / 1000.0):
+                break
+            if hold and step < steps:
+                while not self._program_continue.acquire(timeout=0.01):
+                    if self._program_abort.is_set():
+                        break
+                if self._program_abort.is_set():
+                    break
+        self.emit('END')
+
+    def _schedule_end(self, delay):
+        """运动完成后回复END，按 drop_rate 模拟丢失"""
+        if self.drop_rate and random.random() < self.drop_rate:
+            self.dropped_replies += 1
+            return
+        self._schedule_line('END', delay)
+
+    def _schedule_line(self, line, delay):
+        """delay 秒后向主机发送一行"""
+        timer = threading.Timer(delay, self.emit, args=(line,))
+        timer.daemon = True
+        timer.start()
+
+    def emit(self, line):
+        """立即向主机发送一行"""
+        with self._rx_cond:
+            if not self.is_open:
+                return
+            self._rx.append((line + '\r\n').encode('utf-8'))
+            self._rx_cond.notify_all()
+
+
+class SimulatedPicamera2:
+    """模拟 picamera2.Picamera2，生成真实尺寸的合成画面
+
+    主流为 RGB888，lores 流为 YUV420；画面是固定的噪声纹理加上随时间平移的图案，
+    JPEG编码后的大小与真实照片接近。capture_* 调用按 frame_rate 等待下一帧。
+    static_scene=True 时画面不随时间变化（模拟转台上对称或没有特征的物体）。
+    """
+
+    def __init__(self, camera_num=0, frame_rate=30.0, jpeg_quality=90, static_scene=False):
+        self.camera_num = camera_num
+        self.frame_rate = frame_rate
+        self.jpeg_quality = jpeg_quality
+        self.static_scene = static_scene
+        self.config = None
+        self.started = False
+        self.frame_count = 0
+        self._textures = {}
+        self._last_frame_at = 0.0
+        self._lock = threading.Lock()
+
+    # ---- 配置 ----
+
+    def _make_configuration(self, main=None, lores=None, display=None, **kwargs):
+        return {
+            'main': {'size': tuple((main or {}).get('size', (1920, 1080)))},
+            'lores': {'size': tuple(lores['size'])} if lores else None,
+            'display': display
+        }
+
+    def create_preview_configuration(self, **kwargs):
+        return self._make_configuration(**kwargs)
+
+    def create_still_configuration(self, **kwargs):
+        return self._make_configuration(**kwargs)
+
+    def configure(self, config):
+        self.config = config
+
+    def switch_mode(self, config):
+        self._wait_frame()
+        self.config = config
+
+    def start(self):
+        self.started = True
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.started = False
+
+    # ---- 采集 ----
+
+    def _wait_frame(self):
+        """按帧率节拍等待下一帧"""
+        with self._lock:
+            interval = 1.0 / self.frame_rate
+            wait = self._last_frame_at + interval - time.time()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_frame_at = time.time()
+            self.frame_count += 1
+            return self.frame_count
+
+    def _texture(self, width, height):
+        key = (width, height)
+        if key not in self._textures:
+            rng = np.random.default_rng(width * 10000 + height)
+            noise = rng.integers(0, 64, (height, width, 3), dtype=np.uint8)
+            gradient = np.linspace(0, 160, width, dtype=np.uint8)[np.newaxis, :, np.newaxis]
+            self._textures[key] = noise + gradient
+        return self._textures[key]
+
+    def _render_rgb(self, size, frame_number):
+        width, height = size
+        frame = np.roll(self._texture(width, height), frame_number * 7, axis=1)
+        # 模拟转台上的物体：一个随帧号移动的亮块
+        x = (frame_number * 13) % max(1, width - width // 4)
+        frame[height // 4:height // 2, x:x + width // 8] = 230
+        return frame
+
+    def capture_array(self, name="main"):
+        frame_number = self._wait_frame()
+        stream = (self.config or {}).get(name) or {'size': (640, 480)}
+        rgb = self._render_rgb(stream['size'], 0 if self.static_scene else frame_number)
+        if name == 'lores':
+            return cv2.cvtColor(rgb, cv2.COLOR_RGB2YUV_I420)
+        return rgb
+
+    def capture_metadata(self):
+        self._wait_frame()
+        return {'AeLocked': True, 'FrameCount': self.frame_count}
+
+    def capture_file(self, target, name="main", format=None, **kwargs):
+        frame = self.capture_array(name)
+        ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR),
+                                   [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        if not ok:
+            raise RuntimeError("模拟相机JPEG编码失败")
+        if hasattr(target, 'write'):
+            target.write(encoded.tobytes())
+        else:
+            with open(target, 'wb') as f:
+                f.write(encoded.tobytes())
+        return {'FrameCount': self.frame_count, 'ExposureTime': 10000, 'AnalogueGain': 1.0}
+
+    def switch_mode_and_capture_file(self, config, target, **kwargs):
+        previous = self.config
+        self.switch_mode(config)
+        try:
+            return self.capture_file(target, **kwargs)
+        finally:
+            self.config = previous
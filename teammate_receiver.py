@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+本地队友接收端（替身）
+实现队友服务器的照片/状态接口，用于在没有队友主机时联调和测试上传性能
+"""
+
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+
+from flask import Flask, request, jsonify
+from werkzeug.serving import make_server, WSGIRequestHandler
+
+from teammate_sender import TRANSFER_MODES, PHOTO_METADATA_HEADER
+
+
+def create_receiver_app(save_dir=None, latency=0.0):
+    """创建接收端Flask应用
+
+    参数:
+        save_dir: 收到的照片保存目录，None 表示只计数不落盘
+        latency: 每个请求额外的处理延时（秒），用于模拟慢速接收端
+    """
+    app = Flask(__name__)
+    stats_lock = threading.Lock()
+    stats = {
+        'requests': 0,
+        'photos': 0,
+        'bytes': 0,
+        'status_messages': 0,
+        'references': 0,
+        'modes': {}
+    }
+
+    if save_dir and not os.path.exists(save_dir):
+        os.makedirs(save_dir)
+
+    def _record_photo(image_bytes, metadata, mode):
+        with stats_lock:
+            stats['photos'] += 1
+            stats['bytes'] += len(image_bytes)
+            stats['modes'][mode] = stats['modes'].get(mode, 0) + 1
+        if save_dir:
+            filename = os.path.basename(metadata.get('filename') or f"photo_{stats['photos']:04d}.jpg")
+            with open(os.path.join(save_dir, filename), 'wb') as f:
+                f.write(image_bytes)
+
+    @app.before_request
+    def _simulate_latency():
+        with stats_lock:
+            stats['requests'] += 1
+        if latency:
+            time.sleep(latency)
+
+    @app.route('/api/ping')
+    def ping():
+        return jsonify({'success': True})
+
+    @app.route('/api/capabilities')
+    def capabilities():
+        return jsonify({'photo_modes': list(TRANSFER_MODES), 'batch': True, 'photo_references': True})
+
+    @app.route('/api/receive_photo', methods=['POST'])
+    def receive_photo():
+        content_type = request.mimetype
+        if content_type == 'image/jpeg':
+            metadata = json.loads(request.headers.get(PHOTO_METADATA_HEADER, '{}'))
+            _record_photo(request.get_data(), metadata, 'raw')
+        elif content_type == 'multipart/form-data':
+            image = request.files.get('image')
+            if image is None:
+                return jsonify({'success': False, 'error': '缺少image字段'})
+            metadata = json.loads(request.form.get('metadata', '{}'))
+            _record_photo(image.read(), metadata, 'multipart')
+        else:
+            data = request.get_json(silent=True)
+            if not data or 'image' not in data:
+                return jsonify({'success': False, 'error': '数据格式错误'})
+            _record_photo(base64.b64decode(data['image']), data, 'json')
+        return jsonify({'success': True})
+
+    @app.route('/api/receive_photos', methods=['POST'])
+    def receive_photos():
+        images = request.files.getlist('images')
+        metadata = json.loads(request.form.get('metadata', '[]'))
+        if len(images) != len(metadata):
+            return jsonify({'success': False, 'error': '照片与元数据数量不一致'})
+        for image, meta in zip(images, metadata):
+            _record_photo(image.read(), meta, 'batch')
+        return jsonify({'success': True, 'received': len(images)})
+
+    @app.route('/api/receive_photo_reference', methods=['POST'])
+    def receive_photo_reference():
+        data = request.get_json(silent=True)
+        if not data or 'same_as' not in data:
+            return jsonify({'success': False, 'error': '数据格式错误'})
+        with stats_lock:
+            stats['references'] += 1
+        if save_dir and data.get('same_as_filename') and data.get('filename'):
+            # 引用的照片已保存时复制一份，接收端目录中的照片仍然完整
+            source = os.path.join(save_dir, os.path.basename(data['same_as_filename']))
+            if os.path.exists(source):
+                with open(source, 'rb') as src, \
+                        open(os.path.join(save_dir, os.path.basename(data['filename'])), 'wb') as dst:
+                    dst.write(src.read())
+        return jsonify({'success': True})
+
+    @app.route('/api/receive_status', methods=['POST'])
+    def receive_status():
+        with stats_lock:
+            stats['status_messages'] += 1
+        return jsonify({'success': True})
+
+    @app.route('/api/stats')
+    def get_stats():
+        with stats_lock:
+            return jsonify(dict(stats, modes=dict(stats['modes'])))
+
+    return app
+
+
+class _QuietRequestHandler(WSGIRequestHandler):
+    """不打印访问日志，避免干扰基准测试输出"""
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+class ReceiverServer:
+    """在后台线程中运行的接收端，用于测试和基准脚本"""
+
+    def __init__(self, host='127.0.0.1', port=0, **app_options):
+        self.app = create_receiver_app(**app_options)
+        self.server = make_server(host, port, self.app, threaded=True,
+                                  request_handler=_QuietRequestHandler)
+        self.url = f"http://{host}:{self.server.server_port}"
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        if self._thread:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地队友接收端')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--save-dir', default=None, help='保存收到照片的目录')
+    parser.add_argument('--latency', type=float, default=0.0, help='每个请求的模拟处理延时（秒）')
+    args = parser.parse_args()
+
+    print(f"本地接收端启动: http://{args.host}:{args.port}")
+    create_receiver_app(save_dir=args.save_dir, latency=args.latency).run(
+        host=args.host, port=args.port, threaded=True)
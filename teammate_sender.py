@@ -5,87 +5,659 @@
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import base64
+import io
+import logging
 import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime
 
+import metrics
+from app_logging import RateLimitedLogger
+
+logger = logging.getLogger(__name__)
+# 队友离线时每张照片都会失败，限流后只定期输出一条
+upload_error_logger = RateLimitedLogger(logger)
+
 # 配置树莓派IP地址 - 请修改为实际IP
 RASPBERRY_PI_IP = "192.168.235.170"  # 修改为你的树莓派IP
 API_URL = f"http://{RASPBERRY_PI_IP}:5000/api/receive_angles"
 
+# 照片传输方式，按速度从快到慢排列
+#   raw       - 请求体为原始JPEG，元数据放在 X-Photo-Metadata 请求头
+#   multipart - multipart/form-data，image 字段为JPEG，metadata 字段为JSON
+#   json      - 旧版接收端使用的 base64-in-JSON
+TRANSFER_MODES = ('raw', 'multipart', 'json')
+PHOTO_METADATA_HEADER = 'X-Photo-Metadata'
+
 class TeammateSender:
-    def __init__(self, teammate_url=None):
+    def __init__(self, teammate_url=None, upload_workers=2, max_pending_uploads=8, transfer_mode=None,
+                 batch_uploads=False, batch_max_count=10, batch_max_bytes=4 * 1024 * 1024,
+                 max_retries=3, retry_backoff=0.5, spool=None):
         self.teammate_url = teammate_url or "http://192.168.235.41:5000"  # 队友的IP地址，需要根据实际情况修改
         self.timeout = 10
+        # 连接池 + 长连接，避免每张照片都重新建立TCP连接
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.session = self._create_session(pool_size=upload_workers + 2)
+        # 批量上传：按张数或字节数把多张照片打包到一次 /api/receive_photos 请求
+        self.batch_uploads = batch_uploads
+        self.batch_max_count = batch_max_count
+        self.batch_max_bytes = batch_max_bytes
+        self.batch_supported = True
+        self._batch_buffer = []
+        self._batch_buffer_bytes = 0
+        # 照片传输方式，None 表示第一次发送时与队友协商
+        self.transfer_mode = transfer_mode
+        self._negotiate_lock = threading.Lock()
+        # 队友是否接受"与第N张相同"的照片引用（/api/receive_photo_reference），协商时确定
+        self.references_supported = False
+        # 后台上传队列：线程池 + 有界信号量，队列满时 enqueue_photo 阻塞等待
+        self.upload_workers = upload_workers
+        self.max_pending_uploads = max_pending_uploads
+        self._upload_executor = None
+        self._upload_slots = threading.BoundedSemaphore(max_pending_uploads)
+        self._upload_lock = threading.Lock()
+        self._pending_uploads = []
+        # 持久化待发队列：发送失败的照片和状态消息由后台线程重发，直到送达
+        self._metrics_scope = metrics.bind_current_scope()
+        self.spool = spool
+        if spool is not None:
+            spool.start(self._deliver_spooled)
     
+    def _create_session(self, pool_size):
+        """创建带连接池和重试退避的HTTP会话"""
+        # 连接错误对所有请求都重试（请求体尚未发出）；
+        # 5xx 状态码只对GET重试，因为流式上传的请求体无法重放
+        retry = Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            backoff_factor=self.retry_backoff,
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
     def set_teammate_url(self, url):
         """设置队友的URL"""
         self.teammate_url = url
-        print(f"队友URL设置为: {self.teammate_url}")
+        self.transfer_mode = None  # 新的接收端需要重新协商
+        self.batch_supported = True
+        self.references_supported = False
+        logger.info(f"队友URL设置为: {self.teammate_url}")
     
     def encode_image_to_base64(self, image_path):
-        """将图片编码为base64字符串"""
+        """将图片编码为base64字符串（image_path 也可以是内存中的JPEG字节）"""
         try:
+            if isinstance(image_path, (bytes, bytearray, memoryview)):
+                return base64.b64encode(image_path).decode('utf-8')
             with open(image_path, 'rb') as image_file:
                 encoded_string = base64.b64encode(image_file.read()).decode('utf-8')
                 return encoded_string
         except Exception as e:
-            print(f"编码图片失败: {e}")
+            logger.error(f"编码图片失败: {e}")
             return None
-    
-    def send_photo(self, photo_path, rotation_number=None, additional_data=None):
-        """发送照片给队友"""
-        if not os.path.exists(photo_path):
-            print(f"照片文件不存在: {photo_path}")
+
+    def negotiate_transfer_mode(self):
+        """询问队友支持的照片传输方式，选择其中最快的一种"""
+        try:
+            response = self.session.get(
+                f"{self.teammate_url}/api/capabilities",
+                timeout=5
+            )
+            if response.status_code == 200:
+                capabilities = response.json()
+                supported = capabilities.get('photo_modes', [])
+                self.batch_supported = capabilities.get('batch', False)
+                self.references_supported = capabilities.get('photo_references', False)
+                for mode in TRANSFER_MODES:
+                    if mode in supported:
+                        self.transfer_mode = mode
+                        break
+                else:
+                    self.transfer_mode = 'json'
+            else:
+                # 旧版接收端没有 /api/capabilities，只支持JSON
+                self.transfer_mode = 'json'
+                self.batch_supported = False
+        except Exception as e:
+            logger.warning(f"协商传输方式失败，使用JSON模式: {e}")
+            self.transfer_mode = 'json'
+            self.batch_supported = False
+
+        logger.info(f"照片传输方式: {self.transfer_mode}")
+        return self.transfer_mode
+
+    def _ensure_transfer_mode(self):
+        """第一次发送前协商传输方式（多个上传线程只协商一次）"""
+        if self.transfer_mode is None:
+            with self._negotiate_lock:
+                if self.transfer_mode is None:
+                    self.negotiate_transfer_mode()
+
+    def _build_photo_metadata(self, filename, rotation_number, additional_data):
+        """构建照片的元数据"""
+        data = {
+            'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'filename': filename,
+            'rotation_number': rotation_number,
+            'sender': 'advance_model_camera'
+        }
+        if additional_data:
+            data.update(additional_data)
+        return data
+
+    def _open_photo(self, photo):
+        """把照片来源统一为可读的文件对象，返回 (文件对象, 文件名, 是否需要关闭)"""
+        if isinstance(photo, (bytes, bytearray, memoryview)):
+            return io.BytesIO(photo), None, True
+        if hasattr(photo, 'read'):
+            return photo, os.path.basename(getattr(photo, 'name', '') or '') or None, False
+        return open(photo, 'rb'), os.path.basename(photo), True
+
+    def _post_photo(self, mode, image_file, metadata):
+        """按指定传输方式发送一张照片"""
+        url = f"{self.teammate_url}/api/receive_photo"
+        if mode == 'raw':
+            # 原始JPEG作为请求体流式发送，元数据放在请求头
+            return self.session.post(
+                url,
+                data=image_file,
+                timeout=self.timeout,
+                headers={
+                    'Content-Type': 'image/jpeg',
+                    PHOTO_METADATA_HEADER: json.dumps(metadata)
+                }
+            )
+        if mode == 'multipart':
+            return self.session.post(
+                url,
+                files={'image': (metadata['filename'], image_file, 'image/jpeg')},
+                data={'metadata': json.dumps(metadata)},
+                timeout=self.timeout
+            )
+
+        data = dict(metadata)
+        data['image'] = base64.b64encode(image_file.read()).decode('utf-8')
+        return self.session.post(
+            url,
+            json=data,
+            timeout=self.timeout,
+            headers={'Content-Type': 'application/json'}
+        )
+
+    def send_photo(self, photo_path, rotation_number=None, additional_data=None, filename=None):
+        """发送照片给队友
+
+        photo_path 可以是文件路径、JPEG字节或已打开的文件对象；
+        传输方式在第一次发送时自动协商，二进制模式失败时回退到JSON。
+        """
+        start_time = time.perf_counter()
+        success = self._send_photo(photo_path, rotation_number, additional_data, filename)
+        metrics.observe('upload_seconds', time.perf_counter() - start_time)
+        if success:
+            metrics.inc('uploads_total')
+            try:
+                metrics.inc('upload_bytes_total', self._photo_size(photo_path))
+            except OSError:
+                pass
+        else:
+            metrics.inc('upload_failures_total')
+        return success
+
+    def _send_photo(self, photo_path, rotation_number, additional_data, filename):
+        if isinstance(photo_path, str) and not os.path.exists(photo_path):
+            logger.warning(f"照片文件不存在: {photo_path}")
             return False
-        
+
+        self._ensure_transfer_mode()
+
+        image_file = None
+        close_file = False
         try:
-            # 编码图片
-            image_base64 = self.encode_image_to_base64(photo_path)
-            if not image_base64:
+            image_file, source_name, close_file = self._open_photo(photo_path)
+            if not filename:
+                filename = source_name or f"rotation_{rotation_number or 0:03d}.jpg"
+            metadata = self._build_photo_metadata(filename, rotation_number, additional_data)
+            start_offset = image_file.tell() if image_file.seekable() else None
+
+            mode = self.transfer_mode
+            response = self._post_photo(mode, image_file, metadata)
+
+            if mode != 'json' and response.status_code in (404, 405, 415) and start_offset is not None:
+                # 接收端不支持二进制上传，回退到JSON并记住结果
+                logger.warning(f"队友不支持{mode}模式(状态码 {response.status_code})，回退到JSON")
+                self.transfer_mode = 'json'
+                image_file.seek(start_offset)
+                response = self._post_photo('json', image_file, metadata)
+
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('success', False):
+                    logger.debug(f"照片发送成功: {filename} -> {self.teammate_url}")
+                    return True
+                else:
+                    logger.error(f"队友处理照片失败: {result.get('error', '未知错误')}")
+                    return False
+            else:
+                upload_error_logger.error('status', f"发送照片失败，状态码: {response.status_code}")
                 return False
-            
-            # 准备发送的数据
-            data = {
-                'image': image_base64,
-                'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-                'filename': os.path.basename(photo_path),
+
+        except requests.exceptions.RequestException as e:
+            upload_error_logger.error('network', f"网络请求失败: {e}")
+            return False
+        except Exception as e:
+            upload_error_logger.error('send', f"发送照片时出错: {e}")
+            return False
+        finally:
+            if image_file is not None and close_file:
+                image_file.close()
+
+    def _photo_size(self, photo):
+        """估算照片字节数，用于按字节数分批"""
+        if isinstance(photo, (bytes, bytearray, memoryview)):
+            return len(photo)
+        if isinstance(photo, str):
+            return os.path.getsize(photo)
+        if hasattr(photo, 'getbuffer'):
+            with photo.getbuffer() as view:
+                return view.nbytes
+        return 0
+
+    def _read_photo_bytes(self, photo):
+        """读取照片的完整JPEG字节，用于写入待发队列"""
+        if isinstance(photo, (bytes, bytearray, memoryview)):
+            return bytes(photo)
+        if isinstance(photo, str):
+            with open(photo, 'rb') as f:
+                return f.read()
+        if hasattr(photo, 'getvalue'):
+            return photo.getvalue()
+        photo.seek(0)
+        return photo.read()
+
+    def _spool_photo(self, photo, rotation_number, additional_data, filename):
+        """把发送失败的照片写入待发队列，返回是否写入成功"""
+        try:
+            if not filename:
+                filename = (os.path.basename(photo) if isinstance(photo, str)
+                            else getattr(photo, 'name', None)) or f"rotation_{rotation_number or 0:03d}.jpg"
+            self.spool.put('photo', {
                 'rotation_number': rotation_number,
-                'sender': 'advance_model_camera'
-            }
-            
-            # 添加额外数据
-            if additional_data:
-                data.update(additional_data)
-            
-            # 发送POST请求
-            response = requests.post(
-                f"{self.teammate_url}/api/receive_photo",
-                json=data,
+                'additional_data': additional_data,
+                'filename': filename
+            }, self._read_photo_bytes(photo))
+            return True
+        except Exception as e:
+            logger.error(f"照片写入待发队列失败: {e}")
+            return False
+
+    def _deliver_spooled(self, entry):
+        """待发队列后台线程调用：重发一条记录"""
+        if entry.kind == 'photo':
+            return self.send_photo(entry.payload, entry.metadata.get('rotation_number'),
+                                   entry.metadata.get('additional_data'), entry.metadata.get('filename'))
+        if entry.kind == 'reference':
+            return self.send_photo_reference(entry.metadata.get('rotation_number'), entry.metadata['reference'],
+                                             entry.metadata.get('additional_data'), entry.metadata.get('filename'))
+        if entry.kind == 'status':
+            return self._post_status(entry.metadata)
+        logger.warning(f"待发队列中有未知类型的记录: {entry.kind}")
+        return True  # 丢弃无法处理的记录
+
+    def supports_photo_references(self):
+        """队友是否接受照片引用（第一次调用时协商）"""
+        self._ensure_transfer_mode()
+        return self.references_supported
+
+    def send_photo_reference(self, rotation_number, reference, additional_data=None, filename=None):
+        """发送照片引用代替完整照片：这张照片与之前发送的第 reference['same_as'] 张几乎相同
+
+        只发送元数据（含 same_as、same_as_filename、hash_distance），不发送JPEG。
+        """
+        metadata = self._build_photo_metadata(filename, rotation_number, additional_data)
+        metadata.update(reference)
+        try:
+            response = self.session.post(
+                f"{self.teammate_url}/api/receive_photo_reference",
+                json=metadata,
                 timeout=self.timeout,
                 headers={'Content-Type': 'application/json'}
             )
-            
+        except requests.exceptions.RequestException as e:
+            upload_error_logger.error('network', f"网络请求失败: {e}")
+            return False
+        if response.status_code == 200 and response.json().get('success', False):
+            logger.debug(f"照片引用发送成功: {filename} = 第{reference['same_as']}张")
+            metrics.inc('photo_references_total')
+            return True
+        logger.error(f"发送照片引用失败，状态码: {response.status_code}")
+        return False
+
+    def split_batches(self, items):
+        """按 batch_max_count / batch_max_bytes 把照片列表切分为多个批次"""
+        batches = []
+        current = []
+        current_bytes = 0
+        for item in items:
+            size = self._photo_size(item['photo'])
+            if current and (len(current) >= self.batch_max_count
+                            or current_bytes + size > self.batch_max_bytes):
+                batches.append(current)
+                current = []
+                current_bytes = 0
+            current.append(item)
+            current_bytes += size
+        if current:
+            batches.append(current)
+        return batches
+
+    def send_photo_batch(self, items):
+        """把多张照片打包成一次 multipart 请求发送到 /api/receive_photos
+
+        items 为字典列表，每项包含 photo（路径/字节/文件对象），
+        以及可选的 rotation_number、additional_data、filename。
+        接收端不支持批量接口时逐张发送。
+        """
+        if not items:
+            return True
+
+        self._ensure_transfer_mode()
+
+        if not self.batch_supported:
+            return all([self.send_photo(item['photo'], item.get('rotation_number'),
+                                        item.get('additional_data'), item.get('filename'))
+                        for item in items])
+
+        opened = []
+        try:
+            files = []
+            metadata = []
+            for item in items:
+                image_file, source_name, close_file = self._open_photo(item['photo'])
+                opened.append((image_file, close_file))
+                rotation_number = item.get('rotation_number')
+                filename = (item.get('filename') or source_name
+                            or f"rotation_{rotation_number or 0:03d}.jpg")
+                files.append(('images', (filename, image_file, 'image/jpeg')))
+                metadata.append(self._build_photo_metadata(
+                    filename, rotation_number, item.get('additional_data')))
+
+            with metrics.timed('upload_seconds'):
+                response = self.session.post(
+                    f"{self.teammate_url}/api/receive_photos",
+                    files=files,
+                    data={'metadata': json.dumps(metadata)},
+                    timeout=self.timeout
+                )
+
+            if response.status_code in (404, 405, 415):
+                logger.warning(f"队友不支持批量上传(状态码 {response.status_code})，改为逐张发送")
+                self.batch_supported = False
+                for image_file, _ in opened:
+                    image_file.seek(0)
+                return all([self.send_photo(item['photo'], item.get('rotation_number'),
+                                            item.get('additional_data'), item.get('filename'))
+                            for item in items])
+
             if response.status_code == 200:
                 result = response.json()
                 if result.get('success', False):
-                    print(f"照片发送成功: {photo_path} -> {self.teammate_url}")
+                    logger.debug(f"批量发送成功: {len(items)}张照片 -> {self.teammate_url}")
+                    metrics.inc('uploads_total', len(items))
+                    metrics.inc('upload_bytes_total', sum(self._photo_size(item['photo']) for item in items))
                     return True
-                else:
-                    print(f"队友处理照片失败: {result.get('error', '未知错误')}")
-                    return False
+                logger.error(f"队友处理批量照片失败: {result.get('error', '未知错误')}")
             else:
-                print(f"发送照片失败，状态码: {response.status_code}")
-                return False
-                
+                upload_error_logger.error('status', f"批量发送照片失败，状态码: {response.status_code}")
+            metrics.inc('upload_failures_total', len(items))
+            return False
+
         except requests.exceptions.RequestException as e:
-            print(f"网络请求失败: {e}")
+            upload_error_logger.error('network', f"网络请求失败: {e}")
+            metrics.inc('upload_failures_total', len(items))
             return False
         except Exception as e:
-            print(f"发送照片时出错: {e}")
+            upload_error_logger.error('send', f"批量发送照片时出错: {e}")
+            metrics.inc('upload_failures_total', len(items))
             return False
-    
+        finally:
+            for image_file, close_file in opened:
+                if close_file:
+                    image_file.close()
+
+    def send_photos(self, items):
+        """分批发送多张照片，返回每个批次是否成功的列表"""
+        return [self.send_photo_batch(batch) for batch in self.split_batches(items)]
+
+    def _get_upload_executor(self):
+        """懒加载上传线程池"""
+        with self._upload_lock:
+            if self._upload_executor is None:
+                self._upload_executor = ThreadPoolExecutor(
+                    max_workers=self.upload_workers,
+                    thread_name_prefix="photo-upload"
+                )
+            return self._upload_executor
+
+    def _upload_task(self, photo_path, rotation_number, additional_data, filename=None):
+        """上传线程中执行的单张照片发送，返回 (是否成功, 耗时, 是否转入待发队列)"""
+        start_time = time.time()
+        success = False
+        if self.spool is None or not self.spool.backing_off():
+            try:
+                success = self.send_photo(photo_path, rotation_number, additional_data, filename)
+            except Exception as e:
+                upload_error_logger.error('task', f"后台上传照片时出错: {e}")
+            self._record_delivery(success)
+        # 队友离线期间直接写入待发队列，不再逐张等待网络超时
+        spooled = (not success and self.spool is not None
+                   and self._spool_photo(photo_path, rotation_number, additional_data, filename))
+        return success, time.time() - start_time, spooled
+
+    def _batch_upload_task(self, items):
+        """上传线程中执行的批量发送"""
+        start_time = time.time()
+        success = False
+        if self.spool is None or not self.spool.backing_off():
+            try:
+                success = self.send_photo_batch(items)
+            except Exception as e:
+                logger.error(f"后台批量上传照片时出错: {e}")
+            self._record_delivery(success)
+        spooled = (not success and self.spool is not None
+                   and all([self._spool_photo(item['photo'], item['rotation_number'],
+                                              item['additional_data'], item['filename'])
+                            for item in items]))
+        return success, time.time() - start_time, spooled
+
+    def _reference_task(self, rotation_number, reference, additional_data, filename):
+        """上传线程中执行的照片引用发送，返回值与 _upload_task 相同"""
+        start_time = time.time()
+        success = False
+        if self.spool is None or not self.spool.backing_off():
+            try:
+                success = self.send_photo_reference(rotation_number, reference, additional_data, filename)
+            except Exception as e:
+                upload_error_logger.error('task', f"后台发送照片引用时出错: {e}")
+            self._record_delivery(success)
+        spooled = False
+        if not success and self.spool is not None:
+            try:
+                self.spool.put('reference', {
+                    'rotation_number': rotation_number,
+                    'reference': reference,
+                    'additional_data': additional_data,
+                    'filename': filename
+                })
+                spooled = True
+            except Exception as e:
+                logger.error(f"照片引用写入待发队列失败: {e}")
+        return success, time.time() - start_time, spooled
+
+    def _record_delivery(self, success):
+        """把发送结果告知待发队列，用于判断队友是否离线"""
+        if self.spool is not None:
+            if success:
+                self.spool.record_success()
+            else:
+                self.spool.record_failure()
+
+    def _submit_upload(self, fn, *args, on_complete=None):
+        """在有界队列中提交一个上传任务，完成后调用 on_complete(是否成功)"""
+        executor = self._get_upload_executor()
+        self._upload_slots.acquire()
+        scopes = self._metrics_scope.registries + metrics.current_scopes()
+
+        def _run():
+            # 上传线程继续把指标记到所属转台和提交者（扫描任务）的注册表
+            with metrics.scoped(scopes):
+                return fn(*args)
+
+        try:
+            future = executor.submit(_run)
+        except Exception:
+            self._upload_slots.release()
+            raise
+
+        def _done(f):
+            self._upload_slots.release()
+            for callback in (on_complete if isinstance(on_complete, list) else [on_complete]):
+                if callback:
+                    try:
+                        callback(not f.cancelled() and f.exception() is None and f.result()[0])
+                    except Exception as e:
+                        logger.error(f"上传完成回调出错: {e}")
+
+        future.add_done_callback(_done)
+        return future
+
+    def _submit_batch_buffer(self):
+        """把当前累积的批次提交到上传队列"""
+        with self._upload_lock:
+            items = self._batch_buffer
+            self._batch_buffer = []
+            self._batch_buffer_bytes = 0
+        if not items:
+            return None
+        future = self._submit_upload(self._batch_upload_task, items,
+                                     on_complete=[item['on_complete'] for item in items])
+        with self._upload_lock:
+            for item in items:
+                self._pending_uploads.append((item['rotation_number'], item['label'], future))
+        return future
+
+    def enqueue_photo(self, photo_path, rotation_number=None, additional_data=None, filename=None,
+                      on_complete=None):
+        """将照片放入后台上传队列后立即返回，队列已满时阻塞直到有空位
+
+        开启 batch_uploads 时照片先累积，达到批次上限后整批提交。
+        on_complete(是否成功) 在这张照片上传结束后调用，可用于释放内存缓冲区。
+        """
+        label = photo_path if isinstance(photo_path, str) else filename
+        if self.batch_uploads:
+            size = self._photo_size(photo_path)
+            with self._upload_lock:
+                full = self._batch_buffer and (
+                    len(self._batch_buffer) >= self.batch_max_count
+                    or self._batch_buffer_bytes + size > self.batch_max_bytes)
+            if full:
+                self._submit_batch_buffer()
+            with self._upload_lock:
+                self._batch_buffer.append({
+                    'photo': photo_path,
+                    'rotation_number': rotation_number,
+                    'additional_data': additional_data,
+                    'filename': filename,
+                    'label': label,
+                    'on_complete': on_complete
+                })
+                self._batch_buffer_bytes += size
+            return None
+
+        future = self._submit_upload(self._upload_task, photo_path, rotation_number,
+                                     additional_data, filename, on_complete=on_complete)
+        with self._upload_lock:
+            self._pending_uploads.append((rotation_number, label, future))
+        return future
+
+    def enqueue_photo_reference(self, rotation_number, reference, additional_data=None, filename=None,
+                                on_complete=None):
+        """把照片引用放入后台上传队列，和照片一样计入 flush_uploads 的报告"""
+        future = self._submit_upload(self._reference_task, rotation_number, reference,
+                                     additional_data, filename, on_complete=on_complete)
+        with self._upload_lock:
+            self._pending_uploads.append((rotation_number, filename, future))
+        return future
+
+    def pending_upload_count(self):
+        """返回尚未完成的上传数量"""
+        with self._upload_lock:
+            return (len(self._batch_buffer)
+                    + sum(1 for _, _, future in self._pending_uploads if not future.done()))
+
+    def flush_uploads(self, timeout=None):
+        """等待队列中所有照片上传完成，返回逐张照片的上传结果报告"""
+        self._submit_batch_buffer()
+        with self._upload_lock:
+            pending = self._pending_uploads
+            self._pending_uploads = []
+
+        wait(set(future for _, _, future in pending), timeout=timeout)
+
+        results = []
+        for rotation_number, photo_path, future in pending:
+            if future.done():
+                success, elapsed, spooled = future.result()
+            else:
+                success, elapsed, spooled = False, None, False
+            results.append({
+                'rotation_number': rotation_number,
+                'photo_path': photo_path,
+                'success': success,
+                'spooled': spooled,
+                'finished': future.done(),
+                'elapsed': elapsed
+            })
+
+        succeeded = sum(1 for r in results if r['success'])
+        spooled = sum(1 for r in results if r['spooled'])
+        report = {
+            'total': len(results),
+            'succeeded': succeeded,
+            'spooled': spooled,
+            'failed': len(results) - succeeded - spooled,
+            'results': results
+        }
+        if spooled:
+            logger.info(f"照片上传完成: 成功 {succeeded}/{len(results)}，{spooled}张转入待发队列稍后重发")
+        else:
+            logger.info(f"照片上传完成: 成功 {succeeded}/{len(results)}")
+        return report
+
+    def shutdown_uploads(self, wait_for_pending=True):
+        """关闭上传线程池和HTTP会话"""
+        with self._upload_lock:
+            executor = self._upload_executor
+            self._upload_executor = None
+        if executor:
+            executor.shutdown(wait=wait_for_pending)
+        if self.spool is not None:
+            self.spool.stop()
+        self.session.close()
+
     def send_rotation_status(self, rotation_number, status, photo_path=None):
         """发送旋转状态信息"""
         try:
@@ -102,40 +674,50 @@ class TeammateSender:
                     'rotation_status': status
                 })
             else:
-                # 只发送状态信息
-                response = requests.post(
-                    f"{self.teammate_url}/api/receive_status",
-                    json=data,
-                    timeout=self.timeout,
-                    headers={'Content-Type': 'application/json'}
-                )
-                
-                if response.status_code == 200:
-                    print(f"状态发送成功: 旋转{rotation_number} - {status}")
+                # 只发送状态信息，失败时写入待发队列
+                if self._post_status(data):
                     return True
-                else:
-                    print(f"发送状态失败，状态码: {response.status_code}")
-                    return False
+                if self.spool is not None:
+                    self.spool.put('status', data)
+                return False
                     
         except Exception as e:
-            print(f"发送状态时出错: {e}")
+            logger.error(f"发送状态时出错: {e}")
             return False
+
+    def _post_status(self, data):
+        """发送一条状态消息到 /api/receive_status"""
+        try:
+            response = self.session.post(
+                f"{self.teammate_url}/api/receive_status",
+                json=data,
+                timeout=self.timeout,
+                headers={'Content-Type': 'application/json'}
+            )
+        except requests.exceptions.RequestException as e:
+            upload_error_logger.error('network', f"网络请求失败: {e}")
+            return False
+        if response.status_code == 200:
+            logger.debug(f"状态发送成功: 旋转{data.get('rotation_number')} - {data.get('status')}")
+            return True
+        logger.error(f"发送状态失败，状态码: {response.status_code}")
+        return False
     
     def test_connection(self):
         """测试与队友的连接"""
         try:
-            response = requests.get(
+            response = self.session.get(
                 f"{self.teammate_url}/api/ping",
                 timeout=5
             )
             if response.status_code == 200:
-                print(f"与队友连接正常: {self.teammate_url}")
+                logger.info(f"与队友连接正常: {self.teammate_url}")
                 return True
             else:
-                print(f"队友连接异常，状态码: {response.status_code}")
+                logger.error(f"队友连接异常，状态码: {response.status_code}")
                 return False
         except Exception as e:
-            print(f"连接测试失败: {e}")
+            logger.error(f"连接测试失败: {e}")
             return False
 
 # 配置树莓派IP地址 - 请修改为实际IP
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""
+日志环形缓冲区测试
+limit 为0或负数时不返回日志，而不是返回整个缓冲区
+"""
+
+import logging
+
+import pytest
+
+from app_logging import RingBufferHandler
+
+
+@pytest.fixture
+def handler():
+    handler = RingBufferHandler(capacity=5)
+    logger = logging.getLogger('test_app_logging')
+    for i in range(8):
+        handler.handle(logger.makeRecord(logger.name, logging.WARNING, __file__, 0, f"消息{i}", (), None))
+    return handler
+
+
+def test_limit(handler):
+    assert [r['message'] for r in handler.get_records(limit=2)] == ['消息6', '消息7']
+    assert len(handler.get_records(limit=100)) == 5
+    assert handler.get_records(limit=0) == []
+    assert handler.get_records(limit=-1) == []
+
+
+@pytest.mark.parametrize('limit', ['0', '-1'])
+def test_api_logs_limit_returns_nothing(client, limit):
+    logging.getLogger('app').warning("日志接口测试")
+    assert client.get(f"/api/logs?limit={limit}").get_json()['logs'] == []
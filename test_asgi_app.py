@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+异步服务模式测试
+ASGI包装层把请求正确转给Flask；需要获取工作线程锁的接口在线程池中执行，锁被长时间持有时
+事件循环上的其他请求不受影响
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+import pytest
+
+from scan_jobs import ScanJob
+
+
+@pytest.fixture
+def server(app_module):
+    from asgi_app import AsyncServer
+    server = AsyncServer(app_module.app, app_module.rigs, io_threads=2)
+    yield server
+    server.executor.shutdown(wait=True)
+
+
+async def request(server, method, path, body=b'', query=b''):
+    """发送一次ASGI请求，返回 (状态码, 响应头字典, 响应体)"""
+    scope = {
+        'type': 'http', 'method': method, 'path': path, 'query_string': query, 'http_version': '1.1',
+        'scheme': 'http', 'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())]
+    }
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    finished = asyncio.Event()
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        sent.append(message)
+
+    try:
+        await server(scope, receive, send)
+    finally:
+        finished.set()
+    start = sent[0]
+    headers = {name.decode(): value.decode() for name, value in start['headers']}
+    return start['status'], headers, b''.join(message.get('body', b'') for message in sent[1:])
+
+
+def test_requests_are_forwarded_to_flask(server, app_module):
+    async def scenario():
+        angles = [10, 45.5, 90, 135]
+        status, _, body = await request(server, 'POST', '/api/receive_angles',
+                                        json.dumps({'angles': angles}).encode())
+        assert status == 200
+        assert json.loads(body)['success'], body
+        status, headers, body = await request(server, 'GET', '/api/get_status')
+        assert status == 200
+        assert headers['content-type'].startswith('application/json')
+        assert json.loads(body)['angles'] == angles
+        status, _, body = await request(server, 'GET', '/rigs/rig0/api/jobs/no-such-job')
+        assert status == 404
+        status, _, _ = await request(server, 'GET', '/no/such/route')
+        assert status == 404
+
+    latest_angles = app_module.rigs.default.latest_angles
+    saved = dict(latest_angles)
+    try:
+        asyncio.run(scenario())
+    finally:
+        latest_angles.update(saved)
+
+
+def test_locked_handler_does_not_stall_the_event_loop(server, app_module):
+    manager = app_module.rigs.default.scan_jobs
+    job = ScanJob('asgi-lock-test')
+    manager.jobs[job.job_id] = job
+    hold_seconds = 0.5
+    locked = threading.Event()
+
+    def hold_job_lock():
+        # 模拟扫描线程长时间持有任务的锁
+        with job._lock:
+            locked.set()
+            time.sleep(hold_seconds)
+
+    async def scenario():
+        slow = asyncio.ensure_future(request(server, 'GET', f"/api/jobs/{job.job_id}"))
+        await asyncio.sleep(0.05)  # 让 get_job 先开始等锁
+        started = time.perf_counter()
+        status, _, _ = await request(server, 'GET', '/api/get_status')
+        fast_seconds = time.perf_counter() - started
+        assert status == 200
+        assert not slow.done()
+        status, _, body = await slow
+        assert status == 200
+        assert json.loads(body)['job_id'] == job.job_id
+        return fast_seconds
+
+    holder = threading.Thread(target=hold_job_lock)
+    holder.start()
+    try:
+        assert locked.wait(5)
+        fast_seconds = asyncio.run(scenario())
+    finally:
+        holder.join()
+        manager.jobs.pop(job.job_id, None)
+    assert fast_seconds < hold_seconds / 2
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+事件总线与SSE测试
+重连时按 Last-Event-ID 补发错过的事件；错过的事件已不在历史中时改发快照；
+客户端断开后订阅回调被移除
+"""
+
+import asyncio
+
+import pytest
+
+from events import EventBus, parse_last_event_id
+
+
+def snapshot():
+    return {'state': 'now'}
+
+
+def publish(bus, count):
+    return [bus.publish('job', {'n': i}).id for i in range(count)]
+
+
+def test_replay_sends_missed_events():
+    bus = EventBus(history=10)
+    ids = publish(bus, 6)
+    events, last = bus.replay(ids[2], snapshot)
+    assert [event.id for event in events] == ids[3:]
+    assert [event.data['n'] for event in events] == [3, 4, 5]
+    assert last == ids[-1]
+    # 已经是最新的：不补发，也不发快照
+    assert bus.replay(ids[-1], snapshot) == ([], ids[-1])
+
+
+@pytest.mark.parametrize('last_id', [None, 999])
+def test_new_connection_or_restarted_server_gets_snapshot(last_id):
+    bus = EventBus(history=10)
+    ids = publish(bus, 3)
+    events, last = bus.replay(last_id, snapshot)
+    assert [(event.type, event.data) for event in events] == [('snapshot', {'state': 'now'})]
+    assert last == ids[-1]
+
+
+def test_history_overflow_falls_back_to_snapshot():
+    bus = EventBus(history=5)
+    ids = publish(bus, 12)  # 历史中只剩 8..12
+    # 要求的下一条（8）仍在历史中：照常补发
+    events, _ = bus.replay(ids[6], snapshot)
+    assert [event.id for event in events] == ids[7:]
+    # 要求的下一条（7）已被挤出：补发不完整，改发快照
+    events, last = bus.replay(ids[5], snapshot)
+    assert [event.type for event in events] == ['snapshot']
+    assert last == ids[-1]
+
+
+def test_parse_last_event_id():
+    assert parse_last_event_id('42') == 42
+    assert parse_last_event_id('') is None
+    assert parse_last_event_id('abc') is None
+    assert parse_last_event_id(None) is None
+
+
+def read_sse(chunks, count):
+    """从SSE响应中读出 count 个事件，返回 [(id, event)]"""
+    events = []
+    for chunk in chunks:
+        text = chunk.decode('utf-8')
+        if text.startswith('id: '):
+            lines = dict(line.split(': ', 1) for line in text.strip().split('\n'))
+            events.append((int(lines['id']), lines['event']))
+            if len(events) == count:
+                break
+    return events
+
+
+def test_flask_sse_replays_from_last_event_id(client, app_module):
+    bus = app_module.rigs.default.events
+    ids = publish(bus, 4)
+    response = client.get('/api/events', headers={'Last-Event-ID': str(ids[1])}, buffered=False)
+    try:
+        assert response.mimetype == 'text/event-stream'
+        assert read_sse(response.response, 2) == [(ids[2], 'job'), (ids[3], 'job')]
+    finally:
+        response.close()
+
+
+def test_asgi_sse_replays_and_cleans_up_on_disconnect(app_module):
+    from asgi_app import AsyncServer
+    server = AsyncServer(app_module.app, app_module.rigs, io_threads=1)
+    bus = app_module.rigs.default.events
+    listeners_before = bus.stats()['listeners']
+    ids = publish(bus, 3)
+
+    async def scenario():
+        scope = {
+            'type': 'http', 'method': 'GET', 'path': '/api/events', 'query_string': b'',
+            'http_version': '1.1', 'scheme': 'http', 'server': ('testserver', 80),
+            'client': ('127.0.0.1', 50000),
+            'headers': [(b'host', b'testserver'), (b'last-event-id', str(ids[0]).encode())]
+        }
+        received = []
+        disconnect = asyncio.Event()
+        requested = published = False
+
+        async def receive():
+            nonlocal requested
+            if not requested:
+                requested = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            nonlocal published
+            body = message.get('body', b'')
+            if body.startswith(b'id: '):
+                received.append(int(body.split(b'\n', 1)[0][4:]))
+            if len(received) == 2 and not published:
+                assert bus.stats()['listeners'] == listeners_before + 1
+                # 新事件也会推送给已连接的客户端
+                published = True
+                bus.publish('job', {'n': 'live'})
+            if len(received) == 3:
+                disconnect.set()
+
+        await asyncio.wait_for(server(scope, receive, send), timeout=5)
+        return received
+
+    try:
+        received = asyncio.run(scenario())
+    finally:
+        server.executor.shutdown(wait=True)
+    assert received[:2] == ids[1:]
+    assert received[2] == ids[2] + 1
+    assert bus.stats()['listeners'] == listeners_before
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+运动程序测试
+拍照回调阻塞的时间远超固件的停留时间时，每次拍照时模拟转台的角度仍必须是该步的角度
+"""
+
+import time
+
+import pytest
+
+from arduino_controller import ArduinoController
+from scan_jobs import ScanJob, ScanJobManager
+from simulation import STEP_DEGREES, SimulatedSerial
+
+# 拍照回调阻塞的时间（例如等待内存缓冲区或上传名额），远大于下面的停留时间
+CAPTURE_BLOCK_SECONDS = 0.05
+DWELL_MS = 5
+
+
+def make_arduino(protocol_version):
+    arduino = ArduinoController(
+        serial_factory=SimulatedSerial.factory(motion_delay=0.002, protocol_version=protocol_version),
+        startup_delay=0)
+    arduino.probe_protocol()
+    return arduino
+
+
+@pytest.mark.parametrize('protocol_version', [2, 3, 4])
+@pytest.mark.parametrize('stride', [1, 3])
+def test_motor_holds_while_on_step_blocks(protocol_version, stride):
+    arduino = make_arduino(protocol_version)
+    captured = []
+
+    def on_step(step):
+        before = arduino.ser.angle
+        time.sleep(CAPTURE_BLOCK_SECONDS)
+        captured.append((step, before, arduino.ser.angle))
+
+    try:
+        completed = arduino.run_motion_program(6, dwell_ms=DWELL_MS, on_step=on_step, stride=stride, hold=True)
+    finally:
+        arduino.close()
+
+    assert completed == 6
+    assert [step for step, _, _ in captured] == list(range(1, 7))
+    for step, before, after in captured:
+        expected = step * stride * STEP_DEGREES % 360
+        assert before == expected
+        assert after == expected
+
+
+@pytest.mark.parametrize('protocol_version', [1, 2, 4])
+def test_drive_captures_at_planned_angles(protocol_version):
+    arduino = make_arduino(protocol_version)
+    manager = ScanJobManager(arduino, camera=None, teammate=None, angle_state={},
+                             checkpoint_dir=None, capture_dwell_ms=DWELL_MS)
+    job = ScanJob('test-drive')
+    angles = {}
+
+    def on_arrive(position):
+        angles[position] = arduino.ser.angle
+        time.sleep(CAPTURE_BLOCK_SECONDS)
+
+    try:
+        manager._drive(job, [2, 4, 6, 8, 10], 2, DWELL_MS, on_arrive=on_arrive)
+    finally:
+        arduino.close()
+
+    assert angles == {position: position * STEP_DEGREES for position in (2, 4, 6, 8, 10)}
+    assert job.checkpoint['position'] == 10
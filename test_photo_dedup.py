@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""
+重复照片抑制测试
+默认设置下不同视角的照片都完整上传；只有显式设置阈值且画面确实不变时才只发送引用
+"""
+
+import cv2
+
+from scan_jobs import ScanJob, ScanJobManager
+from simulation import SimulatedPicamera2
+
+
+class ReferenceTeammate:
+    """支持照片引用的队友"""
+
+    def supports_photo_references(self):
+        return True
+
+
+def simulated_views(count, static_scene=False):
+    """模拟相机依次拍摄的 count 张JPEG（画面随帧号变化，相当于转台转过的不同视角）"""
+    camera = SimulatedPicamera2(frame_rate=1000, static_scene=static_scene)
+    camera.configure(camera.create_still_configuration(main={'size': (640, 480)}))
+    views = []
+    for _ in range(count):
+        frame = camera.capture_array('main')
+        ok, encoded = cv2.imencode('.jpg', cv2.cvtColor(frame, cv2.COLOR_RGB2BGR))
+        assert ok
+        views.append(encoded.tobytes())
+    return views
+
+
+def references(manager, views):
+    job = ScanJob('test-dedup')
+    return [manager._duplicate_reference(job, data, number, f"rotation_{number:03d}.jpg")
+            for number, data in enumerate(views, 1)]
+
+
+def test_distinct_views_are_not_suppressed_by_default():
+    manager = ScanJobManager(None, None, ReferenceTeammate(), {}, checkpoint_dir=None)
+    assert references(manager, simulated_views(20)) == [None] * 20
+
+
+def test_static_scene_is_suppressed_when_enabled():
+    manager = ScanJobManager(None, None, ReferenceTeammate(), {}, checkpoint_dir=None, dedup_max_distance=4)
+    result = references(manager, simulated_views(5, static_scene=True))
+    assert result[0] is None
+    assert all(reference and reference['same_as'] == 1 for reference in result[1:])
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+异步落盘测试
+SD卡 fsync 出错（EIO、ENOSPC）时写入线程必须继续工作：之后的照片照常写完，缓冲区全部回到缓冲池
+"""
+
+import errno
+import os
+import threading
+
+import pytest
+
+import photo_writer
+from photo_writer import AsyncPhotoWriter, PhotoBufferPool
+
+
+def flush(writer, timeout=5):
+    """flush() 在写入线程退出时会永远阻塞，测试中加超时"""
+    done = threading.Event()
+    threading.Thread(target=lambda: (writer.flush(), done.set()), daemon=True).start()
+    assert done.wait(timeout), "flush() 没有返回，写入线程可能已经退出"
+
+
+def write_photos(writer, pool, tmp_path, names):
+    for name in names:
+        buffer = pool.acquire(name, timeout=5)
+        assert buffer is not None, "缓冲池耗尽"
+        buffer.file.write(b'jpeg ' + name.encode())
+        writer.write(str(tmp_path / name), buffer)
+
+
+@pytest.mark.parametrize('fail_on', ['file', 'dir'])
+def test_fsync_failure_keeps_writer_alive(tmp_path, monkeypatch, fail_on):
+    real_fsync = os.fsync
+    failures = []
+
+    def flaky_fsync(fd):
+        # 第一批的第一次（文件或目录）fsync 失败
+        if not failures and os.path.isdir(f"/proc/self/fd/{fd}") == (fail_on == 'dir'):
+            failures.append(fd)
+            raise OSError(errno.EIO, 'Input/output error')
+        return real_fsync(fd)
+
+    monkeypatch.setattr(photo_writer.os, 'fsync', flaky_fsync)
+    written = []
+    pool = PhotoBufferPool(2)
+    writer = AsyncPhotoWriter(fsync='batch', batch_size=1, on_written=written.append)
+
+    write_photos(writer, pool, tmp_path, ['a.jpg'])
+    flush(writer)
+    assert failures
+    assert writer.errors == 1
+    assert written == []
+
+    # 缓冲池只有2个缓冲区，写入线程退出时第3张就会拿不到缓冲区
+    write_photos(writer, pool, tmp_path, ['b.jpg', 'c.jpg', 'd.jpg'])
+    flush(writer)
+    assert writer.errors == 1
+    assert written == [str(tmp_path / name) for name in ('b.jpg', 'c.jpg', 'd.jpg')]
+    assert (tmp_path / 'd.jpg').read_bytes() == b'jpeg d.jpg'
+    assert pool.available() == 2
+
+
+def test_unexpected_error_in_batch_keeps_writer_alive(tmp_path, monkeypatch):
+    pool = PhotoBufferPool(2)
+    writer = AsyncPhotoWriter(fsync='batch', batch_size=1)
+    calls = []
+
+    def broken_fsync_dirs(dirs):
+        calls.append(dirs)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+        return set()
+
+    monkeypatch.setattr(writer, '_fsync_dirs', broken_fsync_dirs)
+    write_photos(writer, pool, tmp_path, ['a.jpg', 'b.jpg', 'c.jpg'])
+    flush(writer)
+    assert (tmp_path / 'c.jpg').exists()
+    assert pool.available() == 2
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+缩略图缓存测试
+启动时 fork 的进程池确实被使用；工作进程被杀（例如内存不足）后改用线程继续生成，
+/gallery 的缩略图不会一直返回500。
+进程池只能在没有其他线程时创建，所以这些场景在新的子进程中运行
+"""
+
+import json
+import os
+import subprocess
+import sys
+import textwrap
+
+import pytest
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+pytestmark = pytest.mark.skipif(sys.platform == 'win32', reason='进程池需要 fork')
+
+# 写一张带内容的测试照片，seed 不同则内容（摘要）不同
+WRITE_PHOTO = '''
+import cv2
+import numpy as np
+
+def write_photo(path, seed):
+    image = np.random.default_rng(seed).integers(0, 256, (480, 640, 3), dtype=np.uint8)
+    assert cv2.imwrite(str(path), image)
+    return str(path)
+'''
+
+
+def run_script(tmp_path, script, env=None):
+    """在新的Python进程中执行脚本，返回脚本最后一行输出的JSON"""
+    completed = subprocess.run(
+        [sys.executable, '-c', WRITE_PHOTO + textwrap.dedent(script)], cwd=tmp_path,
+        env={**os.environ, 'PYTHONPATH': ROOT, **(env or {})},
+        capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def test_killed_worker_falls_back_to_threads(tmp_path):
+    result = run_script(tmp_path, '''
+        import json, os, signal, time
+        from renditions import RenditionCache
+
+        cache = RenditionCache('cache').start()
+        before = cache.stats()['executor']
+        first = cache.get(write_photo('a.jpg', 1), 'thumb')
+        for pid in list(cache._executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        time.sleep(0.5)
+        # 进程池已损坏：后台提交和同步获取都应改用线程完成
+        cache.submit(write_photo('b.jpg', 2)).result(timeout=30)
+        second = cache.get('b.jpg', 'medium')
+        third = cache.get(write_photo('c.jpg', 3), 'thumb')
+        stats = cache.stats()
+        cache.close()
+        print(json.dumps({'before': before, 'after': stats['executor'], 'first': first is not None,
+                          'second': second is not None, 'third': third is not None,
+                          'hits': stats['hits']}))
+    ''')
+    assert result == {'before': 'process', 'after': 'thread', 'first': True, 'second': True,
+                      'third': True, 'hits': 1}
+
+
+def test_broken_pool_during_get_is_retried(tmp_path):
+    result = run_script(tmp_path, '''
+        import json, os, signal
+        from renditions import RenditionCache
+
+        def build_and_die(source_path, cache_dir, sizes):
+            # 模拟生成缩略图时工作进程被杀
+            os.kill(os.getpid(), signal.SIGKILL)
+
+        cache = RenditionCache('cache').start()
+        source = write_photo('a.jpg', 1)
+        # 后台任务进行中（登记为待完成）时工作进程被杀，get() 等到的是 BrokenProcessPool
+        future = cache._executor.submit(build_and_die, source, cache.cache_dir, cache.sizes)
+        cache._pending[source] = (cache._source_key(source), future)
+        found = cache.get(source, 'thumb')
+        stats = cache.stats()
+        cache.close()
+        print(json.dumps({'found': found is not None, 'executor': stats['executor'],
+                          'pending': stats['pending']}))
+    ''')
+    assert result == {'found': True, 'executor': 'thread', 'pending': 0}
+
+
+def test_app_uses_the_startup_process_pool(tmp_path):
+    config = tmp_path / 'rigs.json'
+    config.write_text(json.dumps([{
+        'id': 'rig0', 'port': 'sim0', 'camera_index': 0, 'photos_dir': str(tmp_path / 'photos'),
+        'checkpoint_dir': str(tmp_path / 'checkpoints'), 'spool': str(tmp_path / 'uploads.db')
+    }]))
+    result = run_script(tmp_path, '''
+        import json, os
+        import app
+
+        rig = app.rigs.default
+        os.makedirs(rig.camera.photos_dir, exist_ok=True)
+        write_photo(os.path.join(rig.camera.photos_dir, 'rotation_001.jpg'), 1)
+        client = app.app.test_client()
+        statuses = [client.get(f"/gallery/{name}/rotation_001.jpg").status_code
+                    for name in ('thumb', 'medium', 'thumb')]
+        stats = client.get('/api/renditions').get_json()
+        print(json.dumps({'statuses': statuses, 'executor': stats['executor'], 'hits': stats['hits'],
+                          'errors': stats['errors']}))
+    ''', env={'ADVANCE_MODEL_SIMULATE': '1', 'RIGS_CONFIG': str(config),
+              'RENDITION_CACHE': str(tmp_path / 'renditions'), 'TEAMMATE_URL': 'http://127.0.0.1:9',
+              'LOG_LEVEL': 'WARNING'})
+    assert result == {'statuses': [200, 200, 200], 'executor': 'process', 'hits': 2, 'errors': 0}
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+多转台测试
+两台转台同时工作时，各自的指标带 rig 标签互不混合；关闭转台时停止待发队列和上传会话
+"""
+
+import threading
+
+import metrics
+from rigs import Rig, parse_rig_configs
+from simulation import SimulatedPicamera2, SimulatedSerial
+
+
+def make_rigs(tmp_path, count=2):
+    configs = parse_rig_configs([
+        {'id': f"rig{i}", 'teammate_url': 'http://127.0.0.1:9',
+         'photos_dir': str(tmp_path / f"photos{i}"), 'checkpoint_dir': None,
+         'spool': str(tmp_path / f"uploads{i}.db")}
+        for i in range(count)])
+    return [Rig(config, serial_factory=SimulatedSerial.factory(motion_delay=0.001),
+                camera_factory=SimulatedPicamera2, startup_delay=0)
+            for config in configs]
+
+
+def test_rig_threads_record_into_labeled_registry(tmp_path):
+    rigs = make_rigs(tmp_path)
+    try:
+        def work(rig, count):
+            # 模拟转台工作线程：在构造时捕获的注册表中记录
+            with rig.scan_jobs._metrics_scope:
+                for _ in range(count):
+                    metrics.observe('capture_seconds', 0.01)
+
+        global_before = metrics.REGISTRY.get('capture_seconds').count
+        threads = [threading.Thread(target=work, args=(rig, n)) for rig, n in zip(rigs, (3, 5))]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert [rig.metrics.get('capture_seconds').count for rig in rigs] == [3, 5]
+        assert metrics.REGISTRY.get('capture_seconds').count == global_before
+
+        text = metrics.render_prometheus([metrics.REGISTRY] + [rig.metrics for rig in rigs])
+        assert 'advance_model_capture_seconds_count{rig="rig0"} 3' in text
+        assert 'advance_model_capture_seconds_count{rig="rig1"} 5' in text
+        assert text.count('# TYPE advance_model_capture_seconds histogram') == 1
+    finally:
+        for rig in rigs:
+            rig.close()
+
+
+def test_close_stops_spool_and_session(tmp_path, monkeypatch):
+    rig, = make_rigs(tmp_path, count=1)
+    spool_thread = rig.teammate.spool._thread
+    assert spool_thread.is_alive()
+    closed = []
+    monkeypatch.setattr(rig.teammate.session, 'close', lambda: closed.append(True))
+
+    rig.close()
+
+    assert not spool_thread.is_alive()
+    assert rig.teammate.spool._thread is None
+    assert closed
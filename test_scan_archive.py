@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+扫描归档导出测试
+边读边发的TAR/ZIP必须能被标准库解开且内容与照片一致；Range续传的片段必须与完整归档对应
+"""
+
+import io
+import json
+import tarfile
+import zipfile
+
+import pytest
+
+from photo_index import PhotoIndex
+from scan_archive import StreamingArchive, scan_photos
+from scan_jobs import ScanJob
+
+
+def make_job(tmp_path, job_id='job-1', count=4):
+    """一个已完成的任务，照片在 tmp_path 中并登记到照片索引"""
+    job = ScanJob(job_id, {'steps': count})
+    job.status = 'completed'
+    job.update_checkpoint(angles=[10.0, 200.0],
+                          stage3_photos=[{'photo': 'angle_1.jpg', 'source': 'capture'}, None])
+    index = PhotoIndex()
+    photos = {}
+    for i in range(count):
+        name = f"rotation_{i + 1:03d}.jpg"
+        data = bytes([i]) * (1000 + 777 * i)
+        (tmp_path / name).write_bytes(data)
+        index.add(i * 4, name, str(tmp_path / name), scan_id=job_id)
+        photos[name] = data
+    (tmp_path / 'angle_1.jpg').write_bytes(b'angle photo')
+    index.add(10.0, 'angle_1.jpg', str(tmp_path / 'angle_1.jpg'), scan_id=job_id, kind='angle')
+    photos['angle_1.jpg'] = b'angle photo'
+    return job, index, photos
+
+
+def build(tmp_path, fmt):
+    job, index, photos = make_job(tmp_path)
+    return (lambda: StreamingArchive(fmt, 'scan_job-1', *scan_photos(job, index))), photos
+
+
+@pytest.mark.parametrize('fmt', ['tar', 'zip'])
+def test_archive_extracts_to_the_photos(tmp_path, fmt):
+    make_archive, photos = build(tmp_path, fmt)
+    archive = make_archive()
+    body = b''.join(archive.iter_bytes())
+    assert len(body) == archive.size
+
+    if fmt == 'tar':
+        with tarfile.open(fileobj=io.BytesIO(body)) as tar:
+            contents = {member.name: tar.extractfile(member).read() for member in tar.getmembers()}
+    else:
+        with zipfile.ZipFile(io.BytesIO(body)) as archive_file:
+            assert archive_file.testzip() is None  # 校验每个成员的CRC
+            contents = {name: archive_file.read(name) for name in archive_file.namelist()}
+
+    manifest = json.loads(contents.pop('scan_job-1/manifest.json'))
+    assert contents == {f"scan_job-1/photos/{name}": data for name, data in photos.items()}
+    assert manifest['job_id'] == 'job-1'
+    assert [photo['file'] for photo in manifest['photos']] == [f"photos/{name}" for name in sorted(photos)]
+    assert manifest['stage3'] == [{'angle_number': 1, 'angle': 10.0, 'source': 'capture',
+                                   'file': 'photos/angle_1.jpg'}]
+
+
+@pytest.mark.parametrize('fmt', ['tar', 'zip'])
+def test_ranges_match_the_full_body(tmp_path, fmt):
+    make_archive, _ = build(tmp_path, fmt)
+    full = b''.join(make_archive().iter_bytes())
+    size = len(full)
+    for start, end in [(0, 1), (0, 512), (100, 2000), (1500, size), (size - 30, size), (size // 2, size // 2 + 1)]:
+        # 每次用新的归档对象，ZIP的CRC只能在读取文件时现算（从中间续传的情况）
+        assert b''.join(make_archive().iter_bytes(start, end)) == full[start:end], (start, end)
+
+
+@pytest.fixture
+def exported(app_module, tmp_path):
+    rig = app_module.rigs.default
+    job, index, photos = make_job(tmp_path, job_id='archive-test')
+    rig.scan_jobs.jobs[job.job_id] = job
+    for entry in index.entries():
+        rig.scan_jobs.photo_index.add(entry.angle, entry.photo_name, entry.path, scan_id=job.job_id,
+                                      kind=entry.kind)
+    yield f"/api/jobs/{job.job_id}/archive"
+    rig.scan_jobs.jobs.pop(job.job_id, None)
+
+
+@pytest.mark.parametrize('fmt', ['tar', 'zip'])
+def test_http_range_requests(client, exported, fmt):
+    url = f"{exported}?format={fmt}"
+    full = client.get(url)
+    assert full.status_code == 200
+    body = full.data
+    size = len(body)
+    etag = full.headers['ETag'].strip('"')
+
+    partial = client.get(url, headers={'Range': 'bytes=100-2099'})
+    assert partial.status_code == 206
+    assert partial.data == body[100:2100]
+    assert partial.headers['Content-Range'] == f"bytes 100-2099/{size}"
+
+    resumed = client.get(url, headers={'Range': 'bytes=2100-', 'If-Range': f'"{etag}"'})
+    assert resumed.status_code == 206
+    assert body[:2100] + resumed.data == body
+
+    # 归档已变化（ETag不一致）：返回完整归档而不是片段
+    stale = client.get(url, headers={'Range': 'bytes=2100-', 'If-Range': '"0123456789abcdef"'})
+    assert stale.status_code == 200
+    assert stale.data == body
+
+    # 不支持 multipart/byteranges：多个区间时忽略 Range
+    multi = client.get(url, headers={'Range': 'bytes=0-9,20-29'})
+    assert multi.status_code == 200
+    assert multi.data == body
+
+    # 416 的边界：最后一个字节仍可请求，从归档长度开始则越界
+    last = client.get(url, headers={'Range': f"bytes={size - 1}-"})
+    assert last.status_code == 206
+    assert last.data == body[-1:]
+    beyond = client.get(url, headers={'Range': f"bytes={size}-"})
+    assert beyond.status_code == 416
+    assert beyond.headers['Content-Range'] == f"bytes */{size}"
@@ -0,0 +1,22 @@
+#!/usr/bin/env python3
+"""
+扫描规划测试
+"""
+
+from scan_planning import fine_positions_for_intervals, fine_positions_for_ranges, plan_runs
+
+
+def test_fine_ranges_shoot_zero_degrees_from_home():
+    positions = fine_positions_for_ranges([[348, 12]], 1)
+    assert positions == [0, 1, 2, 3, 87, 88, 89]
+    # 第一段在起点原地拍照，不会转一圈回来
+    assert plan_runs(positions, 1, 0)[0] == (0, 0, [0])
+    assert fine_positions_for_ranges([[352, 360]], 1) == [0, 88, 89]
+
+
+def test_fine_intervals_wrap_to_position_zero():
+    coarse = [6, 12, 18, 24, 30, 36, 42, 48, 54, 60, 66, 72, 78, 84, 90]
+    positions = fine_positions_for_intervals(coarse, [13, 14], 2)
+    assert positions == [0, 2, 4, 6, 84, 86, 88]
+    runs = plan_runs(positions, 2, 0)
+    assert sum(transit for transit, _, _ in runs) < 84
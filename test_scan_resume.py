@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+断点续扫测试
+阶段1或阶段3中途停止的任务，重启后从检查点目录载入，继续执行时跳过已拍的照片，
+每张照片恰好上传一次，结束后任务完成且检查点被删除
+"""
+
+import json
+import os
+import time
+
+import pytest
+
+from arduino_controller import ArduinoController
+from camera_controller import CameraController
+from photo_writer import AsyncPhotoWriter
+from scan_jobs import ScanJobManager
+from simulation import SimulatedPicamera2, SimulatedSerial
+from teammate_receiver import ReceiverServer
+from teammate_sender import TeammateSender
+
+STEPS = 8
+ANGLES = [30.0, 100.0, 200.0, 300.0]
+
+
+@pytest.fixture
+def receiver(tmp_path):
+    with ReceiverServer(save_dir=str(tmp_path / 'received')) as server:
+        yield server
+
+
+def make_manager(tmp_path, receiver):
+    """一套模拟转台的任务队列；每次调用相当于一次程序启动"""
+    arduino = ArduinoController(serial_factory=SimulatedSerial.factory(motion_delay=0.001), startup_delay=0)
+    camera = CameraController(camera_factory=SimulatedPicamera2, photo_writer=AsyncPhotoWriter(),
+                              photos_dir=str(tmp_path / 'photos'))
+    teammate = TeammateSender(receiver.url, transfer_mode='raw')
+    manager = ScanJobManager(arduino, camera, teammate, {'angles': None}, retry_delay=0,
+                             checkpoint_dir=str(tmp_path / 'checkpoints'), angle_tolerance=-1)
+    return manager
+
+
+def wait_finished(job, timeout=30):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.02)
+    assert job.finished, job.to_dict()
+
+
+def read_checkpoint(tmp_path, job_id):
+    with open(tmp_path / 'checkpoints' / f"{job_id}.json", encoding='utf-8') as f:
+        return json.load(f)
+
+
+def received_photos(receiver):
+    return receiver.app.test_client().get('/api/stats').get_json()['photos']
+
+
+def resume_after_restart(tmp_path, receiver, job_id):
+    """重新启动（新的任务队列载入检查点目录），送来角度后继续执行"""
+    manager = make_manager(tmp_path, receiver)
+    job = manager.get(job_id)
+    assert job is not None
+    manager.angle_state['angles'] = ANGLES
+    assert manager.resume(job_id) is job
+    wait_finished(job)
+    return manager, job
+
+
+def test_resume_after_cancel_in_stage1(tmp_path, receiver):
+    manager = make_manager(tmp_path, receiver)
+    original = manager._capture_rotation
+    captured = []
+
+    def capture_then_cancel(job, position, kind, progress):
+        original(job, position, kind, progress)
+        captured.append(position)
+        if len(captured) == 3:
+            manager.cancel(job.job_id)
+
+    manager._capture_rotation = capture_then_cancel
+    job = manager.submit({'steps': STEPS})
+    wait_finished(job)
+    assert job.status == 'cancelled'
+    manager.teammate.flush_uploads()
+
+    saved = read_checkpoint(tmp_path, job.job_id)
+    assert saved['status'] == 'cancelled'
+    assert saved['checkpoint']['stage1_completed'] == 3
+    assert not saved['checkpoint']['stage1_done']
+    first_photos = sorted(saved['checkpoint']['uploads'])
+    assert len(first_photos) == 3 and all(saved['checkpoint']['uploads'].values())
+    assert received_photos(receiver) == 3
+
+    manager, job = resume_after_restart(tmp_path, receiver, job.job_id)
+    assert job.status == 'completed', job.error
+    assert job.result['resumes'] == 1
+    assert job.result['stage1']['captures'] == STEPS
+    uploads = job.checkpoint['uploads']
+    assert set(first_photos) < set(uploads)
+    assert len(uploads) == STEPS + len(ANGLES) and all(uploads.values())
+    # 已拍的3张没有重拍重传
+    assert received_photos(receiver) == STEPS + len(ANGLES)
+    assert sorted(os.listdir(tmp_path / 'received')) == sorted(uploads)
+    assert not os.path.exists(tmp_path / 'checkpoints' / f"{job.job_id}.json")
+
+
+def test_resume_after_crash_in_stage3(tmp_path, receiver):
+    manager = make_manager(tmp_path, receiver)
+    manager.angle_state['angles'] = ANGLES
+    original = manager._rotate_to_angle
+    rotations = []
+
+    def crash_on_third(angle, angle_number):
+        rotations.append(angle_number)
+        if len(rotations) == 3:
+            raise RuntimeError('模拟程序崩溃')
+        original(angle, angle_number)
+
+    manager._rotate_to_angle = crash_on_third
+    job = manager.submit({'steps': STEPS})
+    wait_finished(job)
+    assert job.status == 'failed'
+    manager.teammate.flush_uploads()
+
+    saved = read_checkpoint(tmp_path, job.job_id)['checkpoint']
+    assert saved['stage1_done'] and saved['stage1_completed'] == STEPS
+    assert saved['stage3_completed'] == 2
+    order = saved['stage3_plan']['order']
+    done = [f"angle_{i + 1}.jpg" for i in order[:2]]
+    assert [photo['photo'] for photo in saved['stage3_photos'] if photo] == sorted(done)
+    assert received_photos(receiver) == STEPS + 2
+
+    manager, job = resume_after_restart(tmp_path, receiver, job.job_id)
+    assert job.status == 'completed', job.error
+    stage3 = job.result['stage3']
+    assert [photo['photo'] for photo in stage3['photos']] == [f"angle_{n}.jpg" for n in range(1, len(ANGLES) + 1)]
+    assert stage3['order'] == [i + 1 for i in order]
+    # 阶段1没有重做，阶段3只补拍剩下的2个角度
+    assert received_photos(receiver) == STEPS + len(ANGLES)
+    assert len(job.checkpoint['uploads']) == STEPS + len(ANGLES)
+    assert not os.path.exists(tmp_path / 'checkpoints' / f"{job.job_id}.json")
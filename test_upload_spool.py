@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+上传待发队列测试
+队友离线时记录留在队列中并按指数退避重发；队友恢复后每条记录恰好送达一次并被删除；
+进程重启后遗留的记录继续重发
+"""
+
+import socket
+import sqlite3
+import threading
+import time
+
+from teammate_receiver import ReceiverServer
+from teammate_sender import TeammateSender
+from upload_spool import UploadSpool
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if condition():
+            return True
+        time.sleep(0.01)
+    return condition()
+
+
+def rows(path):
+    """用另一个连接读取数据库中的记录 (id, attempts, next_attempt_at)"""
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute('SELECT id, attempts, next_attempt_at FROM spool ORDER BY id').fetchall()
+    finally:
+        conn.close()
+
+
+class FlakyReceiver:
+    """可切换在线/离线的投递函数，记录每条记录的投递时间和成功次数"""
+
+    def __init__(self, online=False):
+        self.online = online
+        self.attempts = []
+        self.delivered = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, entry):
+        with self._lock:
+            self.attempts.append(time.time())
+            if self.online:
+                self.delivered[entry.id] = self.delivered.get(entry.id, 0) + 1
+            return self.online
+
+
+def test_entry_stays_spooled_with_growing_backoff_then_delivers_once(tmp_path):
+    path = str(tmp_path / 'uploads.db')
+    spool = UploadSpool(path, base_backoff=0.05, max_backoff=5.0)
+    receiver = FlakyReceiver(online=False)
+    entry_id = spool.put('photo', {'rotation_number': 1, 'filename': 'rotation_001.jpg'}, b'jpeg')
+    spool.start(receiver)
+    try:
+        snapshots = []
+        for attempts in (1, 2, 3, 4):
+            assert wait_until(lambda: rows(path) and rows(path)[0][1] >= attempts)
+            snapshots.append(rows(path)[0])
+        assert [row[0] for row in snapshots] == [entry_id] * 4
+        assert [row[1] for row in snapshots] == [1, 2, 3, 4]
+        next_attempts = [row[2] for row in snapshots]
+        assert next_attempts == sorted(next_attempts) and len(set(next_attempts)) == 4
+        # 两次尝试之间的间隔按指数增长（带 ±25% 抖动，相邻两级不重叠）
+        gaps = [b - a for a, b in zip(receiver.attempts, receiver.attempts[1:4])]
+        assert gaps[0] < gaps[1] < gaps[2]
+        assert spool.pending_count() == 1
+        assert receiver.delivered == {}
+
+        receiver.online = True
+        spool.retry_now()
+        assert wait_until(lambda: spool.pending_count() == 0)
+        time.sleep(0.2)  # 送达后不应再次发送
+        assert receiver.delivered == {entry_id: 1}
+        assert rows(path) == []
+        assert spool.stats()['delivered'] == 1
+    finally:
+        spool.close()
+
+
+def test_restart_resends_leftover_entries(tmp_path):
+    path = str(tmp_path / 'uploads.db')
+    spool = UploadSpool(path, base_backoff=0.05)
+    ids = [spool.put('photo', {'rotation_number': i}, bytes([i]) * 10) for i in range(3)]
+    ids.append(spool.put('status', {'status': 'completed'}))
+    spool.mark_failed(ids[0], 'offline')  # 上次运行中已失败过一次，退避尚未结束
+    spool.close()
+
+    restarted = UploadSpool(path, base_backoff=0.05)
+    received = []
+    try:
+        def deliver(entry):
+            received.append((entry.id, entry.kind, entry.metadata, entry.payload))
+            return True
+
+        restarted.start(deliver)
+        assert wait_until(lambda: restarted.pending_count() == 0)
+        time.sleep(0.1)
+        assert [item[0] for item in received] == ids
+        assert received[1] == (ids[1], 'photo', {'rotation_number': 1}, bytes([1]) * 10)
+        assert received[3][1:] == ('status', {'status': 'completed'}, None)
+    finally:
+        restarted.close()
+
+
+def test_sender_spools_while_teammate_is_down(tmp_path):
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+    spool = UploadSpool(str(tmp_path / 'uploads.db'), base_backoff=0.05, max_backoff=0.2)
+    sender = TeammateSender(f"http://127.0.0.1:{port}", max_retries=0, transfer_mode='raw', spool=spool)
+    try:
+        sender.enqueue_photo(b'jpeg bytes', rotation_number=7, filename='rotation_007.jpg')
+        report = sender.flush_uploads(timeout=10)
+        assert report['spooled'] == 1
+        assert spool.pending_count() == 1
+
+        with ReceiverServer(port=port, save_dir=str(tmp_path / 'received')) as receiver:
+            spool.retry_now()
+            assert wait_until(lambda: spool.pending_count() == 0)
+            time.sleep(0.3)
+            stats = receiver.app.test_client().get('/api/stats').get_json()
+        assert stats['photos'] == 1
+        assert (tmp_path / 'received' / 'rotation_007.jpg').read_bytes() == b'jpeg bytes'
+    finally:
+        sender.shutdown_uploads()
+        spool.close()
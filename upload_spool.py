@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+上传待发队列模块
+发送失败的照片和状态消息持久化到SQLite，后台线程按指数退避重发，进程重启后自动继续
+"""
+
+import json
+import logging
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# 一条待发记录；kind 为 'photo' 或 'status'，payload 为照片JPEG字节（状态消息为 None）
+SpoolEntry = namedtuple('SpoolEntry', ['id', 'kind', 'metadata', 'payload', 'attempts', 'created_at'])
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS spool (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    payload BLOB,
+    created_at REAL NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+)
+"""
+
+
+class UploadSpool:
+    """基于SQLite的持久化待发队列
+
+    put() 在事务提交后返回，断电也不会丢失；送达后记录被删除。
+    队友离线期间（最近一次发送失败后的退避时间内）backing_off() 为 True，
+    调用方可以直接入队而不必先尝试网络请求。
+    """
+
+    def __init__(self, path='spool/uploads.db', base_backoff=1.0, max_backoff=300.0, batch_size=20):
+        self.path = path
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.batch_size = batch_size
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._metrics_scope = metrics.bind_current_scope()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.execute(_SCHEMA)
+        # 全局退避：连续失败次数和下次允许发送的时间
+        self._failures = 0
+        self._offline_until = 0.0
+        self.delivered = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---- 存储 ----
+
+    def put(self, kind, metadata, payload=None, error=None):
+        """写入一条待发记录，返回记录ID"""
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                'INSERT INTO spool (kind, metadata, payload, created_at, next_attempt_at, last_error) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (kind, json.dumps(metadata, ensure_ascii=False), payload, now,
+                 max(now, self._offline_until), error))
+        metrics.inc('spooled_total')
+        self._wake.set()
+        return cursor.lastrowid
+
+    def due(self, limit=None):
+        """到期可以重发的记录，按写入顺序"""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id, kind, metadata, payload, attempts, created_at FROM spool '
+                'WHERE next_attempt_at <= ? ORDER BY id LIMIT ?',
+                (time.time(), limit or self.batch_size)).fetchall()
+        return [SpoolEntry(row[0], row[1], json.loads(row[2]), row[3], row[4], row[5]) for row in rows]
+
+    def mark_delivered(self, entry_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM spool WHERE id = ?', (entry_id,))
+            self.delivered += 1
+        metrics.inc('spool_delivered_total')
+
+    def mark_failed(self, entry_id, error=None):
+        """记录一次重发失败，按该记录的失败次数推迟下次重发"""
+        with self._lock:
+            row = self._conn.execute('SELECT attempts FROM spool WHERE id = ?', (entry_id,)).fetchone()
+            if row is None:
+                return
+            attempts = row[0] + 1
+            self._conn.execute(
+                'UPDATE spool SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE id = ?',
+                (attempts, time.time() + self._backoff(attempts), error, entry_id))
+
+    def pending_count(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM spool').fetchone()[0]
+
+    def _backoff(self, attempts):
+        """指数退避，带 ±25% 随机抖动"""
+        delay = min(self.max_backoff, self.base_backoff * (2 ** max(0, attempts - 1)))
+        return delay * random.uniform(0.75, 1.25)
+
+    # ---- 全局退避 ----
+
+    def record_failure(self):
+        """一次发送失败：进入退避，期间新的上传直接入队"""
+        with self._lock:
+            self._failures += 1
+            self._offline_until = time.time() + self._backoff(self._failures)
+
+    def record_success(self):
+        """一次发送成功：退出退避，并唤醒后台线程尽快重发积压的记录"""
+        with self._lock:
+            was_backing_off = self._failures > 0
+            self._failures = 0
+            self._offline_until = 0.0
+        if was_backing_off:
+            self._wake.set()
+
+    def backing_off(self):
+        return time.time() < self._offline_until
+
+    # ---- 后台重发 ----
+
+    def start(self, deliver):
+        """启动后台重发线程；deliver(entry) 返回是否送达"""
+        if self._thread is not None:
+            return
+        # 进程重启后立即重试上次遗留的记录
+        self.retry_now()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._drain_loop, args=(deliver,),
+                                        name="upload-spool", daemon=True)
+        self._thread.start()
+        pending = self.pending_count()
+        if pending:
+            logger.info(f"待发队列中有{pending}条遗留记录，开始重发")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def retry_now(self):
+        """清除退避，所有记录立即重发"""
+        with self._lock:
+            self._conn.execute('UPDATE spool SET next_attempt_at = ?', (time.time(),))
+            self._failures = 0
+            self._offline_until = 0.0
+        self._wake.set()
+
+    def _drain_loop(self, deliver):
+        with self._metrics_scope:
+            while not self._stop.is_set():
+                entries = [] if self.backing_off() else self.due()
+                for entry in entries:
+                    if self._stop.is_set():
+                        break
+                    try:
+                        delivered = deliver(entry)
+                        error = None if delivered else '发送失败'
+                    except Exception as e:
+                        delivered, error = False, str(e)
+                    if delivered:
+                        self.mark_delivered(entry.id)
+                        self.record_success()
+                    else:
+                        # 队友多半仍然离线，本轮不再继续尝试
+                        self.mark_failed(entry.id, error)
+                        self.record_failure()
+                        break
+                if entries and not self.backing_off():
+                    continue  # 可能还有到期的记录
+                self._wake.wait(self._next_wait())
+                self._wake.clear()
+
+    def _next_wait(self):
+        """到下一条记录到期或退避结束的秒数"""
+        with self._lock:
+            row = self._conn.execute('SELECT MIN(next_attempt_at) FROM spool').fetchone()
+        wake_at = max(row[0] or time.time() + self.max_backoff, self._offline_until)
+        return min(self.max_backoff, max(0.05, wake_at - time.time()))
+
+    def stats(self):
+        with self._lock:
+            pending, oldest, max_attempts = self._conn.execute(
+                'SELECT COUNT(*), MIN(created_at), MAX(attempts) FROM spool').fetchone()
+            by_kind = dict(self._conn.execute('SELECT kind, COUNT(*) FROM spool GROUP BY kind').fetchall())
+        return {
+            'path': self.path,
+            'pending': pending,
+            'pending_by_kind': by_kind,
+            'oldest_age_seconds': round(time.time() - oldest, 1) if oldest else None,
+            'max_attempts': max_attempts or 0,
+            'delivered': self.delivered,
+            'backing_off': self.backing_off(),
+            'retry_in_seconds': round(max(0.0, self._offline_until - time.time()), 1)
+        }
+
+    def close(self):
+        self.stop()
+        with self._lock:
+            self._conn.close()